@@ -0,0 +1,77 @@
+'''Benchmark of the fixed overhead of an acquisition on a small ROI.
+
+Agents acquire a small ROI at every action step, such that the cost of an
+acquisition is dominated by its setup instead of the raster kernel. The ROI is
+acquired without emitters, where the kernel skips every pixel, and the mean time
+of a call of ``get_signal_and_bleach`` is compared to a target.
+
+.. code-block:: bash
+
+    python benchmarks/call_overhead.py --roi 32 --target 750
+'''
+
+import argparse
+import time
+
+import numpy
+
+from pysted import base
+
+parser = argparse.ArgumentParser(description="Fixed overhead of get_signal_and_bleach on a small ROI.")
+parser.add_argument("--roi", type=int, default=32,
+                    help="size of the (square) ROI that is scanned")
+parser.add_argument("--pixelsize", type=float, default=20e-9,
+                    help="pixelsize (in m) of the datamap")
+parser.add_argument("--calls", type=int, default=200,
+                    help="number of calls per repetition")
+parser.add_argument("--repeats", type=int, default=5,
+                    help="number of repetitions, the best mean time is kept")
+parser.add_argument("--target", type=float, default=750.,
+                    help="maximal fixed overhead (in us) of a call")
+args = parser.parse_args()
+
+egfp = {
+    "lambda_": 535e-9,
+    "qy": 0.6,
+    "sigma_abs": {488: 0.08e-21, 575: 0.02e-21},
+    "sigma_ste": {575: 3.0e-22},
+    "tau": 3e-09,
+    "tau_vib": 1.0e-12,
+    "tau_tri": 1.2e-6,
+    "k1": 1.3e-15,
+    "b": 1.4,
+}
+laser_ex = base.GaussianBeam(488e-9)
+laser_sted = base.DonutBeam(575e-9, zero_residual=0, anti_stoke=False)
+detector = base.Detector(noise=True)
+objective = base.Objective()
+fluo = base.Fluorescence(**egfp)
+microscope = base.Microscope(laser_ex, laser_sted, detector, objective, fluo)
+i_ex, _, _ = microscope.cache(args.pixelsize)
+
+
+def best_time(molecules, calls):
+    '''Best mean time (s) of *calls* calls on the datamap of *molecules*.
+    '''
+    datamap = base.Datamap(molecules, args.pixelsize)
+    datamap.set_roi(i_ex, "max")
+    # The first call computes the bank of the imaging parameters
+    microscope.get_signal_and_bleach(datamap, args.pixelsize, 10e-6, 10e-6, 50e-3, seed=42, update=False)
+    best = numpy.inf
+    for _ in range(args.repeats):
+        start_time = time.perf_counter()
+        for _ in range(calls):
+            microscope.get_signal_and_bleach(datamap, args.pixelsize, 10e-6, 10e-6, 50e-3, seed=42, update=False)
+        best = min(best, (time.perf_counter() - start_time) / calls)
+    return best
+
+
+random_state = numpy.random.RandomState(42)
+overhead = best_time(numpy.zeros((args.roi, args.roi), dtype=numpy.int64), args.calls)
+acquisition = best_time(random_state.poisson(5, size=(args.roi, args.roi)), max(1, args.calls // 50))
+print(f"Footprint of the laser: {i_ex.shape}")
+print(f"{'ROI':>10} {'overhead (us)':>15} {'with emitters (us)':>20}")
+print(f"{args.roi:>10} {overhead * 1e6:>15.1f} {acquisition * 1e6:>20.1f}")
+
+assert overhead * 1e6 <= args.target, \
+    f"The fixed overhead of {overhead * 1e6:.1f} us exceeds the target of {args.target:.1f} us"
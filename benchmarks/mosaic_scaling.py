@@ -0,0 +1,65 @@
+'''Benchmark of the scaling of a mosaic acquisition with the number of processes.
+
+A sample larger than a field of view is acquired as a mosaic of tiles (see
+:mod:`pysted.mosaic`) with pools of an increasing number of processes. The
+mosaic does not depend on the number of processes for a fixed seed, which is
+verified, and its time should decrease with the number of cores of the node.
+
+.. code-block:: bash
+
+    python benchmarks/mosaic_scaling.py --size 1024 --tile 256 --workers 1 2 4 8
+'''
+
+import argparse
+import time
+
+import numpy
+
+from pysted import base, mosaic
+
+parser = argparse.ArgumentParser(description="Time of a mosaic acquisition for pools of processes of increasing size.")
+parser.add_argument("--size", type=int, default=1024,
+                    help="size of the (square) sample")
+parser.add_argument("--tile", type=int, default=256,
+                    help="size of the (square) tiles of the mosaic")
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                    help="numbers of processes of the pool")
+parser.add_argument("--pixelsize", type=float, default=20e-9,
+                    help="pixelsize (in m) of the datamap")
+args = parser.parse_args()
+
+egfp = {
+    "lambda_": 535e-9,
+    "qy": 0.6,
+    "sigma_abs": {488: 0.08e-21, 575: 0.02e-21},
+    "sigma_ste": {575: 3.0e-22},
+    "tau": 3e-09,
+    "tau_vib": 1.0e-12,
+    "tau_tri": 1.2e-6,
+    "k1": 1.3e-15,
+    "b": 1.4,
+}
+laser_ex = base.GaussianBeam(488e-9)
+laser_sted = base.DonutBeam(575e-9, zero_residual=0, anti_stoke=False)
+detector = base.Detector(noise=True)
+objective = base.Objective()
+fluo = base.Fluorescence(**egfp)
+microscope = base.Microscope(laser_ex, laser_sted, detector, objective, fluo)
+i_ex, _, _ = microscope.cache(args.pixelsize)
+
+if __name__ == "__main__":
+    molecules = numpy.random.RandomState(42).poisson(0.5, size=(args.size, args.size))
+    print(f"Footprint of the laser: {i_ex.shape}")
+    print(f"{'workers':>10} {'mosaic (s)':>12} {'speedup':>10}")
+    reference = None
+    for workers in args.workers:
+        datamap = base.Datamap(molecules, args.pixelsize, virtual_padding=True)
+        datamap.set_roi(i_ex, "max")
+        start_time = time.perf_counter()
+        photons, _ = mosaic.acquire_mosaic(microscope, datamap, args.pixelsize, 10e-6, 10e-6, 50e-3,
+                                           tile_size=args.tile, max_workers=workers, seed=42)
+        elapsed = time.perf_counter() - start_time
+        if reference is None:
+            reference = (elapsed, photons)
+        assert numpy.array_equal(photons, reference[1]), "The mosaic depends on the number of processes"
+        print(f"{workers:>10} {elapsed:>12.2f} {reference[0] / elapsed:>10.2f}")
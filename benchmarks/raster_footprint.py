@@ -0,0 +1,66 @@
+'''Benchmark of the per-pixel cost of the raster kernels as the datamap grows.
+
+The same 32x32 ROI is acquired in datamaps of increasing size. Since the raster
+kernels only read the laser footprint around every scanned pixel, the scan time
+should stay flat as the padded datamap grows.
+
+.. code-block:: bash
+
+    python benchmarks/raster_footprint.py --sizes 128 256 512 1024
+'''
+
+import argparse
+import time
+
+import numpy
+
+from pysted import base
+
+parser = argparse.ArgumentParser(description="Scan time of a fixed ROI in datamaps of increasing size.")
+parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512, 1024],
+                    help="sizes of the (square) datamaps")
+parser.add_argument("--roi", type=int, default=32,
+                    help="size of the (square) ROI that is scanned")
+parser.add_argument("--pixelsize", type=float, default=20e-9,
+                    help="pixelsize (in m) of the datamap")
+parser.add_argument("--repeats", type=int, default=3,
+                    help="number of repetitions, the best time is kept")
+args = parser.parse_args()
+
+egfp = {
+    "lambda_": 535e-9,
+    "qy": 0.6,
+    "sigma_abs": {488: 0.08e-21, 575: 0.02e-21},
+    "sigma_ste": {575: 3.0e-22},
+    "tau": 3e-09,
+    "tau_vib": 1.0e-12,
+    "tau_tri": 1.2e-6,
+    "k1": 1.3e-15,
+    "b": 1.4,
+}
+laser_ex = base.GaussianBeam(488e-9)
+laser_sted = base.DonutBeam(575e-9, zero_residual=0, anti_stoke=False)
+detector = base.Detector(noise=True)
+objective = base.Objective()
+fluo = base.Fluorescence(**egfp)
+microscope = base.Microscope(laser_ex, laser_sted, detector, objective, fluo)
+i_ex, _, _ = microscope.cache(args.pixelsize)
+
+random_state = numpy.random.RandomState(42)
+print(f"Footprint of the laser: {i_ex.shape}")
+print(f"{'datamap':>10} {'scan (s)':>10} {'per pixel (us)':>15}")
+for size in args.sizes:
+    molecules = random_state.poisson(5, size=(size, size))
+
+    # ROI centered in the datamap
+    start = size // 2 - args.roi // 2
+    intervals = {"rows": [start, start + args.roi - 1], "cols": [start, start + args.roi - 1]}
+
+    best = numpy.inf
+    for _ in range(args.repeats):
+        datamap = base.Datamap(molecules, args.pixelsize)
+        datamap.set_roi(i_ex, intervals)
+        start_time = time.perf_counter()
+        microscope.get_signal_and_bleach(datamap, args.pixelsize, 10e-6, 10e-6, 50e-3, seed=42, update=False)
+        best = min(best, time.perf_counter() - start_time)
+    print(f"{size:>10} {best:>10.4f} {best / args.roi ** 2 * 1e6:>15.2f}")
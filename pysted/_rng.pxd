@@ -0,0 +1,162 @@
+'''Scalar random variates for the Cython kernels.
+
+The variates are drawn from a ``RNG`` state owned by the caller (the splitmix64
+generator), such that they can be sampled inside the kernels without calling
+into the interpreter and that concurrent acquisitions in different threads do
+not share, nor lock, a global generator. The algorithms of the variates are the
+ones used by numpy.
+'''
+
+from libc.math cimport exp, log, sqrt, floor, fabs, lgamma, cos
+from libc.stdint cimport uint64_t
+
+
+cdef struct RNG:
+    uint64_t state
+
+
+cdef inline void seed_rng(RNG *rng, uint64_t seed) noexcept nogil:
+    '''Seed a generator.
+    '''
+    rng.state = seed
+
+
+cdef inline uint64_t mix64(uint64_t z) noexcept nogil:
+    '''Scramble the bits of an integer (finalizer of splitmix64).
+    '''
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL
+    return z ^ (z >> 31)
+
+
+cdef inline void seed_stream(RNG *rng, uint64_t seed, uint64_t stream) noexcept nogil:
+    '''Seed a generator of an independent stream of a seed.
+
+    The streams start at scrambled positions of the period of the generator
+    such that the streams of a seed do not overlap in practice.
+    '''
+    rng.state = mix64(mix64(seed) + mix64(stream + 1))
+
+
+cdef inline uint64_t next_uint64(RNG *rng) noexcept nogil:
+    '''Sample a uniform 64 bits integer (splitmix64 of Steele et al. (2014)).
+    '''
+    rng.state += 0x9E3779B97F4A7C15ULL
+    return mix64(rng.state)
+
+
+cdef inline double uniform(RNG *rng) noexcept nogil:
+    '''Sample a uniform variate in [0, 1).
+    '''
+    return (next_uint64(rng) >> 11) * (1.0 / 9007199254740992.0)
+
+
+cdef inline double gaussian(RNG *rng) noexcept nogil:
+    '''Sample a standard normal variate (Box-Muller transform).
+    '''
+    cdef double u = 1.0 - uniform(rng)
+    return sqrt(-2.0 * log(u)) * cos(6.283185307179586 * uniform(rng))
+
+
+cdef inline long long poisson(RNG *rng, double lam) noexcept nogil:
+    '''Sample a Poisson variate of mean *lam*.
+
+    Small means are sampled by multiplication of uniform variates and large
+    means with the transformed rejection of Hörmann (1993).
+    '''
+    cdef long long k
+    cdef double enlam, prod
+    cdef double slam, loglam, a, b, invalpha, vr, us, u, v
+
+    if lam <= 0:
+        return 0
+    if lam < 10:
+        enlam = exp(-lam)
+        k = 0
+        prod = uniform(rng)
+        while prod > enlam:
+            k += 1
+            prod *= uniform(rng)
+        return k
+
+    slam = sqrt(lam)
+    loglam = log(lam)
+    b = 0.931 + 2.53 * slam
+    a = -0.059 + 0.02483 * b
+    invalpha = 1.1239 + 1.1328 / (b - 3.4)
+    vr = 0.9277 - 3.6224 / (b - 2)
+    while True:
+        u = uniform(rng) - 0.5
+        v = uniform(rng)
+        us = 0.5 - fabs(u)
+        k = <long long>floor((2 * a / us + b) * u + lam + 0.43)
+        if (us >= 0.07) and (v <= vr):
+            return k
+        if (k < 0) or ((us < 0.013) and (v > us)):
+            continue
+        if (log(v) + log(invalpha) - log(a / (us * us) + b)) <= (-lam + k * loglam - lgamma(k + 1)):
+            return k
+
+
+cdef inline long long binomial(RNG *rng, long long n, double p) noexcept nogil:
+    '''Sample a binomial variate of *n* trials with probability *p*.
+
+    Small expectations are sampled by inversion and large expectations with the
+    transformed rejection of Hörmann (1993) (BTRS) such that the expected time
+    does not depend on the number of trials.
+    '''
+    cdef double q, qn, np, px, u, v, us, bound
+    cdef double spq, a, b, c, alpha, vr, lpq, h
+    cdef long long x, m
+    cdef bint flipped = p > 0.5
+
+    if (n <= 0) or (p <= 0):
+        return 0
+    if p >= 1:
+        return n
+    if flipped:
+        p = 1 - p
+    q = 1 - p
+    np = n * p
+
+    if np < 10:
+        qn = exp(n * log(q))
+        bound = n if n < np + 10 * sqrt(np * q + 1) else np + 10 * sqrt(np * q + 1)
+        x = 0
+        px = qn
+        u = uniform(rng)
+        while u > px:
+            x += 1
+            if x > bound:
+                x = 0
+                px = qn
+                u = uniform(rng)
+            else:
+                u -= px
+                px = ((n - x + 1) * p * px) / (x * q)
+    else:
+        spq = sqrt(np * q)
+        b = 1.15 + 2.53 * spq
+        a = -0.0873 + 0.0248 * b + 0.01 * p
+        c = np + 0.5
+        alpha = (2.83 + 5.1 / b) * spq
+        vr = 0.92 - 4.2 / b
+        lpq = log(p / q)
+        m = <long long>floor((n + 1) * p)
+        h = lgamma(m + 1.0) + lgamma(n - m + 1.0)
+        while True:
+            u = uniform(rng) - 0.5
+            v = uniform(rng)
+            us = 0.5 - fabs(u)
+            x = <long long>floor((2 * a / us + b) * u + c)
+            if (x < 0) or (x > n):
+                continue
+            if (us >= 0.07) and (v <= vr):
+                break
+            v = log(v * alpha / (a / (us * us) + b))
+            if v <= h - lgamma(x + 1.0) - lgamma(n - x + 1.0) + (x - m) * lpq:
+                break
+
+    if flipped:
+        return n - x
+    return x
@@ -0,0 +1,358 @@
+'''This module implements the bank of the imaging parameters of an acquisition.
+
+When the excitation power, the STED power or the pixel dwell time vary through
+the imaged ROI, the effective PSF and the photobleaching rates depend on the
+scanned pixel. Since these parameters are typically chosen from a small set of
+values (e.g. the discrete actions of an agent), the effective PSF and the
+photobleaching rates are computed once for every unique (p_ex, p_sted, pdt)
+triple and stacked in 3D arrays that are indexed while scanning.
+
+For continuous parameters, a regular grid spanning the parameters of the ROI is
+used instead and the arrays are linearly interpolated between the nodes of the
+grid. The interpolated arrays of the unique triples are stored as in the exact
+mode when they are few, otherwise the raster kernels interpolate the nodes of
+the grid at every pixel (see :meth:`ParameterBank.get_corners`).
+
+The arrays are computed on the window of the largest of the excitation, STED and
+detection PSFs (see :func:`pysted.utils.resize`), which is mostly zeros for the
+effective PSF of a confocal acquisition. A compact window holding a fraction of
+the energy of the arrays can be found at construction with ``energy``, such that
+the raster kernels only visit the pixels of this window.
+
+.. code-block:: python
+
+    bank = ParameterBank(microscope, datamap.pixelsize, p_ex, p_sted, pdt)
+    effective, k_ex, k_sted, prob_ex, prob_sted = bank.get(row, col)
+'''
+
+import itertools
+import warnings
+
+import numpy
+
+
+class ParameterBank:
+    '''Bank of the effective PSF and photobleaching rates of the imaging
+    parameters of an acquisition.
+
+    In the exact mode (``grid_size=None``), the arrays are computed for every
+    unique (p_ex, p_sted, pdt) triple of the ROI.
+
+    In the interpolation mode, every varying parameter is sampled with
+    ``grid_size`` regularly spaced nodes between its minimum and maximum
+    value and the arrays are multilinearly interpolated from the nodes of the
+    grid. Within a cell of width :math:`\\Delta`, the error of the linear
+    interpolation of a function :math:`f` is bounded by
+    :math:`\\Delta^2 \\max|f''| / 8` along every dimension, which is attained at
+    the middle of the cell for a quadratic function. The deviation between
+    the interpolated and the exact arrays at the middle of every cell of the
+    grid is measured at construction and stored in :attr:`error` relative to
+    the maximum of the exact arrays. As in the exact mode, the interpolated
+    arrays of the unique triples of the ROI are stored when there are at most
+    ``max_unique`` of them.
+
+    :param microscope: A :class:`~pysted.base.Microscope` object.
+    :param datamap_pixelsize: The size of a pixel of the datamap (m).
+    :param p_ex: The excitation power, a float or a 2D array of the shape of the ROI (W).
+    :param p_sted: The STED power, a float or a 2D array of the shape of the ROI (W).
+    :param pdt: The pixel dwell time, a float or a 2D array of the shape of the ROI (s).
+    :param grid_size: The number of nodes per varying parameter of the
+                      interpolation grid. ``None`` to compute the exact arrays
+                      of the unique parameters.
+    :param max_unique: The maximal number of unique triples whose arrays are
+                       stored. Over this number, the arrays are computed (or
+                       interpolated) when requested instead of being stored.
+    :param energy: The fraction of the energy of the effective PSFs and of the
+                   photobleaching rates kept in the compact :attr:`window` of
+                   the stored arrays. ``None`` to keep the whole arrays.
+
+    With ``energy``, :attr:`window` is the smallest
+    ``(row_start, row_stop, col_start, col_stop)`` window containing the largest
+    values of every stored array that sum to the fraction ``energy`` of the
+    array. It is the whole arrays otherwise. The fraction of the energy outside
+    the window, which is the relative error of the intensity of a uniform
+    sample, is stored in :attr:`trim_error` for the effective PSFs and the
+    photobleaching rates. In the interpolation mode, the window of the arrays
+    which are not stored is the one of the arrays of the nodes of the grid. As
+    the interpolated arrays are weighted sums of the nonnegative arrays of the
+    nodes, their fraction of the energy outside the window is at most
+    :attr:`trim_error`. The arrays of the exact mode which are not stored are
+    not trimmed.
+    '''
+    def __init__(self, microscope, datamap_pixelsize, p_ex, p_sted, pdt, grid_size=None, max_unique=256,
+                 energy=None):
+        self.microscope = microscope
+        self.datamap_pixelsize = datamap_pixelsize
+        self.grid_size = grid_size
+        self.max_unique = max_unique
+        self.energy = energy
+
+        p_ex, p_sted, pdt = numpy.broadcast_arrays(*(numpy.atleast_2d(numpy.asarray(param, dtype=numpy.float64))
+                                                     for param in (p_ex, p_sted, pdt)))
+        self.shape = p_ex.shape
+        self.is_uniform = all(numpy.all(param == param.flat[0]) for param in (p_ex, p_sted, pdt))
+        self.error = {"effective" : 0., "k_sted" : 0.}
+        self.trim_error = {"effective" : 0., "k_sted" : 0.}
+        self.is_stored = False
+
+        if (grid_size is None) or self.is_uniform:
+            self._build_exact(p_ex, p_sted, pdt)
+        else:
+            self._build_grid(p_ex, p_sted, pdt, grid_size)
+
+        shape = microscope.cache(datamap_pixelsize)[0].shape
+        self.window = (0, shape[0], 0, shape[1])
+        if energy is not None:
+            if self.is_stored:
+                self.window, self.trim_error = self._trim(energy, self.effectives, self.k_sted)
+            elif hasattr(self, "grid_effectives"):
+                # The interpolated arrays are weighted sums of the arrays of the nodes
+                self.window, self.trim_error = self._trim(energy, self.grid_effectives.reshape(-1, *shape),
+                                                          self.grid_k_sted.reshape(-1, *shape))
+            else:
+                warnings.warn(f"The arrays of the {len(numpy.unique(self.indices))} unique triples exceed "
+                              f"max_unique={max_unique} and are not stored, the energy={energy} is ignored. Use an "
+                              f"interpolation grid (grid_size) to trim the arrays.")
+
+    def get_bleach_rates(self, p_ex, p_sted, pdt):
+        '''Compute the photobleaching rates of the fluorophores under the laser.
+
+        :param p_ex: The excitation power (W).
+        :param p_sted: The STED power (W).
+        :param pdt: The pixel dwell time (s).
+
+        :return: A tuple of 2D arrays of the excitation and STED photobleaching rates.
+        '''
+        microscope = self.microscope
+        i_ex, i_sted, _ = microscope.cache(self.datamap_pixelsize)
+        photons_ex = microscope.fluo.get_photons(i_ex * p_ex, microscope.excitation.lambda_)
+        duty_cycle = microscope.sted.tau * microscope.sted.rate
+        photons_sted = microscope.fluo.get_photons(i_sted * p_sted * duty_cycle, microscope.sted.lambda_)
+        k_sted = microscope.fluo.get_k_bleach(microscope.excitation.lambda_, microscope.sted.lambda_,
+                                              photons_ex, photons_sted, microscope.sted.tau,
+                                              1/microscope.sted.rate, pdt,)
+        k_ex = k_sted * 0.
+        return k_ex, k_sted
+
+    def _find_triplets(self, p_ex, p_sted, pdt):
+        '''Find the unique (p_ex, p_sted, pdt) triples of the ROI and the index
+        of the triple of every pixel.
+        '''
+        # Unique values are found per parameter and combined in a single code
+        # which is much faster than looking for unique rows
+        uniques, codes = zip(*(numpy.unique(param, return_inverse=True) for param in (p_ex, p_sted, pdt)))
+        codes = [code.reshape(self.shape) for code in codes]
+        powers_code = codes[0] * len(uniques[1]) + codes[1]
+        triplets_code = powers_code * len(uniques[2]) + codes[2]
+        triplets, firsts, indices = numpy.unique(triplets_code, return_index=True, return_inverse=True)
+        self.indices = indices.reshape(self.shape)
+        return uniques, triplets, firsts
+
+    def _build_exact(self, p_ex, p_sted, pdt):
+        '''Compute the arrays of every unique (p_ex, p_sted, pdt) triple.
+        '''
+        uniques, triplets, _ = self._find_triplets(p_ex, p_sted, pdt)
+        self.p_ex, self.p_sted, self.pdt = p_ex, p_sted, pdt
+
+        self.is_stored = len(triplets) <= self.max_unique
+        if not self.is_stored:
+            return
+
+        effectives = {}
+        self.effectives, self.k_sted = [], []
+        for triplet in triplets:
+            powers, pdt_idx = divmod(triplet, len(uniques[2]))
+            ex_idx, sted_idx = divmod(powers, len(uniques[1]))
+            _p_ex, _p_sted, _pdt = uniques[0][ex_idx], uniques[1][sted_idx], uniques[2][pdt_idx]
+
+            # The effective PSF does not depend on the pixel dwell time
+            if powers not in effectives:
+                effectives[powers] = self.microscope.get_effective(self.datamap_pixelsize, _p_ex, _p_sted)
+            _, k_sted = self.get_bleach_rates(_p_ex, _p_sted, _pdt)
+            self.effectives.append(effectives[powers])
+            self.k_sted.append(k_sted)
+
+        self.effectives = numpy.stack(self.effectives)
+        self.k_sted = numpy.stack(self.k_sted)
+        pdts = uniques[2][triplets % len(uniques[2])]
+        self.prob_sted = numpy.exp(-1. * self.k_sted * pdts[:, numpy.newaxis, numpy.newaxis])
+
+        # There is no photobleaching caused by the excitation
+        self.k_ex = numpy.zeros(self.effectives.shape[1:])
+        self.prob_ex = numpy.ones(self.effectives.shape[1:])
+
+    def _trim(self, energy, effectives, k_sted):
+        '''Find the compact window of the arrays holding the fraction *energy*
+        of every array and the fraction of the energy outside of it.
+        '''
+        arrays = {"effective" : effectives, "k_sted" : k_sted}
+        bounds = []
+        for array in itertools.chain(*arrays.values()):
+            values = numpy.abs(array).ravel()
+            total = values.sum()
+            if total == 0:
+                continue
+            order = numpy.argsort(values)[::-1]
+            count = numpy.searchsorted(numpy.cumsum(values[order]), energy * total) + 1
+            rows, cols = numpy.unravel_index(order[:min(count, len(order))], array.shape)
+            bounds.append((rows.min(), rows.max() + 1, cols.min(), cols.max() + 1))
+
+        shape = effectives.shape[1:]
+        if bounds:
+            bounds = numpy.array(bounds)
+            window = (bounds[:, 0].min(), bounds[:, 1].max(), bounds[:, 2].min(), bounds[:, 3].max())
+        else:
+            # Nothing is emitted nor bleached, a single pixel is kept
+            window = (shape[0] // 2, shape[0] // 2 + 1, shape[1] // 2, shape[1] // 2 + 1)
+        window = tuple(int(bound) for bound in window)
+
+        trim_error = {}
+        for name, array in arrays.items():
+            totals = numpy.abs(array).sum(axis=(1, 2))
+            inside = numpy.abs(array[:, window[0]:window[1], window[2]:window[3]]).sum(axis=(1, 2))
+            outside = numpy.maximum(totals - inside, 0.)
+            trim_error[name] = float(numpy.max(outside / numpy.maximum(totals, numpy.finfo(float).tiny)))
+        return window, trim_error
+
+    def _build_grid(self, p_ex, p_sted, pdt, grid_size):
+        '''Compute the arrays on the nodes of the interpolation grid and the
+        interpolation weights of every pixel of the ROI.
+        '''
+        self.axes = [numpy.linspace(param.min(), param.max(), grid_size if param.min() < param.max() else 1)
+                     for param in (p_ex, p_sted, pdt)]
+        self.lower, self.weights = [], []
+        for axis, param in zip(self.axes, (p_ex, p_sted, pdt)):
+            if len(axis) == 1:
+                self.lower.append(numpy.zeros(self.shape, dtype=int))
+                self.weights.append(numpy.zeros(self.shape))
+                continue
+            lower = numpy.clip(numpy.searchsorted(axis, param, side="right") - 1, 0, len(axis) - 2)
+            self.lower.append(lower)
+            self.weights.append((param - axis[lower]) / (axis[lower + 1] - axis[lower]))
+
+        self.grid_effectives = numpy.stack([
+            numpy.stack([self.microscope.get_effective(self.datamap_pixelsize, _p_ex, _p_sted)
+                         for _p_sted in self.axes[1]])
+            for _p_ex in self.axes[0]
+        ])
+        self.grid_k_sted = numpy.stack([
+            numpy.stack([
+                numpy.stack([self.get_bleach_rates(_p_ex, _p_sted, _pdt)[1] for _pdt in self.axes[2]])
+                for _p_sted in self.axes[1]
+            ])
+            for _p_ex in self.axes[0]
+        ])
+        self.pdt = pdt
+        self.error = self._estimate_error()
+
+        # The arrays of a few unique triples are interpolated once, as they are computed in the exact mode
+        _, triplets, firsts = self._find_triplets(p_ex, p_sted, pdt)
+        self.is_stored = len(triplets) <= self.max_unique
+        if not self.is_stored:
+            return
+        arrays = [self._interpolate(*numpy.unravel_index(first, self.shape)) for first in firsts]
+        self.effectives = numpy.stack([effective for effective, _ in arrays])
+        self.k_sted = numpy.stack([k_sted for _, k_sted in arrays])
+        pdts = pdt.ravel()[firsts]
+        self.prob_sted = numpy.exp(-1. * self.k_sted * pdts[:, numpy.newaxis, numpy.newaxis])
+        self.k_ex = numpy.zeros(self.effectives.shape[1:])
+        self.prob_ex = numpy.ones(self.effectives.shape[1:])
+
+    def _estimate_error(self):
+        '''Measure the relative deviation between the interpolated and the exact
+        arrays at the middle of every cell of the grid.
+        '''
+        middles = [(axis[:-1] + axis[1:]) / 2 if len(axis) > 1 else axis for axis in self.axes]
+        effective_error, k_sted_error = 0., 0.
+        for i, j in itertools.product(range(len(middles[0])), range(len(middles[1]))):
+            exact = self.microscope.get_effective(self.datamap_pixelsize, middles[0][i], middles[1][j])
+            interpolated = self.grid_effectives[i:i + 2, j:j + 2].mean(axis=(0, 1))
+            effective_error = max(effective_error, numpy.abs(exact - interpolated).max())
+            for k in range(len(middles[2])):
+                exact = self.get_bleach_rates(middles[0][i], middles[1][j], middles[2][k])[1]
+                interpolated = self.grid_k_sted[i:i + 2, j:j + 2, k:k + 2].mean(axis=(0, 1, 2))
+                k_sted_error = max(k_sted_error, numpy.abs(exact - interpolated).max())
+        return {
+            "effective" : effective_error / max(self.grid_effectives.max(), numpy.finfo(float).tiny),
+            "k_sted" : k_sted_error / max(self.grid_k_sted.max(), numpy.finfo(float).tiny)
+        }
+
+    def get(self, row, col):
+        '''Return the arrays of the imaging parameters of a pixel of the ROI.
+
+        :param row: The row of the pixel in the ROI.
+        :param col: The column of the pixel in the ROI.
+
+        :return: A tuple of 2D arrays of the effective PSF, the excitation and
+                 STED photobleaching rates, and the excitation and STED
+                 survival probabilities over the pixel dwell time.
+        '''
+        if self.is_stored:
+            index = self.indices[row, col]
+            return (self.effectives[index], self.k_ex, self.k_sted[index],
+                    self.prob_ex, self.prob_sted[index])
+        if self.grid_size is None or self.is_uniform:
+            p_ex, p_sted, pdt = self.p_ex[row, col], self.p_sted[row, col], self.pdt[row, col]
+            effective = self.microscope.get_effective(self.datamap_pixelsize, p_ex, p_sted)
+            k_ex, k_sted = self.get_bleach_rates(p_ex, p_sted, pdt)
+            return effective, k_ex, k_sted, numpy.exp(-1. * k_ex * pdt), numpy.exp(-1. * k_sted * pdt)
+
+        effective, k_sted = self._interpolate(row, col)
+        k_ex = k_sted * 0.
+        pdt = self.pdt[row, col]
+        return effective, k_ex, k_sted, numpy.exp(-1. * k_ex * pdt), numpy.exp(-1. * k_sted * pdt)
+
+    def _interpolate(self, row, col):
+        '''Interpolate the effective PSF and the STED photobleaching rates of
+        a pixel of the ROI from the nodes of the grid.
+        '''
+        i, j, k = (lower[row, col] for lower in self.lower)
+        w_i, w_j, w_k = (weights[row, col] for weights in self.weights)
+        effective = numpy.zeros(self.grid_effectives.shape[2:])
+        k_sted = numpy.zeros(self.grid_k_sted.shape[3:])
+        for d_i, d_j in itertools.product((0, 1), repeat=2):
+            weight = (w_i if d_i else 1 - w_i) * (w_j if d_j else 1 - w_j)
+            if weight == 0:
+                continue
+            effective += weight * self.grid_effectives[i + d_i, j + d_j]
+            for d_k in (0, 1):
+                weight_k = weight * (w_k if d_k else 1 - w_k)
+                if weight_k == 0:
+                    continue
+                k_sted += weight_k * self.grid_k_sted[i + d_i, j + d_j, k + d_k]
+        return effective, k_sted
+
+    def get_corners(self):
+        '''Return the nodes of the interpolation grid and the corners of the
+        cell of every pixel of the ROI, from which the raster kernels
+        interpolate the arrays of the pixels when they are not stored.
+
+        The arrays of a pixel are the sums of the arrays of the nodes of its
+        corners weighted as in :meth:`get`, the corners of a parameter with a
+        single node having a weight of zero.
+
+        :return: A tuple of the effective PSFs of the nodes of the grid, of
+                 shape (nodes, rows, cols), the STED photobleaching rates of
+                 the nodes, the indices and the weights of the 4 nodes of the
+                 effective PSF of every pixel, of shape (rows, cols, 4), the
+                 indices and the weights of the 8 nodes of the STED
+                 photobleaching rates of every pixel, of shape (rows, cols, 8),
+                 and the pixel dwell time of every pixel.
+        '''
+        sizes = [len(axis) for axis in self.axes]
+        w_i, w_j, w_k = self.weights
+        effective_nodes, effective_weights, k_sted_nodes, k_sted_weights = [], [], [], []
+        for d_i, d_j in itertools.product((0, 1), repeat=2):
+            i = numpy.minimum(self.lower[0] + d_i, sizes[0] - 1)
+            j = numpy.minimum(self.lower[1] + d_j, sizes[1] - 1)
+            weight = (w_i if d_i else 1 - w_i) * (w_j if d_j else 1 - w_j)
+            effective_nodes.append(i * sizes[1] + j)
+            effective_weights.append(weight)
+            for d_k in (0, 1):
+                k = numpy.minimum(self.lower[2] + d_k, sizes[2] - 1)
+                k_sted_nodes.append((i * sizes[1] + j) * sizes[2] + k)
+                k_sted_weights.append(weight * (w_k if d_k else 1 - w_k))
+        return (self.grid_effectives.reshape(-1, *self.grid_effectives.shape[2:]),
+                self.grid_k_sted.reshape(-1, *self.grid_k_sted.shape[3:]),
+                numpy.stack(effective_nodes, axis=-1), numpy.stack(effective_weights, axis=-1),
+                numpy.stack(k_sted_nodes, axis=-1), numpy.stack(k_sted_weights, axis=-1), self.pdt)
@@ -80,17 +80,124 @@ Code written by Benoit Turcotte, Albert Michaud-Gagnon, Anthony Bilodeau, Audrey
    Journal of the Optical Society of America A (JOSA A), 30(8), 1640–1645.
 '''
 
-import logging
+import collections.abc
 import numpy
 import scipy.constants
 import scipy.signal
-import pickle
 import copy
-import os
+import warnings
 
-from pysted import utils, cUtils, raster, bleach_funcs
+from pysted import cache, utils, cUtils, raster, bleach_funcs
+from pysted.bank import ParameterBank
 
-class GaussianBeam:
+class FrozenDict(collections.abc.Mapping):
+    '''An immutable and hashable dict, used for the dict parameters of the
+    components (e.g. :attr:`Objective.transmission`).
+
+    :param args: The arguments of a :class:`dict`.
+    :param kwargs: The keyword arguments of a :class:`dict`.
+    '''
+    def __init__(self, *args, **kwargs):
+        self._data = dict(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __hash__(self):
+        return hash(frozenset(self._data.items()))
+
+    def __repr__(self):
+        return f"FrozenDict({self._data!r})"
+
+    def __reduce__(self):
+        return (FrozenDict, (self._data,))
+
+
+class Component:
+    '''Base class of the immutable components of a microscope.
+
+    The parameters of a component are set at construction and cannot be
+    modified afterwards, :meth:`replace` returns a modified copy instead. A key
+    is computed once from the parameters at construction such that comparing
+    two components, e.g. to validate the cache of a :class:`Microscope`, is a
+    single integer comparison. The key is stable across processes.
+
+    .. code-block:: python
+
+        detector = base.Detector(noise=True)
+        detector = detector.replace(n_airy=1.0)
+    '''
+    def _freeze(self):
+        '''Make the dict parameters immutable, compute the key of the
+        component and forbid further modifications.
+        '''
+        for name, value in vars(self).items():
+            if isinstance(value, dict):
+                object.__setattr__(self, name, FrozenDict(value))
+        key = int(cache.digest(type(self).__name__, vars(self))[:16], 16)
+        object.__setattr__(self, "_key", key)
+
+    @property
+    def key(self):
+        '''The key of the component computed from its parameters.
+        '''
+        return self._key
+
+    def parameters(self):
+        '''Return the parameters of the component.
+
+        :return: A dict of the parameters that can be used to instantiate the component.
+        '''
+        return {name: value for name, value in vars(self).items() if name != "_key"}
+
+    def replace(self, **changes):
+        '''Return a copy of the component with some modified parameters.
+
+        :param changes: The parameters to modify.
+
+        :return: A new component.
+        '''
+        parameters = self.parameters()
+        unknown = set(changes) - set(parameters)
+        if unknown:
+            raise TypeError(f"{type(self).__name__} has no parameters {sorted(unknown)}")
+        parameters.update(changes)
+        return type(self)(**parameters)
+
+    def __setattr__(self, name, value):
+        if "_key" in vars(self):
+            raise AttributeError(f"{type(self).__name__} is immutable, use `replace({name}=...)` instead")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        '''Two components are equal if they are of the same type and all of their
+        parameters are equal.
+
+        :param other: Any type of python objects
+
+        :return: A `bool` wheter both objects are equal
+        '''
+        if type(self) is not type(other):
+            return False
+        return self._key == other._key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self._key
+
+
+class GaussianBeam(Component):
     '''This class implements a Gaussian beam (excitation).
 
     :param lambda_: The wavelength of the beam (m).
@@ -117,6 +224,7 @@ class GaussianBeam:
         self.lambda_ = lambda_
         self.polarization = kwargs.get("polarization", numpy.pi/2)
         self.beta = kwargs.get("beta", numpy.pi/4)
+        self._freeze()
 
     # FIXME: pass Objective object instead of f, n, na, transmission
     def get_intensity(self, power, f, n, na, transmission, datamap_pixelsize):
@@ -155,22 +263,14 @@ class GaussianBeam:
         k = 2 * numpy.pi * n / self.lambda_
 
         # compute the focal plane integrations i1 to i3 [Xie2013]
-        i1 = numpy.empty((n_pixels, n_pixels))
-        i2 = numpy.empty((n_pixels, n_pixels))
-        i3 = numpy.empty((n_pixels, n_pixels))
-        phi = numpy.empty((n_pixels, n_pixels))
-        for y in range(n_pixels):
-            h_rel = (center - y)
-            for x in range(n_pixels):
-                w_rel = (x - center)
-
-                angle, radius = utils.cart2pol(w_rel, h_rel)
-
-                kr = k * radius * datamap_pixelsize
-                i1[y, x] = scipy.integrate.quad(fun1, 0, alpha, (kr,))[0]
-                i2[y, x] = scipy.integrate.quad(fun2, 0, alpha, (kr,))[0]
-                i3[y, x] = scipy.integrate.quad(fun3, 0, alpha, (kr,))[0]
-                phi[y, x] = angle
+        # The integrals only depend on the radius, they are computed once per unique
+        # radius and scattered back on the grid
+        y, x = numpy.mgrid[:n_pixels, :n_pixels]
+        phi, _ = utils.cart2pol(x - center, center - y)
+        squared_radius, inverse = numpy.unique((x - center)**2 + (center - y)**2, return_inverse=True)
+        kr = k * numpy.sqrt(squared_radius) * datamap_pixelsize
+        i1, i2, i3 = (integral[inverse].reshape(phi.shape)
+                      for integral in utils.radial_quadrature((fun1, fun2, fun3), 0, alpha, kr))
 
         ax = numpy.sin(self.beta)
         ay = numpy.cos(self.beta) * numpy.exp(1j * self.polarization)
@@ -215,33 +315,8 @@ class GaussianBeam:
         # [RPPhoto2015]
         return intensity_flipped * transmission * power
 
-    def __eq__(self, other):
-        """
-        Overloads the equal method of the `GaussianBeam` object. Two `GaussianBeam`
-        objects are equal if all of their constituent are equals.
-
-        :param other: Any type of python objects
-
-        :return : A `bool` wheter both objects are equal
-        """
-        if not isinstance(other, GaussianBeam):
-            return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
-
-    def __ne__(self, other):
-        """
-        Overloads the not equal method of the `GaussianBeam` object. Two `GaussianBeam`
-        objects are not equal if not all of their constituent are equals.
-
-        :param other: Any type of python objects
 
-        :return : A `bool` wheter both objects are not equal
-        """
-        return not self == other
-
-class DonutBeam:
+class DonutBeam(Component):
     '''This class implements a donut beam (STED).
 
     :param lambda_: The wavelength of the beam (m).
@@ -283,6 +358,7 @@ class DonutBeam:
         self.rate = kwargs.get("rate", 40e6)
         self.zero_residual = kwargs.get("zero_residual", 0)
         self.anti_stoke = kwargs.get("anti_stoke", True)
+        self._freeze()
 
     # FIXME: pass Objective object instead of f, n, na, transmission
     def get_intensity(self, power, f, n, na, transmission, datamap_pixelsize):
@@ -327,27 +403,14 @@ class DonutBeam:
         k = 2 * numpy.pi * n / self.lambda_
 
         # compute the angular integrations i1 to i5 [Xie2013]
-        i1 = numpy.zeros((n_pixels, n_pixels))
-        i2 = numpy.zeros((n_pixels, n_pixels))
-        i3 = numpy.zeros((n_pixels, n_pixels))
-        i4 = numpy.zeros((n_pixels, n_pixels))
-        i5 = numpy.zeros((n_pixels, n_pixels))
-        phi = numpy.zeros((n_pixels, n_pixels))
-        for y in range(n_pixels):
-            h_rel = (center - y)
-            for x in range(n_pixels):
-                w_rel = (x - center)
-
-                angle, radius = utils.cart2pol(w_rel, h_rel)
-
-                kr = k * radius * datamap_pixelsize
-
-                i1[y, x] = scipy.integrate.quad(fun1, 0, alpha, (kr,))[0]
-                i2[y, x] = scipy.integrate.quad(fun2, 0, alpha, (kr,))[0]
-                i3[y, x] = scipy.integrate.quad(fun3, 0, alpha, (kr,))[0]
-                i4[y, x] = scipy.integrate.quad(fun4, 0, alpha, (kr,))[0]
-                i5[y, x] = scipy.integrate.quad(fun5, 0, alpha, (kr,))[0]
-                phi[y, x] = angle
+        # The integrals only depend on the radius, they are computed once per unique
+        # radius and scattered back on the grid
+        y, x = numpy.mgrid[:n_pixels, :n_pixels]
+        phi, _ = utils.cart2pol(x - center, center - y)
+        squared_radius, inverse = numpy.unique((x - center)**2 + (center - y)**2, return_inverse=True)
+        kr = k * numpy.sqrt(squared_radius) * datamap_pixelsize
+        i1, i2, i3, i4, i5 = (integral[inverse].reshape(phi.shape)
+                              for integral in utils.radial_quadrature((fun1, fun2, fun3, fun4, fun5), 0, alpha, kr))
 
         ax = numpy.sin(self.beta)
         ay = numpy.cos(self.beta) * numpy.exp(1j * self.polarization)
@@ -418,33 +481,8 @@ class DonutBeam:
 
         return intensity
 
-    def __eq__(self, other):
-        """
-        Overloads the equal method of the `DonutBeam` object. Two `DonutBeam`
-        objects are equal if all of their constituent are equals.
-
-        :param other: Any type of python objects
-
-        :return : A `bool` wheter both objects are equal
-        """
-        if not isinstance(other, DonutBeam):
-            return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
-
-    def __ne__(self, other):
-        """
-        Overloads the not equal method of the `DonutBeam` object. Two `DonutBeam`
-        objects are not equal if not all of their constituent are equals.
-
-        :param other: Any type of python objects
 
-        :return : A `bool` wheter both objects are not equal
-        """
-        return not self == other
-
-class Detector:
+class Detector(Component):
     '''This class implements the photon detector component.
 
     :param parameters: One or more parameters as described in the following
@@ -504,6 +542,7 @@ class Detector:
         self.det_delay = kwargs.get("det_delay", 750e-12)
         self.det_width = kwargs.get("det_width", 8e-9)
         assert self.det_delay >= 0 #Verify the detection delay is not negative
+        self._freeze()
 
     def get_detection_psf(self, lambda_, psf, na, transmission, datamap_pixelsize):
         '''Compute the detection PSF as a convolution between the fluorscence
@@ -550,13 +589,18 @@ class Detector:
         :param photons: An array of number of emitted photons.
         :param dwelltime: The time spent to detect the emitted photons (s). It is
                           either a scalar or an array shaped like *nb_photons*.
+        :param seed: A seed of the global random generator of numpy or a
+                     ``numpy.random.Generator`` from which the signal is sampled.
         :return: An array shaped like *nb_photons*.
         '''
         if isinstance(photons, int):
             photons = numpy.array([photons], dtype=numpy.int64)
 
         detection_efficiency = self.pcef * self.pdef # ratio
-        if seed is None:
+        random = numpy.random
+        if isinstance(seed, numpy.random.Generator):
+            random = seed
+        elif seed is None:
             # On Windows this seems to be causing some problems when get_signal
             # is called repeatedly since time_ns may not be fast enough...
             # Leaving the seed to None, seems to do the trick.
@@ -566,9 +610,9 @@ class Detector:
         else:
             numpy.random.seed(seed)
         try:
-            signal = numpy.random.binomial(photons.astype(numpy.int64),
-                                           detection_efficiency,
-                                           photons.shape) * dwelltime
+            signal = random.binomial(photons.astype(numpy.int64),
+                                    detection_efficiency,
+                                    photons.shape) * dwelltime
         except:
             # on Windows numpy.random.binomial cannot generate 64-bit integers
             signal = utils.approx_binomial(photons.astype(numpy.int64),
@@ -576,44 +620,36 @@ class Detector:
                                            photons.shape) * dwelltime
         # add noise, background, and dark counts
         if self.noise:
-            signal = numpy.random.poisson(signal, signal.shape)
+            signal = random.poisson(signal, signal.shape)
         if self.background > 0:
             # background counts per second, accounting for the detection gating
-            cts = numpy.random.poisson(self.background * self.det_width * rate * dwelltime, signal.shape)
+            cts = random.poisson(self.background * self.det_width * rate * dwelltime, signal.shape)
             signal += cts
         if self.darkcount > 0:
             # Dark counts per second, accounting for the detection gating
-            cts = numpy.random.poisson(self.darkcount * self.det_width * rate * dwelltime, signal.shape)
+            cts = random.poisson(self.darkcount * self.det_width * rate * dwelltime, signal.shape)
             signal += cts
         return signal
 
-    def __eq__(self, other):
-        """
-        Overloads the equal method of the `Detector` object. Two `Detector`
-        objects are equal if all of their constituent are equals.
-
-        :param other: Any type of python objects
-
-        :return : A `bool` wheter both objects are equal
-        """
-        if not isinstance(other, Detector):
-            return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
+    def get_expected_signal(self, photons, dwelltime, rate):
+        '''Compute the expected detected signal (in photons) given the number of
+        emitted photons and the time spent by the detector.
 
-    def __ne__(self, other):
-        """
-        Overloads the not equal method of the `Detector` object. Two `Detector`
-        objects are not equal if not all of their constituent are equals.
+        This is the mean of :meth:`get_signal`, without sampling.
 
-        :param other: Any type of python objects
+        :param photons: An array of number of emitted photons.
+        :param dwelltime: The time spent to detect the emitted photons (s). It is
+                          either a scalar or an array shaped like *nb_photons*.
+        :return: An array shaped like *nb_photons*.
+        '''
+        detection_efficiency = self.pcef * self.pdef # ratio
+        signal = numpy.asarray(photons, dtype=numpy.float64) * detection_efficiency * dwelltime
+        # background and dark counts per second, accounting for the detection gating
+        signal = signal + (self.background + self.darkcount) * self.det_width * rate * dwelltime
+        return signal
 
-        :return : A `bool` wheter both objects are not equal
-        """
-        return not self == other
 
-class Objective:
+class Objective(Component):
     '''
     This class implements the microscope objective component.
 
@@ -649,38 +685,14 @@ class Objective:
                                                         585: 0.85,
                                                         575: 0.85,
                                                         })
+        self._freeze()
 
     def get_transmission(self, lambda_):
         return self.transmission[int(lambda_ * 1e9)]
 
-    def __eq__(self, other):
-        """
-        Overloads the equal method of the `Objective` object. Two `Objective`
-        objects are equal if all of their constituent are equals.
-
-        :param other: Any type of python objects
-
-        :return : A `bool` wheter both objects are equal
-        """
-        if not isinstance(other, Objective):
-            return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
-
-    def __ne__(self, other):
-        """
-        Overloads the not equal method of the `Objective` object. Two `Objective`
-        objects are not equal if not all of their constituent are equals.
 
-        :param other: Any type of python objects
-
-        :return : A `bool` wheter both objects are not equal
-        """
-        return not self == other
 
-
-class Fluorescence:
+class Fluorescence(Component):
     '''This class implements a fluorescence molecule.
 
     :param lambda_: The fluorescence wavelength (m).
@@ -736,32 +748,8 @@ class Fluorescence:
         self.k1 = kwargs.get("k1", 1.3e-15) #Note: divided by (100**2)**1.4, assuming units where wrong in the paper (cm^2 instead of m^2)
         self.b = kwargs.get("b", 1.4)
         self.triplet_dynamic_frac = kwargs.get("triplet_dynamic_frac", 0)
+        self._freeze()
 
-    def __eq__(self, other):
-        """
-        Overloads the equal method of the `Fluorescence` object. Two fluorescence
-        objects are equal if all of their constituent are equals.
-
-        :param other: Any type of python objects
-
-        :return : A `bool` wheter both objects are equal
-        """
-        if not isinstance(other, Fluorescence):
-            return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
-
-    def __ne__(self, other):
-        """
-        Overloads the not equal method of the fluorescence object. Two fluorescence
-        objects are not equal if not all of their constituent are equals.
-
-        :param other: Any type of python objects
-
-        :return : A `bool` wheter both objects are not equal
-        """
-        return not self == other
 
     def get_sigma_ste(self, lambda_):
         '''Return the stimulated emission cross-section of the fluorescence
@@ -782,11 +770,20 @@ class Fluorescence:
         return self.sigma_abs[int(lambda_ * 1e9)]
 
 
-    def get_psf(self, na, datamap_pixelsize):
+    def get_psf(self, na, datamap_pixelsize, order=8, supersample=1):
         '''Compute the Gaussian-shaped fluorescence PSF.
 
+        Every pixel is integrated with a fixed-order Gauss-Legendre tensor-product
+        quadrature. The amplitude is radially symmetric, hence only a quadrant of
+        the PSF is integrated and then mirrored. With the default parameters the
+        PSF agrees with an adaptive integration of every pixel to a relative error
+        below 1e-12.
+
         :param na: The numerical aperture of the objective.
         :param datamap_pixelsize: The size of an element in the intensity matrix (m).
+        :param order: The number of quadrature nodes per dimension in every (sub) pixel.
+        :param supersample: The number of sub pixels per dimension in which every
+                            pixel is split before the quadrature.
         :return: A 2D array.
         '''
         diameter = 2.233 * self.lambda_ / (na * datamap_pixelsize)
@@ -795,32 +792,44 @@ class Fluorescence:
 
         fwhm = self.lambda_ / (2 * na)
 
-        half_pixelsize = datamap_pixelsize / 2
-        gauss = numpy.zeros((n_pixels, n_pixels))
-        for y in range(n_pixels):
-            h_rel = (center - y) * datamap_pixelsize
-            h_lb = h_rel - half_pixelsize
-            h_ub = h_rel + half_pixelsize
-            for x in range(n_pixels):
-                w_rel = (x - center) * datamap_pixelsize
-                w_lb = w_rel - half_pixelsize
-                w_ub = w_rel + half_pixelsize
-                gauss[y, x] = scipy.integrate.nquad(cUtils.calculate_amplitude,
-                                                    ((h_lb, h_ub), (w_lb, w_ub)),
-                                                    (fwhm,))[0]
+        # quadrature nodes and weights in a pixel centered on 0 of unit size
+        nodes, weights = numpy.polynomial.legendre.leggauss(order)
+        sub_centers = (numpy.arange(supersample) + 0.5) / supersample - 0.5
+        nodes = (sub_centers[:, numpy.newaxis] + nodes / (2 * supersample)).ravel()
+        weights = numpy.tile(weights / (2 * supersample), supersample)
+
+        # positions of the nodes in the quadrant (center, center) to (n_pixels, n_pixels)
+        offsets = numpy.arange(center + 1)
+        positions = ((offsets[:, numpy.newaxis] + nodes) * datamap_pixelsize).ravel()
+        h, w = numpy.meshgrid(positions, positions, indexing="ij")
+        amplitudes = numpy.empty(h.shape)
+        cUtils.calculate_amplitudes(h, w, amplitudes, fwhm)
+
+        n_nodes = len(nodes)
+        amplitudes = amplitudes.reshape(center + 1, n_nodes, center + 1, n_nodes)
+        quadrant = numpy.einsum("injm,n,m->ij", amplitudes, weights, weights)
+        quadrant *= datamap_pixelsize ** 2
+
+        gauss = numpy.empty((n_pixels, n_pixels))
+        gauss[center:, center:] = quadrant
+        gauss[:center + 1, center:] = quadrant[::-1]
+        gauss[:, :center] = gauss[:, :center:-1]
         return numpy.real_if_close(gauss / numpy.max(gauss))
 
-    def get_photons(self, intensity, lambda_=None):
+    def get_photons(self, intensity, lambda_=None, discrete=True):
         '''Translate a light intensity to a photon flux.
 
         :param intensity: Light intensity (:math:`W/m^{-2}`).
         :param lambda_: Wavelenght. If None, default to the emission wavelenght.
+        :param discrete: Whether the photon flux is rounded down to a whole number of photons.
 
         :return: Photon flux (:math:`m^{-2}s^{-1}`).
         '''
         if lambda_ is None:
             lambda_ = self.lambda_
         e_photon = scipy.constants.c * scipy.constants.h / lambda_
+        if not discrete:
+            return intensity / e_photon
         return numpy.floor(intensity / e_photon)
 
     def get_k_bleach(self, lambda_ex, lambda_sted, phi_ex, phi_sted, tau_sted, tau_rep, dwelltime):
@@ -901,9 +910,17 @@ class Microscope:
                        (load_cache=False) or if they will be loaded from the previous save (load_cache=True). Generating
                        the lasers from scratch can take a long time (takes longer as the pixel_size decreases), so
                        loading the cache can save time when doing multiple experiments using the same pixel_size.
+    :param cache_dir: The directory of the on-disk cache of the lasers (see :class:`~pysted.cache.LaserCache`).
+                      Defaults to the environment variable ``PYSTED_CACHE_DIR`` or ``.pysted_cache``.
+    :param cache_max_size: The maximal size (bytes) of the on-disk cache. The least recently used entries are
+                           removed when it is exceeded. ``None`` for no limit.
     '''
 
-    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False, verbose=False):
+    # Number of banks of scalar imaging parameters kept in the cache of every pixel size (see get_bank)
+    MAX_CACHED_BANKS = 32
+
+    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False, verbose=False,
+                 cache_dir=None, cache_max_size=None):
         self.excitation = excitation
         self.sted = sted
         self.detector = detector
@@ -914,25 +931,8 @@ class Microscope:
 
         # caching system
         self.__cache = {}   # add all the elements used to compute lasers in the cache
-        cache_keys = ["lasers", "objective", "excitation", "sted", "fluo"]
-        if load_cache:
-            if os.path.isfile(".microscope_cache.pkl"):
-                try:
-                    self.__cache = pickle.load(open(".microscope_cache.pkl", "rb"))
-                    flag = False
-                    for key, values in self.__cache.items():
-                        if not all([ckey in values.keys() for ckey in cache_keys]):
-                            flag = True
-                    if flag:
-                        self.__cache = {}
-
-                except Exception as e:
-                    if verbose:
-                        logging.warning("-----------------")
-                        logging.warning(f"An exception was caught while trying to load the microscope cache")
-                        logging.warning(f"The microscope cache will be built...")
-                        logging.warning(e)
-                        logging.warning("-----------------")
+        self.load_cache = load_cache
+        self.disk_cache = cache.LaserCache(cache_dir, cache_max_size)
 
         # This will be used during the acquisition routine to make a better correspondance
         # between the microscope acquisition time steps and the Ca2+ flash time steps
@@ -952,7 +952,35 @@ class Microscope:
         :return: A boolean.
         '''
         datamap_pixelsize_nm = int(datamap_pixelsize * 1e9)
-        return datamap_pixelsize_nm in self.__cache
+        return "lasers" in self.__cache.get(datamap_pixelsize_nm, {})
+
+    def _cache_node(self, datamap_pixelsize_nm, name, components, parents, compute):
+        '''Return the value of a node of the dependency graph of the cache.
+
+        The node is recomputed only if the key of one of its components differs
+        from the one at its last computation or if one of its parent nodes was
+        recomputed since.
+
+        :param datamap_pixelsize_nm: The pixel size (nm) of the cache entry.
+        :param name: The name of the node.
+        :param components: A list of the components the node depends on.
+        :param parents: A list of the names of the nodes the node depends on.
+        :param compute: A function without argument computing the value of the node.
+
+        :return: The value of the node.
+        '''
+        nodes = self.__cache.setdefault(datamap_pixelsize_nm, {})
+        keys = [component.key for component in components]
+        versions = [nodes[parent]["version"] for parent in parents]
+        node = nodes.get(name, None)
+        if (node is None) or (node["components"] != keys) or (node["parents"] != versions):
+            nodes[name] = {
+                "value" : compute(),
+                "components" : keys,
+                "parents" : versions,
+                "version" : 0 if node is None else node["version"] + 1
+            }
+        return nodes[name]["value"]
 
     def cache(self, datamap_pixelsize, save_cache=False):
         '''Compute and cache the excitation and STED intensities, and the
@@ -961,9 +989,17 @@ class Microscope:
         These intensities are computed with a power of 1 W such that they can 
         serve as a basis to compute intensities with any power.
 
+        The cache is a dependency graph in which every array is recomputed only
+        when its own inputs change:
+
+        * excitation intensity <- (excitation, objective, pixel size);
+        * STED intensity <- (sted, objective, pixel size);
+        * fluorescence PSF <- (fluo, objective, pixel size);
+        * detection PSF <- (fluorescence PSF, detector).
+
         :param datamap_pixelsize: The size of a pixel in the simulated image (m).
-        :param save_cache: A bool which determines whether or not the lasers will be saved to allow for faster load
-                           times for future experiments
+        :param save_cache: A bool which determines whether or not the lasers will be saved in the on-disk cache
+                           to allow for faster load times for future experiments
 
         :return: A tuple containing:
 
@@ -971,70 +1007,97 @@ class Microscope:
                   * A 2D array of the STED intensity for a a power of 1 W;
                   * A 2D array of the detection PSF.
         '''
+        datamap_pixelsize_nm = int(datamap_pixelsize * 1e9)
+        f, n, na = self.objective.f, self.objective.n, self.objective.na
 
-        def compute_lasers(datamap_pixelsize_nm, reset_cache=True):
-            """
-            We only reset the components in the cache if it is necessary
-            """
-            if reset_cache:
-                self.__cache[datamap_pixelsize_nm] = {}
-
-            f, n, na = self.objective.f, self.objective.n, self.objective.na
-
-            # Verifies excitation laser
-            if self.excitation == self.__cache[datamap_pixelsize_nm].get("excitation", None):
-                i_ex, _, _ = self.__cache[datamap_pixelsize_nm]["lasers"]
-            else:
-                transmission = self.objective.get_transmission(self.excitation.lambda_)
-                i_ex = self.excitation.get_intensity(1, f, n, na,
-                                                     transmission, datamap_pixelsize)
+        def compute_i_ex():
+            transmission = self.objective.get_transmission(self.excitation.lambda_)
+            return self.excitation.get_intensity(1, f, n, na, transmission, datamap_pixelsize)
+
+        def compute_i_sted():
+            transmission = self.objective.get_transmission(self.sted.lambda_)
+            return self.sted.get_intensity(1, f, n, na, transmission, datamap_pixelsize)
+
+        def compute_psf():
+            return self.fluo.get_psf(na, datamap_pixelsize)
+
+        def compute_psf_det():
+            transmission = self.objective.get_transmission(self.fluo.lambda_)
+            psf = self.__cache[datamap_pixelsize_nm]["psf"]["value"]
+            return self.detector.get_detection_psf(self.fluo.lambda_, psf, na, transmission,
+                                                   datamap_pixelsize)
+
+        def compute_lasers():
+            i_ex = self._cache_node(datamap_pixelsize_nm, "i_ex", [self.excitation, self.objective], [], compute_i_ex)
+            i_sted = self._cache_node(datamap_pixelsize_nm, "i_sted", [self.sted, self.objective], [], compute_i_sted)
+            self._cache_node(datamap_pixelsize_nm, "psf", [self.fluo, self.objective], [], compute_psf)
+            psf_det = self._cache_node(datamap_pixelsize_nm, "psf_det", [self.detector], ["psf"], compute_psf_det)
+            return utils.resize(i_ex, i_sted, psf_det)
+
+        components = [self.excitation, self.sted, self.detector, self.objective, self.fluo]
+        node = self.__cache.get(datamap_pixelsize_nm, {}).get("lasers", None)
+        is_stale = (node is None) or (node["components"] != [component.key for component in components])
+
+        if is_stale or save_cache:
+            key = self.disk_cache.key(datamap_pixelsize, *components)
+        if is_stale and self.load_cache:
+            lasers = self.disk_cache.load(key)
+            if lasers is not None:
+                self.__cache.setdefault(datamap_pixelsize_nm, {})["lasers"] = {
+                    "value" : lasers,
+                    "components" : [component.key for component in components],
+                    "parents" : [],
+                    "version" : 0 if node is None else node["version"] + 1
+                }
+
+        lasers = self._cache_node(datamap_pixelsize_nm, "lasers", components, [], compute_lasers)
+        if save_cache and key not in self.disk_cache:
+            self.disk_cache.save(key, lasers)
+        return lasers
+
+    def get_bank(self, datamap_pixelsize, p_ex, p_sted, pdt, grid_size=None, energy=None):
+        '''Build the :class:`~pysted.bank.ParameterBank` of the imaging parameters of an acquisition.
+
+        The banks of scalar imaging parameters are nodes of the cache depending on the lasers, such that repeated
+        acquisitions with the same parameters (e.g. the actions of an agent) do not recompute the effective PSF and the
+        photobleaching rates. The :attr:`MAX_CACHED_BANKS` most recently built banks are kept for every pixel size.
 
-            # Verifies STED laser
-            if self.sted == self.__cache[datamap_pixelsize_nm].get("sted", None):
-                _, i_sted, _ = self.__cache[datamap_pixelsize_nm]["lasers"]
-            else:
-                transmission = self.objective.get_transmission(self.sted.lambda_)
-                i_sted = self.sted.get_intensity(1, f, n, na,
-                                                 transmission, datamap_pixelsize)
+        :param datamap_pixelsize: The size of a pixel in the simulated image (m).
+        :param p_ex: The excitation power, a float or a 2D array of the shape of the ROI (W).
+        :param p_sted: The STED power, a float or a 2D array of the shape of the ROI (W).
+        :param pdt: The pixel dwell time, a float or a 2D array of the shape of the ROI (s).
+        :param grid_size: The number of nodes per varying parameter of the interpolation grid of the bank.
+        :param energy: The fraction of the energy kept in the compact window of the bank.
 
-            # Verifies fluo
-            if self.fluo == self.__cache[datamap_pixelsize_nm].get("fluo", None):
-                _, _, psf_det = self.__cache[datamap_pixelsize_nm]["lasers"]
-            else:
-                transmission = self.objective.get_transmission(self.fluo.lambda_)
-                psf = self.fluo.get_psf(na, datamap_pixelsize)
-                # should take data_pixelsize instead of pixelsize, right? same for psf above?
-                psf_det = self.detector.get_detection_psf(self.fluo.lambda_, psf,
-                                                          na, transmission,
-                                                          datamap_pixelsize)
-
-            self.__cache[datamap_pixelsize_nm]["lasers"] = utils.resize(i_ex, i_sted, psf_det)
-            self.__cache[datamap_pixelsize_nm]["objective"] = self.objective
-            self.__cache[datamap_pixelsize_nm]["excitation"] = self.excitation
-            self.__cache[datamap_pixelsize_nm]["sted"] = self.sted
-            self.__cache[datamap_pixelsize_nm]["fluo"] = self.fluo
+        :return: A :class:`~pysted.bank.ParameterBank`.
+        '''
+        if not all(isinstance(param, (float, numpy.floating)) for param in (p_ex, p_sted, pdt)):
+            return ParameterBank(self, datamap_pixelsize, p_ex, p_sted, pdt, grid_size=grid_size, energy=energy)
 
+        # The bank depends on the lasers which are computed first
+        self.cache(datamap_pixelsize)
         datamap_pixelsize_nm = int(datamap_pixelsize * 1e9)
-        if datamap_pixelsize_nm not in self.__cache:
-            compute_lasers(datamap_pixelsize_nm, reset_cache=True)
-        elif (self.__cache[datamap_pixelsize_nm]["objective"] != self.objective) or \
-             (self.__cache[datamap_pixelsize_nm]["excitation"] != self.excitation) or \
-             (self.__cache[datamap_pixelsize_nm]["sted"] != self.sted) or \
-             (self.__cache[datamap_pixelsize_nm]["fluo"] != self.fluo):
-            compute_lasers(datamap_pixelsize_nm, reset_cache=False)
-
-        if save_cache:
-            pickle.dump(self.__cache, open(".microscope_cache.pkl", "wb"))
-        return self.__cache[datamap_pixelsize_nm]["lasers"]
+        name = ("bank", float(p_ex), float(p_sted), float(pdt), energy)
+        components = [self.excitation, self.sted, self.detector, self.objective, self.fluo]
+        bank = self._cache_node(datamap_pixelsize_nm, name, components, ["lasers"],
+                                lambda: ParameterBank(self, datamap_pixelsize, p_ex, p_sted, pdt, energy=energy))
+
+        # The most recently used bank is moved last and the oldest banks are dropped
+        nodes = self.__cache[datamap_pixelsize_nm]
+        nodes[name] = nodes.pop(name)
+        banks = [key for key in nodes if isinstance(key, tuple) and key[0] == "bank"]
+        for key in banks[:-self.MAX_CACHED_BANKS]:
+            del nodes[key]
+        return bank
 
     def clear_cache(self):
         '''Empty the cache.
 
-        .. important::
-           It is important to empty the cache if any of the components
-           :attr:`excitation`, :attr:`sted`, :attr:`detector`,
-           :attr:`objective`, or :attr:`fluorescence` are internally modified
-           or replaced.
+        .. note::
+           Replacements of the components :attr:`excitation`, :attr:`sted`,
+           :attr:`detector`, :attr:`objective`, or :attr:`fluorescence` are
+           detected by the cache, such that emptying it is only required to
+           free memory.
         '''
         self.__cache = {}
 
@@ -1107,10 +1170,62 @@ class Microscope:
         # effective intensity of a single molecule (W) [Willig2006] eq. 3
         return excitation_probability * eta * psf_det
 
+    def get_intensity_no_bleach(self, datamap, acquired_intensity, pixel_list, ratio, p_ex, p_sted,
+                                max_unique_powers=16):
+        '''Computes the acquired intensity of an acquisition without photobleaching in a
+        single vectorized pass.
+
+        Without photobleaching, the intensity measured at a pixel does not depend on the
+        previously acquired pixels. The image is thus the correlation of the datamap with
+        the effective PSF (see :func:`~pysted.utils.correlate_effective`) sampled at the
+        positions of the *pixel_list*. One correlation is computed for every unique
+        combination of excitation and STED powers in the *pixel_list*.
+
+        :param datamap: The datamap on which the acquisition is done, either a Datamap object or TemporalDatamap
+        :param acquired_intensity: 2D array in which the intensity is accumulated (modified in place).
+        :param pixel_list: A (N, 2) array of the pixels to acquire.
+        :param ratio: The ratio of the acquisition pixel size to the datamap pixel size.
+        :param p_ex: 2D array of the excitation power of every pixel of the ROI (W).
+        :param p_sted: 2D array of the STED power of every pixel of the ROI (W).
+        :param max_unique_powers: The maximal number of unique combinations of powers for which
+                                  correlations are computed. With more combinations the pixel by
+                                  pixel raster is faster.
+
+        :return: The *acquired_intensity*, or None if there are more than *max_unique_powers*
+                 combinations of powers in the *pixel_list*.
+        '''
+        pixel_list = numpy.asarray(pixel_list, dtype=numpy.int64).reshape(-1, 2)
+        rows, cols = pixel_list[:, 0], pixel_list[:, 1]
+        if len(pixel_list) == 0:
+            return acquired_intensity
+
+        _p_ex, _p_sted = p_ex[rows, cols], p_sted[rows, cols]
+        if numpy.all(_p_ex == _p_ex[0]) and numpy.all(_p_sted == _p_sted[0]):
+            unique_powers = [(_p_ex[0], _p_sted[0])]
+            inverse = numpy.zeros(len(pixel_list), dtype=numpy.int64)
+        else:
+            # Complex numbers allow a fast unique on the pairs of powers
+            unique_powers, inverse = numpy.unique(_p_ex + 1j * _p_sted, return_inverse=True)
+            if len(unique_powers) > max_unique_powers:
+                return None
+            unique_powers = [(power.real, power.imag) for power in unique_powers]
+            inverse = inverse.ravel()
+
+        whole_datamap = datamap.sub_datamaps_dict.total()
+        shape = (rows.max() + 1, cols.max() + 1)
+        for i, (_p_ex, _p_sted) in enumerate(unique_powers):
+            effective = self.get_effective(datamap.pixelsize, _p_ex, _p_sted)
+            intensity = utils.correlate_effective(whole_datamap, effective, shape)
+            in_group = inverse == i
+            numpy.add.at(acquired_intensity, (rows[in_group] // ratio, cols[in_group] // ratio),
+                         intensity[rows[in_group], cols[in_group]])
+        return acquired_intensity
+
     def get_signal_and_bleach(self, datamap, pixelsize, pdt, p_ex, p_sted, indices=None, acquired_intensity=None,
                               pixel_list=None, bleach=True, update=True, seed=None, filter_bypass=False,
                               bleach_func=bleach_funcs.default_update_survival_probabilities, steps=None,
-                              prob_ex=None, prob_sted=None, bleach_mode="default", *args, **kwargs):
+                              prob_ex=None, prob_sted=None, bleach_mode="default", parameter_grid=None,
+                              num_threads=None, psf_energy=None, acquisition_id=0, *args, **kwargs):
         """
         Acquires the signal and bleaches simultaneously. 
         
@@ -1130,26 +1245,59 @@ class Microscope:
                                    flashes can occur mid acquisition. Leave as None if it is not the case. (array)
         :param pixel_list: The list of pixels to be iterated on. If none, a pixel_list of a raster scan will be
                            generated. (list of tuples (row, col))
-        :param bleach: Determines whether bleaching is active or not. (Bool)
+        :param bleach: Determines whether bleaching is active or not. Without bleaching, the image is computed in a
+                       single vectorized pass (see :meth:`get_intensity_no_bleach`). (Bool)
         :param update: Determines whether the datamap is updated in place. If set to false, the datamap can still be
                        updated later with the returned bleached datamap. (Bool)
-        :param seed: Sets a seed for the random number generator.
+        :param seed: Sets a seed for the random number generator. Either an int, a ``numpy.random.SeedSequence`` or a
+                     ``numpy.random.Generator`` (see :func:`~pysted.utils.rng_key`).
         :param filter_bypass: Whether or not to filter the pixel list.
                               This is useful if you know your pixel list is adequate and ordered differently from a
                               raster scan (i.e. a left to right, row by row scan), as filtering the list return it
                               in raster order.
                               If pixel_list is none, this must be True then.
         :param bleach_func: The bleaching function to be applied.
-        :param steps: list containing the pixeldwelltimes for the sub steps of an acquisition. Is none by default.
-                      Should be used if trying to implement a DyMin type acquisition, where decisions are made
-                      after some time on whether or not to continue the acq.
+        :param steps: Ignored, kept for compatibility. The sub steps of an adaptive acquisition (e.g. DyMIN) are
+                      described by the policy of an :class:`~pysted.microscopes.AdaptiveMicroscope`.
+        :param prob_ex: Ignored, kept for compatibility. The survival probabilities are computed by the raster
+                        functions over the footprint of the laser.
+        :param prob_sted: Ignored, kept for compatibility (see ``prob_ex``).
+        :param parameter_grid: The number of nodes per varying imaging parameter of the interpolation grid of the
+                               :class:`~pysted.bank.ParameterBank`. Useful when the imaging parameters vary
+                               continuously through the ROI, as the arrays of every pixel are then interpolated in the
+                               raster kernel. If None, the effective PSF and photobleaching rates are computed exactly
+                               for every unique (p_ex, p_sted, pdt) triple, which are computed at every pixel instead
+                               of being stored over 256 unique triples.
+        :param num_threads: The number of threads used to acquire the image. The image is then acquired by tiles of the
+                            size of the laser which are not visited in raster order (see
+                            :func:`~pysted.raster.raster_func_c_self_bleach_split_g`). If None, the pixels are
+                            acquired in order in the calling thread. The tiles require the scan without the GIL of
+                            the kernel, otherwise a warning is raised and the pixels are acquired in order.
+        :param psf_energy: The fraction of the energy of the effective PSF and of the photobleaching rates kept in the
+                           footprint of the laser, e.g. 0.9999. The footprint is then the compact window of the
+                           :class:`~pysted.bank.ParameterBank` instead of the window of the largest laser, and the
+                           relative error on the intensity of a uniform sample is given by its ``trim_error``. If None,
+                           the whole laser is used. The footprint is only trimmed in the scan without the GIL of
+                           :func:`~pysted.raster.raster_func_c_self_bleach_split_g`, in the exact mode when the arrays
+                           of at most 256 unique triples are stored and in the interpolation mode (see
+                           ``parameter_grid``). A warning is raised when it cannot be applied.
+        :param acquisition_id: The index of the acquisition among the acquisitions made with the same seed, e.g. the
+                               partial scans of an interrupted acquisition, which then draw independent random
+                               streams (see :func:`~pysted.utils.acquisition_seed`).
 
         :return: returned_acquired_photons, the acquired photon for the acquisition.
-                 bleached_sub_datamaps_dict, a dict containing the results of bleaching on the subdatamaps
-                 acquired_intensity, the intensity of the acquisition, used for interrupted acquisitions
-        """
-
-        if seed is not None:
+                 bleached_sub_datamaps_dict, a dict containing the results of bleaching on the subdatamaps. Without
+                 bleaching, the subdatamaps are read-only views of the ones of the datamap. The subdatamaps of a
+                 virtually padded datamap are the ones of the window of the acquisition (see
+                 :meth:`Datamap.crop_window`).
+                 temporal_acq_elts, a dict containing the intensity of the acquisition (``"intensity"``), used for
+                 interrupted acquisitions
+        """
+        seed = utils.acquisition_seed(seed, acquisition_id)
+        if isinstance(seed, (numpy.random.Generator, numpy.random.SeedSequence)):
+            # The detection is sampled from a generator of the seed
+            seed = numpy.random.default_rng(seed)
+        elif seed is not None:
             numpy.random.seed(seed)
         datamap_pixelsize = datamap.pixelsize
         i_ex, i_sted, psf_det = self.cache(datamap_pixelsize)
@@ -1159,13 +1307,19 @@ class Microscope:
             # demander au dude de setter une roi
             datamap.set_roi(i_ex)
 
+        # A virtually padded datamap is acquired on the window of its ROI, which is written back at the update
+        padded_datamap = None
+        if getattr(datamap, "virtual_padding", False):
+            padded_datamap, datamap = datamap, datamap.crop_window(i_ex)
+
         datamap_roi = datamap.whole_datamap[datamap.roi]
 
-        # convert scalar values to arrays if they aren't already arrays
-        # C funcs need pre defined types, so in order to only have 1 general case C func, I convert scalars to arrays
-        pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape)
-        p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape)
-        p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape)
+        # The scalar values are kept for the bank and broadcast without copy to the shape of the ROI for the C funcs
+        # which are indexed per pixel
+        bank_params = (p_ex, p_sted, pdt)
+        pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape, copy=False)
+        p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape, copy=False)
+        p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape, copy=False)
 
         if not filter_bypass:
             pixel_list = utils.pixel_list_filter(datamap_roi, pixel_list, pixelsize, datamap_pixelsize)
@@ -1175,51 +1329,50 @@ class Microscope:
             acquired_intensity = numpy.zeros((int(numpy.ceil(datamap_roi.shape[0] / ratio)),
                                               int(numpy.ceil(datamap_roi.shape[1] / ratio))))
 
-        rows_pad, cols_pad = datamap.roi_corners['tl'][0], datamap.roi_corners['tl'][1]
-        laser_pad = i_ex.shape[0] // 2
-
-        if prob_ex is None:
-            prob_ex = numpy.ones(datamap.whole_datamap.shape)
-        if prob_sted is None:
-            prob_sted = numpy.ones(datamap.whole_datamap.shape)
-        
-        bleached_sub_datamaps_dict = {}
+        # Without bleaching the sub datamaps are not modified and read-only views are returned instead of copies
         if isinstance(indices, type(None)):
             indices = {"flashes": 0}
-        for key in datamap.sub_datamaps_dict:
-            bleached_sub_datamaps_dict[key] = numpy.copy(datamap.sub_datamaps_dict[key].astype(numpy.int64))
-
-        if seed is None:
-            seed = 0
-
-        if steps is None:
-            steps = [pdt]
+        if bleach:
+            bleached_sub_datamaps_dict = datamap.sub_datamaps_dict.counts()
         else:
-            for idx, step in enumerate(steps):
-                steps[idx] = utils.float_to_array_verifier(step, datamap_roi.shape)
-
-        raster_func = raster.raster_func_c_self_bleach_split_g
-        sample_func = bleach_funcs.sample_molecules
-        raster_func(self, datamap, acquired_intensity, numpy.array(pixel_list).astype(numpy.int32), ratio, rows_pad,
-                    cols_pad, laser_pad, prob_ex, prob_sted, pdt, p_ex, p_sted, bleach, bleached_sub_datamaps_dict,
-                    seed, bleach_func, sample_func, steps)
+            bleached_sub_datamaps_dict = datamap.sub_datamaps_dict.counts(copy=False)
+            bleached_sub_datamaps_dict.stack = bleached_sub_datamaps_dict.stack.view()
+            bleached_sub_datamaps_dict.stack.flags.writeable = False
+
+        key = utils.rng_key(seed)
+
+        # Without bleaching the whole image is computed at once
+        if bleach or self.get_intensity_no_bleach(datamap, acquired_intensity, pixel_list, ratio,
+                                                  p_ex, p_sted) is None:
+            raster_func = raster.raster_func_c_self_bleach_split_g
+            sample_func = bleach_funcs.sample_molecules
+            bank = self.get_bank(datamap_pixelsize, *bank_params, grid_size=parameter_grid, energy=psf_energy)
+            if (num_threads is not None) and not raster.scans_without_gil(bank, bleach, bleach_func, sample_func):
+                warnings.warn(f"num_threads={num_threads} is ignored and the pixels are acquired in order, as the "
+                              "tiled acquisition requires the scan without the GIL (see "
+                              "pysted.raster.raster_func_c_self_bleach_split_g): use an interpolation grid "
+                              "(parameter_grid) for more than 256 unique imaging parameters, and a bleaching "
+                              "function with a C implementation.")
+            raster_func(self, datamap, acquired_intensity, utils.as_pixel_array(pixel_list), ratio, pdt, p_ex, p_sted,
+                        bleach, bleached_sub_datamaps_dict, key, bleach_func, sample_func, bank, num_threads)
 
         # Bleaching is done, the rest is for intensity calculation
         photons = self.fluo.get_photons(acquired_intensity)
 
-        if photons.shape == pdt.shape:
+        if isinstance(bank_params[2], (float, numpy.floating)):
+            returned_acquired_photons = self.detector.get_signal(photons, bank_params[2], self.sted.rate, seed=seed)
+        elif photons.shape == pdt.shape:
             returned_acquired_photons = self.detector.get_signal(photons, pdt, self.sted.rate, seed=seed)
         else:
-            pixeldwelltime_reshaped = numpy.zeros((int(numpy.ceil(pdt.shape[0] / ratio)),
-                                                   int(numpy.ceil(pdt.shape[1] / ratio))))
-            new_pdt_plist = utils.pixel_sampling(pixeldwelltime_reshaped, mode='all')
-            for (row, col) in new_pdt_plist:
-                pixeldwelltime_reshaped[row, col] = pdt[row * ratio, col * ratio]
+            pixeldwelltime_reshaped = pdt[::ratio, ::ratio]
             returned_acquired_photons = self.detector.get_signal(photons, pixeldwelltime_reshaped, self.sted.rate, seed=seed)
 
-        unbleached_whole_datamap = numpy.copy(datamap.whole_datamap)
+        # The whole datamap is replaced, not modified, by the update such that it is kept without copy
+        unbleached_whole_datamap = datamap.whole_datamap
 
-        if update and bleach:
+        if update and bleach and (padded_datamap is not None):
+            padded_datamap.paste_window(datamap.origin, bleached_sub_datamaps_dict)
+        elif update and bleach:
             datamap.sub_datamaps_dict = bleached_sub_datamaps_dict
             datamap.base_datamap = datamap.sub_datamaps_dict["base"]
             datamap.whole_datamap = numpy.copy(datamap.base_datamap)
@@ -1229,12 +1382,199 @@ class Microscope:
                 elif bleach_mode == "proportional":
                     datamap.bleach_future_proportional(indices, bleached_sub_datamaps_dict, unbleached_whole_datamap)
 
-        temporal_acq_elts = {"intensity": acquired_intensity,
-                             "prob_ex": prob_ex,
-                             "prob_sted": prob_sted}
+        temporal_acq_elts = {"intensity": acquired_intensity}
 
         return returned_acquired_photons, bleached_sub_datamaps_dict, temporal_acq_elts
 
+    def get_signal_and_bleach_batch(self, datamaps, pixelsize, pdt, p_ex, p_sted, pixel_list=None, bleach=True,
+                                    update=True, seed=None, filter_bypass=False, datamap_pixelsize=None,
+                                    num_threads=None, psf_energy=None, acquisition_id=0):
+        """
+        Acquires the signal and bleaches simultaneously a batch of datamaps of the same shape.
+
+        The setup of the acquisition (the pixel list, the effective PSFs and the photobleaching rates) is done once for
+        the whole batch and the datamaps are acquired in a single call of
+        :func:`~pysted.raster.raster_func_batch` with the default photobleaching functions. The imaging parameters
+        may differ between the datamaps.
+
+        The seed is split in a child ``numpy.random.SeedSequence`` per datamap with ``spawn``, such that the
+        acquisition of the datamap ``i`` is the one of :meth:`get_signal_and_bleach` with the ``i``-th child as seed.
+
+        :param datamaps: Either a sequence of Datamap objects with the same shape of ROI and the same sub datamaps, or a
+                         3D array of the number of molecules of the datamaps, of shape (datamaps, rows, columns), whose
+                         whole extent is imaged (as a Datamap with the ROI set to ``"max"``). Flashes are not supported.
+        :param pixelsize: The pixelsize of the acquisition. (m)
+        :param pdt: The pixel dwelltime. Either a single float value, an array of the shape of the ROI or an array of
+                    shape (datamaps, rows, columns) of the ROI of every datamap. (s)
+        :param p_ex: The excitation beam power, shaped as *pdt*. (W)
+        :param p_sted: The depletion beam power, shaped as *pdt*. (W)
+        :param pixel_list: The list of pixels to be iterated on in every datamap. If none, a pixel_list of a raster scan
+                           will be generated. (list of tuples (row, col))
+        :param bleach: Determines whether bleaching is active or not. (Bool)
+        :param update: Determines whether the Datamap objects are updated in place. (Bool)
+        :param seed: Sets a seed for the random number generator. Either an int, a ``numpy.random.SeedSequence`` or a
+                     ``numpy.random.Generator`` from which the key of the batch is drawn.
+        :param filter_bypass: Whether or not to filter the pixel list (see :meth:`get_signal_and_bleach`).
+        :param datamap_pixelsize: The size of a pixel of the datamaps given as an array. (m)
+        :param num_threads: The number of threads acquiring the datamaps. If None, the datamaps are acquired in order
+                            in the calling thread.
+        :param psf_energy: The fraction of the energy of the effective PSF and of the photobleaching rates kept in the
+                           footprint of the laser (see :meth:`get_signal_and_bleach`).
+        :param acquisition_id: The index of the batch among the batches acquired with the same seed (see
+                               :meth:`get_signal_and_bleach`).
+
+        :return: A 3D array of the acquired photons of every datamap.
+                 The bleached datamaps, a 3D array of the number of molecules for an array of datamaps, otherwise a list
+                 of the dicts of the bleached sub datamaps of every datamap, or of its window if it is virtually
+                 padded (see :meth:`Datamap.crop_window`).
+        """
+        is_array = isinstance(datamaps, numpy.ndarray)
+        if is_array:
+            if datamap_pixelsize is None:
+                raise ValueError("The pixel size of an array of datamaps must be given with datamap_pixelsize")
+        else:
+            datamaps = list(datamaps)
+            datamap_pixelsize = datamaps[0].pixelsize
+        num_datamaps = len(datamaps)
+        i_ex, _, _ = self.cache(datamap_pixelsize)
+
+        if is_array:
+            roi_shape = datamaps.shape[1:]
+            rows_pad, cols_pad = i_ex.shape[0] // 2, i_ex.shape[1] // 2
+            sub_datamaps = numpy.pad(datamaps.astype(numpy.int64)[:, numpy.newaxis],
+                                     ((0, 0), (0, 0), (rows_pad, rows_pad), (cols_pad, cols_pad)), "constant")
+            sparse = None
+        else:
+            for datamap in datamaps:
+                if datamap.roi is None:
+                    datamap.set_roi(i_ex)
+                if datamap.contains_sub_datamaps.get("flashes", False):
+                    raise ValueError("Datamaps with flashes cannot be acquired in a batch")
+            # The virtually padded datamaps are acquired on the windows of their ROI
+            padded_datamaps = datamaps
+            datamaps = [datamap.crop_window(i_ex) if getattr(datamap, "virtual_padding", False) else datamap
+                        for datamap in datamaps]
+            names = list(datamaps[0].sub_datamaps_dict)
+            roi_shape = datamaps[0].whole_datamap[datamaps[0].roi].shape
+            if any((list(datamap.sub_datamaps_dict) != names) or
+                   (datamap.whole_datamap[datamap.roi].shape != roi_shape) or
+                   (datamap.whole_datamap.shape != datamaps[0].whole_datamap.shape) for datamap in datamaps):
+                raise ValueError("The datamaps of a batch must have the same shape and sub datamaps")
+            sub_datamaps = numpy.stack([datamap.sub_datamaps_dict.counts(copy=False).stack for datamap in datamaps])
+            sparse = getattr(datamaps[0], "sparse", None)
+
+        # The imaging parameters of the datamaps are stacked along the rows in a single bank
+        shape = (num_datamaps, *roi_shape)
+        pdt, p_ex, p_sted = (numpy.broadcast_to(numpy.asarray(param, dtype=numpy.float64), shape)
+                             for param in (pdt, p_ex, p_sted))
+        bank = ParameterBank(self, datamap_pixelsize,
+                             *(param.reshape(-1, roi_shape[1]) for param in (p_ex, p_sted, pdt)),
+                             max_unique=numpy.inf, energy=psf_energy)
+
+        if not filter_bypass:
+            pixel_list = utils.pixel_list_filter(numpy.empty(roi_shape), pixel_list, pixelsize, datamap_pixelsize)
+        ratio = utils.pxsize_ratio(pixelsize, datamap_pixelsize)
+        acquired_intensity = numpy.zeros((num_datamaps, int(numpy.ceil(roi_shape[0] / ratio)),
+                                          int(numpy.ceil(roi_shape[1] / ratio))))
+
+        # Every datamap is acquired with the generator of a child of the seed, as in get_signal_and_bleach
+        seed = utils.acquisition_seed(seed, acquisition_id)
+        if isinstance(seed, numpy.random.SeedSequence):
+            root = seed
+        elif isinstance(seed, numpy.random.Generator):
+            root = numpy.random.SeedSequence(utils.rng_key(seed))
+        else:
+            root = numpy.random.SeedSequence(seed)
+        generators = [numpy.random.default_rng(child) for child in root.spawn(num_datamaps)]
+        keys = numpy.array([utils.rng_key(generator) for generator in generators], dtype=numpy.uint64)
+
+        raster.raster_func_batch(self, sub_datamaps, acquired_intensity, utils.as_pixel_array(pixel_list),
+                                 ratio, bleach, keys, bank, sparse, num_threads)
+
+        photons = self.fluo.get_photons(acquired_intensity)
+        pdt = pdt[:, ::ratio, ::ratio]
+        returned_acquired_photons = numpy.stack([
+            self.detector.get_signal(photons[i], pdt[i], self.sted.rate, seed=generators[i])
+            for i in range(num_datamaps)
+        ])
+
+        if is_array:
+            bleached = sub_datamaps[:, 0, rows_pad:sub_datamaps.shape[2] - rows_pad,
+                                    cols_pad:sub_datamaps.shape[3] - cols_pad]
+            return returned_acquired_photons, bleached
+
+        bleached = [SubDatamaps.from_stack(names, item) for item in sub_datamaps]
+        if update and bleach:
+            for padded_datamap, datamap, bleached_sub_datamaps_dict in zip(padded_datamaps, datamaps, bleached):
+                if padded_datamap is not datamap:
+                    padded_datamap.paste_window(datamap.origin, bleached_sub_datamaps_dict)
+                    continue
+                datamap.sub_datamaps_dict = bleached_sub_datamaps_dict
+                datamap.base_datamap = datamap.sub_datamaps_dict["base"]
+                datamap.whole_datamap = numpy.copy(datamap.base_datamap)
+        return returned_acquired_photons, bleached
+
+    def get_expected_signal_and_bleach(self, datamap, pixelsize, pdt, p_ex, p_sted, pixel_list=None, bleach=True,
+                                       filter_bypass=False, psf_energy=None):
+        """
+        Computes the expected acquisition and photobleaching of :meth:`get_signal_and_bleach` in a single deterministic
+        pass.
+
+        The expected number of molecules of every position is carried as a float and multiplied by its survival
+        probability under the laser in the order of the pixel list (see :func:`~pysted.raster.raster_func_mean_field`),
+        instead of averaging many stochastic acquisitions. The expectations are the ones of the default photobleaching
+        functions.
+
+        :param datamap: The datamap on which the acquisition is done. It is not updated.
+        :param pixelsize: The pixelsize of the acquisition. (m)
+        :param pdt: The pixel dwelltime. Can be either a single float value or an array of the same size as the ROI
+                    being imaged. (s)
+        :param p_ex: The excitation beam power. Can be either a single float value or an array of the same size as the
+                     ROI being imaged. (W)
+        :param p_sted: The depletion beam power. Can be either a single float value or an array of the same size as the
+                       ROI being imaged. (W)
+        :param pixel_list: The list of pixels to be iterated on. If none, a pixel_list of a raster scan will be
+                           generated.
+        :param bleach: Determines whether bleaching is active or not. (Bool)
+        :param filter_bypass: Whether or not to filter the pixel list (see :meth:`get_signal_and_bleach`).
+        :param psf_energy: The fraction of the energy of the effective PSF and of the photobleaching rates kept in the
+                           footprint of the laser (see :meth:`get_signal_and_bleach`).
+
+        :return: expected_photons, the expected emitted photons of every pixel of the acquisition, before the detection.
+                 The expected detected photons are given by :meth:`Detector.get_expected_signal`.
+                 expected_sub_datamaps_dict, a dict of the expected number of molecules (float) of the sub datamaps
+                 after bleaching.
+                 acquired_intensity, the expected intensity of the acquisition.
+        """
+        datamap_pixelsize = datamap.pixelsize
+        i_ex, _, _ = self.cache(datamap_pixelsize)
+        if datamap.roi is None:
+            datamap.set_roi(i_ex)
+        if getattr(datamap, "virtual_padding", False):
+            datamap = datamap.crop_window(i_ex)
+        roi_shape = datamap.whole_datamap[datamap.roi].shape
+
+        if all(isinstance(param, (float, numpy.floating)) for param in (p_ex, p_sted, pdt)):
+            bank = self.get_bank(datamap_pixelsize, p_ex, p_sted, pdt, energy=psf_energy)
+        else:
+            p_ex, p_sted, pdt = (utils.float_to_array_verifier(param, roi_shape, copy=False)
+                                 for param in (p_ex, p_sted, pdt))
+            bank = ParameterBank(self, datamap_pixelsize, p_ex, p_sted, pdt, max_unique=numpy.inf,
+                                 energy=psf_energy)
+
+        if not filter_bypass:
+            pixel_list = utils.pixel_list_filter(datamap.whole_datamap[datamap.roi], pixel_list, pixelsize,
+                                                 datamap_pixelsize)
+        ratio = utils.pxsize_ratio(pixelsize, datamap_pixelsize)
+        acquired_intensity = numpy.zeros((int(numpy.ceil(roi_shape[0] / ratio)), int(numpy.ceil(roi_shape[1] / ratio))))
+
+        sub_datamaps = datamap.sub_datamaps_dict.astype(numpy.float64)
+        raster.raster_func_mean_field(acquired_intensity, utils.as_pixel_array(pixel_list), ratio, bleach,
+                                      sub_datamaps.stack, bank, roi_shape)
+
+        expected_photons = self.fluo.get_photons(acquired_intensity, discrete=False)
+        return expected_photons, sub_datamaps, acquired_intensity
+
     def add_to_pixel_bank(self, n_pixels_per_tstep):
         """
         Adds the residual pixels to the pixel bank
@@ -1264,34 +1604,195 @@ class Microscope:
         """
         self.pixel_bank = 0
 
+class SubDatamaps(collections.abc.MutableMapping):
+    """
+    This class implements the layers of a datamap (e.g. the 'base' and the 'flashes'), stored in a single array.
+
+    The layers are stacked along the first axis of `stack`, of shape (layers, rows, columns), and are accessed by
+    name, as views onto the stack, such that it is used as the dict of the sub datamaps. The kernels read all the
+    layers of a footprint from the stack and the operations on all the layers (e.g. :meth:`total`) are vectorized.
+
+    Assigning an existing layer copies the values in the stack, while assigning a new layer appends it to the stack.
+    The molecule counts are kept in the compact type of the stack (see :func:`~pysted.utils.promote_counts`), which is
+    only promoted when a count of the assigned layer does not fit in it.
+
+    :param layers: A dict of the layers, 2D arrays of the same shape. (optional)
+    """
+
+    def __init__(self, layers=None):
+        self.names = {}
+        self.stack = None
+        if layers:
+            self.names = {name: index for index, name in enumerate(layers)}
+            self.stack = numpy.stack([numpy.asarray(layers[name]) for name in self.names])
+
+    @classmethod
+    def from_stack(cls, names, stack):
+        """
+        Wraps a stack of layers, without copy.
+
+        :param names: The names of the layers, in the order of the stack.
+        :param stack: A 3D array of the layers, of shape (layers, rows, columns).
+        :returns: A `SubDatamaps` object.
+        """
+        if len(names) != len(stack):
+            raise ValueError(f"{len(names)} names were given for a stack of {len(stack)} layers.")
+        sub_datamaps = cls()
+        sub_datamaps.names = {name: index for index, name in enumerate(names)}
+        sub_datamaps.stack = stack
+        return sub_datamaps
+
+    def __getitem__(self, name):
+        return self.stack[self.names[name]]
+
+    def __setitem__(self, name, value):
+        value = numpy.asarray(value)
+        if self.stack is not None and value.shape != self.stack.shape[1:]:
+            if list(self.names) != [name]:
+                raise ValueError(f"Layer '{name}' of shape {value.shape} does not match the shape "
+                                 f"{self.stack.shape[1:]} of the other layers.")
+            # The only layer is replaced, e.g. when the ROI is set again
+            self.names, self.stack = {}, None
+        if self.stack is None:
+            self.names[name] = 0
+            self.stack = value[numpy.newaxis].copy()
+            return
+        if (self.stack.dtype in utils.COUNT_DTYPES) and (value.dtype in utils.COUNT_DTYPES):
+            self.promote(utils.promote_counts(self.stack.dtype, value))
+        elif name not in self.names:
+            self.promote(value.dtype)
+        if name in self.names:
+            self.stack[self.names[name]] = value
+        else:
+            self.names[name] = len(self.stack)
+            self.stack = numpy.concatenate((self.stack, value[numpy.newaxis].astype(self.stack.dtype, copy=False)))
+
+    def __delitem__(self, name):
+        index = self.names.pop(name)
+        self.names = {key: i - (i > index) for key, i in self.names.items()}
+        self.stack = numpy.delete(self.stack, index, axis=0) if self.names else None
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return f"SubDatamaps({list(self.names)}, shape={None if self.stack is None else self.stack.shape})"
+
+    def copy(self):
+        """
+        Copies the layers.
+
+        :returns: A `SubDatamaps` object.
+        """
+        return self.astype(self.stack.dtype)
+
+    def astype(self, dtype, copy=True):
+        """
+        Casts the layers to a type.
+
+        :param dtype: The type of the layers.
+        :param copy: If False, the stack is not copied when it is already of the type.
+        :returns: A `SubDatamaps` object.
+        """
+        return SubDatamaps.from_stack(list(self.names), self.stack.astype(dtype, copy=copy))
+
+    def counts(self, copy=True):
+        """
+        Returns the layers as molecule counts, e.g. to be bleached by the raster kernels. A stack of
+        :attr:`~pysted.utils.COUNT_DTYPES` keeps its type while other types (e.g. floats) are cast to int64.
+
+        :param copy: If False, the stack is not copied when it is already of the type.
+        :returns: A `SubDatamaps` object.
+        """
+        dtype = self.stack.dtype if self.stack.dtype in utils.COUNT_DTYPES else numpy.int64
+        return self.astype(dtype, copy=copy)
+
+    def promote(self, dtype):
+        """
+        Casts the stack in place to a type which holds the values of a type, if it does not already.
+
+        :param dtype: The type of the values.
+        """
+        dtype = numpy.promote_types(self.stack.dtype, dtype)
+        if dtype != self.stack.dtype:
+            self.stack = self.stack.astype(dtype)
+
+    def total(self):
+        """
+        Sums the layers.
+
+        :returns: A 2D array of the number of molecules in every pixel.
+        """
+        return self.stack.sum(axis=0)
+
+
 class Datamap:
     """
     This class implements a datamap, containing a disposition of molecules and a ROI to image.
 
     The Datamap can be a composition of multiple parts, for instance, a 'base', which is static, a 'flashes' part,
     which represents only the flashes occuring in the Datamap, or a 'diffusing' part, which would represent only
-    the moving molecules in the Datamap.
+    the moving molecules in the Datamap. The parts are stored as the layers of a single array (see
+    :class:`SubDatamaps`).
     The ROI represents the portion of the Datamap that will be imaged. Since the microscope's lasers are represented by
     arrays, we must ensure that the laser array's edges are contained within the whole Datamap array for every pixel
     of the ROI. To facilitated this, the ROI can be set to 'max', which will simply 0 pad the passed whole_datamap so
     the laser stays confined when scanning over the pixels of the whole_datamap.
 
+    Most datamaps are mostly empty. During an acquisition with bleaching, the emitters under the laser are then found
+    from a sparse index of the occupied pixels instead of visiting every pixel of the laser (see
+    :func:`~pysted.raster.raster_func_c_self_bleach_split_g`).
+
     :param whole_datamap: The disposition of the molecules in the sample. This represents the whole sample, from which
                           only a region will be imaged (roi). (numpy array)
     :param datamap_pixelsize: The size of a pixel of the datamap. (m)
+    :param sparse: Whether the emitters are found from the sparse index of the occupied pixels. If None, the index is
+                   used when at most half of the pixels are occupied.
+    :param dtype: The type in which the molecule counts are stored, one of :attr:`~pysted.utils.COUNT_DTYPES`. A more
+                  compact type reduces the memory of large datamaps and of the flashes. The type is promoted when a
+                  count does not fit in it (see :func:`~pysted.utils.promote_counts`).
+    :param copy: If False, a whole_datamap of type *dtype*, e.g. a ``numpy.memmap`` or any array exposing the buffer
+                 protocol, is kept without copy. With *virtual_padding*, it is then bleached in place, unless it is
+                 read-only in which case it is copied at the first update. A ``numpy.memmap`` opened with
+                 ``mode="c"`` is bleached in a copy-on-write overlay of the file, whose memory is proportional to the
+                 bleached pages.
+    :param virtual_padding: If True, the datamap is never padded nor copied by :meth:`set_roi`. The acquisitions are
+                            done on the window of the ROI and of the halo of the laser (see :meth:`crop_window`), in
+                            which the positions outside of the datamap are zeros, such that very large samples are
+                            imaged with a memory proportional to the ROI. Flashes are not supported.
 
     """
 
-    def __init__(self, whole_datamap, datamap_pixelsize):
-        self.whole_datamap = numpy.copy(whole_datamap.astype(numpy.int32))
+    def __init__(self, whole_datamap, datamap_pixelsize, sparse=None, dtype=numpy.int32, copy=True,
+                 virtual_padding=False):
+        self.dtype = numpy.dtype(dtype)
+        self.whole_datamap = utils.as_counts(whole_datamap, self.dtype, copy=copy)
         self.whole_shape = self.whole_datamap.shape
         self.pixelsize = datamap_pixelsize
+        self.sparse = sparse
+        self.virtual_padding = virtual_padding
         self.roi = None
         self.roi_corners = None
         self.contains_sub_datamaps = {"base": True,
                                       "flashes": False}
         self.sub_datamaps_dict = {}
 
+    @property
+    def sub_datamaps_dict(self):
+        """
+        The layers of the datamap, stored in a `SubDatamaps` object. A dict assigned to it is stacked.
+        """
+        return self._sub_datamaps
+
+    @sub_datamaps_dict.setter
+    def sub_datamaps_dict(self, layers):
+        if not isinstance(layers, SubDatamaps):
+            layers = SubDatamaps(layers)
+        self._sub_datamaps = layers
+
     def __getitem__(self, key):
         return self.sub_datamaps_dict[key]
 
@@ -1304,9 +1805,13 @@ class Datamap:
         :param laser: An array of the same shape as the lasers which will be used on the datamap
         :param intervals: Values to set the ROI to. Either 'max', a dict like {'rows': [min_row, max_row],
                           'cols': [min_col, max_col]} or None. If 'max', the whole datamap will be padded with 0s, and
-                          the original array will be used as ROI. If None, will prompt the user to enter an ROI.
+                          the original array will be used as ROI. If None, will prompt the user to enter an ROI. A
+                          virtually padded datamap is not padded and its ROI may extend to its edges.
         """
         rows_min, cols_min = laser.shape[0] // 2, laser.shape[1] // 2
+        if self.virtual_padding:
+            # The laser may leave the datamap, whose positions outside are zeros
+            rows_min, cols_min = 0, 0
         rows_max, cols_max = self.whole_datamap.shape[0] - rows_min - 1, self.whole_datamap.shape[1] - cols_min - 1
 
         if intervals is None:
@@ -1336,14 +1841,11 @@ class Datamap:
 
         elif intervals == 'max':
             # User wants the maximal interval
-            self.whole_datamap, rows_pad, cols_pad = utils.array_padder(self.whole_datamap, laser)
-            self.roi = (slice(rows_pad, self.whole_datamap.shape[0] - rows_pad),
-                        slice(cols_pad, self.whole_datamap.shape[1] - cols_pad))
-            self.roi_corners = {'tl': (rows_pad, cols_pad),
-                                'tr': (rows_pad, self.whole_datamap.shape[1] - cols_pad - 1),
-                                'bl': (self.whole_datamap.shape[0] - rows_pad - 1, cols_pad),
-                                'br': (self.whole_datamap.shape[0] - rows_pad - 1,
-                                       self.whole_datamap.shape[1] - cols_pad - 1)}
+            if self.virtual_padding:
+                self.set_max_roi(0, 0)
+            else:
+                self.whole_datamap, rows_pad, cols_pad = utils.array_padder(self.whole_datamap, laser)
+                self.set_max_roi(rows_pad, cols_pad)
 
         elif type(intervals) is dict:
             # User used a dict of intervals with rows/cols
@@ -1364,8 +1866,87 @@ class Datamap:
         else:
             raise ValueError("intervals parameter must be either None, 'max' or dict")
 
-        self.base_datamap = numpy.copy(self.whole_datamap)
-        self.sub_datamaps_dict["base"] = self.base_datamap
+        # A virtually padded datamap is bleached in place (see paste_window), such that its base is the whole datamap
+        self.base_datamap = self.whole_datamap if self.virtual_padding else numpy.copy(self.whole_datamap)
+        if set(self.sub_datamaps_dict) - {"base"}:
+            self.sub_datamaps_dict["base"] = self.base_datamap
+        else:
+            # The base is the only layer, which is stacked without copy
+            self.sub_datamaps_dict = SubDatamaps.from_stack(["base"], self.base_datamap[numpy.newaxis])
+
+    def set_max_roi(self, rows_pad, cols_pad):
+        """
+        Sets the ROI to the whole datamap but a margin.
+
+        :param rows_pad: The number of rows of the margin at the top and at the bottom of the datamap
+        :param cols_pad: The number of columns of the margin at the left and at the right of the datamap
+        """
+        rows, cols = self.whole_datamap.shape
+        self.roi = (slice(rows_pad, rows - rows_pad), slice(cols_pad, cols - cols_pad))
+        self.roi_corners = {'tl': (rows_pad, cols_pad),
+                            'tr': (rows_pad, cols - cols_pad - 1),
+                            'bl': (rows - rows_pad - 1, cols_pad),
+                            'br': (rows - rows_pad - 1, cols - cols_pad - 1)}
+
+    def window_bounds(self, origin, shape):
+        """
+        Finds the part of a window (see :meth:`crop_window`) which lies within the datamap.
+
+        :param origin: The position of the top left corner of the window in the datamap
+        :param shape: The shape of the window
+        :returns: A tuple of the rows and columns of the part in the datamap, and of the rows and columns of the part in
+                  the window (slices)
+        """
+        (top, left), (height, width) = origin, shape
+        rows = slice(max(top, 0), max(top, min(top + height, self.whole_datamap.shape[0])))
+        cols = slice(max(left, 0), max(left, min(left + width, self.whole_datamap.shape[1])))
+        return rows, cols, slice(rows.start - top, rows.stop - top), slice(cols.start - left, cols.stop - left)
+
+    def crop_window(self, laser):
+        """
+        Crops the window of the ROI and of the halo of the laser around it from a virtually padded datamap.
+
+        The positions of the window outside of the datamap are zeros, such that the window is the ROI padded as by
+        ``set_roi(laser, 'max')``, on which the raster kernels read the laser footprints. Only the window is copied.
+
+        :param laser: An array of the same shape as the lasers which will be used on the datamap
+        :returns: A `Datamap` of the window with the ROI of the datamap. Its ``origin`` is the position of its top left
+                  corner in the datamap.
+        """
+        if self.contains_sub_datamaps.get("flashes", False):
+            raise ValueError("Datamaps with flashes cannot be virtually padded")
+        rows_pad, cols_pad = utils.pad_values(laser)
+        origin = (self.roi[0].start - rows_pad, self.roi[1].start - cols_pad)
+        shape = (self.roi[0].stop - self.roi[0].start + 2 * rows_pad,
+                 self.roi[1].stop - self.roi[1].start + 2 * cols_pad)
+        names, stack = list(self.sub_datamaps_dict), self.sub_datamaps_dict.stack
+
+        window_stack = numpy.zeros((len(stack), *shape), dtype=stack.dtype)
+        rows, cols, window_rows, window_cols = self.window_bounds(origin, shape)
+        window_stack[:, window_rows, window_cols] = stack[:, rows, cols]
+
+        window = Datamap(utils.add_counts(*window_stack) if len(names) > 1 else window_stack[0], self.pixelsize,
+                         sparse=self.sparse, dtype=self.dtype, copy=False)
+        window.origin = origin
+        window.set_max_roi(rows_pad, cols_pad)
+        window.sub_datamaps_dict = SubDatamaps.from_stack(names, window_stack)
+        window.base_datamap = window.sub_datamaps_dict["base"]
+        return window
+
+    def paste_window(self, origin, bleached_sub_datamaps_dict):
+        """
+        Writes the bleached sub datamaps of a window (see :meth:`crop_window`) in place in the datamap.
+
+        :param origin: The position of the top left corner of the window in the datamap
+        :param bleached_sub_datamaps_dict: The bleached sub datamaps of the window
+        """
+        rows, cols, window_rows, window_cols = self.window_bounds(origin, bleached_sub_datamaps_dict.stack.shape[1:])
+        if not self.sub_datamaps_dict.stack.flags.writeable:
+            # A read-only datamap, e.g. a numpy.memmap opened with mode 'r', is copied at the first update
+            self.sub_datamaps_dict.stack = numpy.array(self.sub_datamaps_dict.stack)
+        self.sub_datamaps_dict.stack[:, rows, cols] = bleached_sub_datamaps_dict.stack[:, window_rows, window_cols]
+        self.base_datamap = self.sub_datamaps_dict["base"]
+        self.whole_datamap = self.base_datamap
 
     def set_bleached_datamap(self, bleached_datamap):
         """
@@ -1401,10 +1982,12 @@ class TemporalDatamap(Datamap):
                           only a region will be imaged (roi). (numpy array)
     :param datamap_pixelsize: The size of a pixel of the datamap. (m)
     :param synapses: The list of synapses present in the whole_datamap
+    :param sparse: Whether the emitters are found from the sparse index of the occupied pixels (see :class:`Datamap`).
+    :param dtype: The type in which the molecule counts, including the flashes, are stored (see :class:`Datamap`).
     """
 
-    def __init__(self, whole_datamap, datamap_pixelsize, synapses):
-        super().__init__(whole_datamap, datamap_pixelsize)
+    def __init__(self, whole_datamap, datamap_pixelsize, synapses, sparse=None, dtype=numpy.int32):
+        super().__init__(whole_datamap, datamap_pixelsize, sparse=sparse, dtype=dtype)
         # add flat synapses list as attribute
         self.synapses = synapses
         self.contains_sub_datamaps = {"base": True,
@@ -1459,6 +2042,7 @@ class TemporalDatamap(Datamap):
         self.flash_tstack[-1] = temp_dmap - self.base_datamap   # le petit dernier pour la route
         self.contains_sub_datamaps["flashes"] = True
         self.sub_datamaps_idx_dict["flashes"] = 0
+        self.flash_tstack = utils.as_counts(self.flash_tstack, self.dtype)
         self.sub_datamaps_dict["flashes"] = self.flash_tstack[0]
         self.update_whole_datamap(0)
 
@@ -1472,22 +2056,19 @@ class TemporalDatamap(Datamap):
                         indices = {"flashes": idx}, with idx being an >=0 integer.
         :param bleached_sub_datamaps_dict: A dictionary containing the bleached subdatamaps (base, flashes)
         """
-        what_bleached = self.flash_tstack[indices["flashes"]] - bleached_sub_datamaps_dict["flashes"]
+        what_bleached = (self.flash_tstack[indices["flashes"]].astype(numpy.int64)
+                         - bleached_sub_datamaps_dict["flashes"])
         self.flash_tstack[indices["flashes"]] = bleached_sub_datamaps_dict["flashes"]
         # UPDATE THE FUTURE
         with numpy.errstate(divide='ignore', invalid='ignore'):
             flash_survival = bleached_sub_datamaps_dict["flashes"] / self.flash_tstack[indices["flashes"]]
         flash_survival[numpy.isnan(flash_survival)] = 1
-        self.flash_tstack[indices["flashes"] + 1:] -= what_bleached
-        self.flash_tstack[indices["flashes"] + 1:] = numpy.multiply(
-            self.flash_tstack[indices["flashes"] + 1:],
-            flash_survival)
-        self.flash_tstack[indices["flashes"] + 1:] = numpy.rint(
-            self.flash_tstack[indices["flashes"] + 1:])
-        self.flash_tstack[indices["flashes"] + 1:] = numpy.where(
-            self.flash_tstack[indices["flashes"] + 1:] < 0,
-            0, self.flash_tstack[indices["flashes"] + 1:])
-        self.whole_datamap += self.flash_tstack[indices["flashes"]]
+        # The future flashes are updated as signed integers since the compact type of the stack may be unsigned
+        future = self.flash_tstack[indices["flashes"] + 1:].astype(numpy.int64)
+        future -= what_bleached
+        future[...] = numpy.rint(future * flash_survival)
+        self.flash_tstack[indices["flashes"] + 1:] = numpy.where(future < 0, 0, future)
+        self.whole_datamap = utils.add_counts(self.whole_datamap, self.flash_tstack[indices["flashes"]])
 
     def update_whole_datamap(self, flash_idx):
         """
@@ -1497,7 +2078,7 @@ class TemporalDatamap(Datamap):
 
         :param flash_idx: The index of the flash for the most recent acquisition.
         """
-        self.whole_datamap = self.base_datamap + self.flash_tstack[flash_idx]
+        self.whole_datamap = utils.add_counts(self.base_datamap, self.flash_tstack[flash_idx])
 
     def update_dicts(self, indices):
         """
@@ -1513,9 +2094,11 @@ class TemporalDatamap(Datamap):
 class TemporalSynapseDmap(Datamap):
     """
     Temporal Datamap of a Synaptic region with nanodomains.
+
+    The molecule counts, including the flashes, are stored in ``dtype`` (see :class:`Datamap`).
     """
-    def __init__(self, whole_datamap, datamap_pixelsize, synapse_obj):
-        super().__init__(whole_datamap, datamap_pixelsize)
+    def __init__(self, whole_datamap, datamap_pixelsize, synapse_obj, dtype=numpy.int32):
+        super().__init__(whole_datamap, datamap_pixelsize, dtype=dtype)
         self.synapse = synapse_obj
         self.contains_sub_datamaps = {"base": True,
                                       "flashes": False}
@@ -1567,6 +2150,7 @@ class TemporalSynapseDmap(Datamap):
         self.nanodomains_active_currently = self.nanodomains_active[0]
         self.contains_sub_datamaps["flashes"] = True
         self.sub_datamaps_idx_dict["flashes"] = 0
+        self.flash_tstack = utils.as_counts(self.flash_tstack, self.dtype)
         self.sub_datamaps_dict["flashes"] = self.flash_tstack[0]
         self.update_whole_datamap(0)
 
@@ -1627,6 +2211,7 @@ class TemporalSynapseDmap(Datamap):
         self.nanodomains_active_currently = self.nanodomains_active[0]
         self.contains_sub_datamaps["flashes"] = True
         self.sub_datamaps_idx_dict["flashes"] = 0
+        self.flash_tstack = utils.as_counts(self.flash_tstack, self.dtype)
         self.sub_datamaps_dict["flashes"] = self.flash_tstack[0]
         self.update_whole_datamap(0)
         
@@ -1687,6 +2272,7 @@ class TemporalSynapseDmap(Datamap):
         self.nanodomains_active_currently = self.nanodomains_active[0]
         self.contains_sub_datamaps["flashes"] = True
         self.sub_datamaps_idx_dict["flashes"] = 0
+        self.flash_tstack = utils.as_counts(self.flash_tstack, self.dtype)
         self.sub_datamaps_dict["flashes"] = self.flash_tstack[0]
         self.update_whole_datamap(0)
 
@@ -1749,6 +2335,7 @@ class TemporalSynapseDmap(Datamap):
         self.nanodomains_active_currently = self.nanodomains_active[0]
         self.contains_sub_datamaps["flashes"] = True
         self.sub_datamaps_idx_dict["flashes"] = 0
+        self.flash_tstack = utils.as_counts(self.flash_tstack, self.dtype)
         self.sub_datamaps_dict["flashes"] = self.flash_tstack[0]
         self.update_whole_datamap(0)
 
@@ -1762,23 +2349,19 @@ class TemporalSynapseDmap(Datamap):
                         indices = {"flashes": idx}, with idx being an >=0 integer.
         :param bleached_sub_datamaps_dict: A dictionary containing the bleached subdatamaps (base, flashes)
         """
-        what_bleached = self.flash_tstack[indices["flashes"]] - bleached_sub_datamaps_dict["flashes"]
+        what_bleached = (self.flash_tstack[indices["flashes"]].astype(numpy.int64)
+                         - bleached_sub_datamaps_dict["flashes"])
         self.flash_tstack[indices["flashes"]] = bleached_sub_datamaps_dict["flashes"]
         # UPDATE THE FUTURE
         with numpy.errstate(divide='ignore', invalid='ignore'):
             flash_survival = bleached_sub_datamaps_dict["flashes"] / self.flash_tstack[indices["flashes"]]
         flash_survival[numpy.isnan(flash_survival)] = 1
-        self.flash_tstack[indices["flashes"] + 1:] -= what_bleached
-        self.flash_tstack[indices["flashes"] + 1:] = numpy.multiply(
-            self.flash_tstack[indices["flashes"] + 1:],
-            flash_survival)
-        self.flash_tstack[indices["flashes"] + 1:] = numpy.rint(
-            self.flash_tstack[indices["flashes"] + 1:])
-        self.flash_tstack[indices["flashes"] + 1:] = numpy.where(
-            self.flash_tstack[indices["flashes"] + 1:] < 0,
-            0, self.flash_tstack[indices["flashes"] + 1:])
-        self.flash_tstack = self.flash_tstack.astype('int64')
-        self.whole_datamap += self.flash_tstack[indices["flashes"]]
+        # The future flashes are updated as signed integers since the compact type of the stack may be unsigned
+        future = self.flash_tstack[indices["flashes"] + 1:].astype(numpy.int64)
+        future -= what_bleached
+        future[...] = numpy.rint(future * flash_survival)
+        self.flash_tstack[indices["flashes"] + 1:] = numpy.where(future < 0, 0, future)
+        self.whole_datamap = utils.add_counts(self.whole_datamap, self.flash_tstack[indices["flashes"]])
 
     def bleach_future_proportional(self, indices, bleached_sub_datamaps_dict, unbleached_whole_datamap):
         """
@@ -1787,9 +2370,7 @@ class TemporalSynapseDmap(Datamap):
         For instance, if 3/5 molecules are left after bleaching, then the number of molecules in the subsequent
         flashes will be multiplied by 3/5.
         """
-        bleached_whole_datamap = numpy.zeros(unbleached_whole_datamap.shape)
-        for key in bleached_sub_datamaps_dict:
-            bleached_whole_datamap += bleached_sub_datamaps_dict[key]
+        bleached_whole_datamap = bleached_sub_datamaps_dict.total()
         ratio = bleached_whole_datamap / numpy.where(numpy.logical_and(unbleached_whole_datamap == 0,
                                                                        bleached_whole_datamap == 0),
                                                      1, unbleached_whole_datamap)
@@ -1798,7 +2379,7 @@ class TemporalSynapseDmap(Datamap):
         # self.flash_tstack = self.flash_tstack.astype('int64')
         self.flash_tstack[indices["flashes"]:, :, :] = numpy.ceil(self.flash_tstack[indices["flashes"]:, :, :]
                                                                   * ratio).astype('int64')
-        self.whole_datamap = bleached_sub_datamaps_dict["base"] + self.flash_tstack[indices["flashes"]]
+        self.whole_datamap = utils.add_counts(bleached_sub_datamaps_dict["base"], self.flash_tstack[indices["flashes"]])
 
 
     def update_whole_datamap(self, flash_idx):
@@ -1811,7 +2392,7 @@ class TemporalSynapseDmap(Datamap):
         # If the experiment runs longer than the generated flash curve, just keep extending the final value of the curve
         if flash_idx >= self.flash_tstack.shape[0]:
             flash_idx = self.flash_tstack.shape[0] - 1
-        self.whole_datamap = self.base_datamap + self.flash_tstack[flash_idx]
+        self.whole_datamap = utils.add_counts(self.base_datamap, self.flash_tstack[flash_idx])
         self.nanodomains_active_currently = self.nanodomains_active[flash_idx]   # updates whether or not flashing rn
 
 
@@ -1830,8 +2411,8 @@ class TestTemporalDmap(Datamap):
     """
     Test class for the TemporalDatamap class
     """
-    def __init__(self, whole_datamap, datamap_pixelsize):
-        super().__init__(whole_datamap, datamap_pixelsize)
+    def __init__(self, whole_datamap, datamap_pixelsize, dtype=numpy.int32):
+        super().__init__(whole_datamap, datamap_pixelsize, dtype=dtype)
         self.contains_sub_datamaps = {"base": True,
                                       "flashes": False}
         self.sub_datamaps_idx_dict = {}
@@ -1866,6 +2447,7 @@ class TestTemporalDmap(Datamap):
 
         self.contains_sub_datamaps["flashes"] = True
         self.sub_datamaps_idx_dict["flashes"] = 0
+        self.flash_tstack = utils.as_counts(self.flash_tstack, self.dtype)
         self.sub_datamaps_dict["flashes"] = self.flash_tstack[0]
         self.update_whole_datamap(0)
 
@@ -1873,28 +2455,24 @@ class TestTemporalDmap(Datamap):
         """
         pass for now
         """
-        what_bleached = self.flash_tstack[indices["flashes"]] - bleached_sub_datamaps_dict["flashes"]
+        what_bleached = (self.flash_tstack[indices["flashes"]].astype(numpy.int64)
+                         - bleached_sub_datamaps_dict["flashes"])
         self.flash_tstack[indices["flashes"]] = bleached_sub_datamaps_dict["flashes"]
         # UPDATE THE FUTURE
         with numpy.errstate(divide='ignore', invalid='ignore'):
             flash_survival = bleached_sub_datamaps_dict["flashes"] / self.flash_tstack[indices["flashes"]]
         flash_survival[numpy.isnan(flash_survival)] = 1
-        self.flash_tstack[indices["flashes"] + 1:] -= what_bleached
-        self.flash_tstack[indices["flashes"] + 1:] = numpy.multiply(
-            self.flash_tstack[indices["flashes"] + 1:],
-            flash_survival)
-        self.flash_tstack[indices["flashes"] + 1:] = numpy.rint(
-            self.flash_tstack[indices["flashes"] + 1:])
-        self.flash_tstack[indices["flashes"] + 1:] = numpy.where(
-            self.flash_tstack[indices["flashes"] + 1:] < 0,
-            0, self.flash_tstack[indices["flashes"] + 1:])
-        self.flash_tstack = self.flash_tstack.astype('int64')
-        self.whole_datamap += self.flash_tstack[indices["flashes"]]
+        # The future flashes are updated as signed integers since the compact type of the stack may be unsigned
+        future = self.flash_tstack[indices["flashes"] + 1:].astype(numpy.int64)
+        future -= what_bleached
+        future[...] = numpy.rint(future * flash_survival)
+        self.flash_tstack[indices["flashes"] + 1:] = numpy.where(future < 0, 0, future)
+        self.whole_datamap = utils.add_counts(self.whole_datamap, self.flash_tstack[indices["flashes"]])
 
     def update_whole_datamap(self, flash_idx):
         if flash_idx >= self.flash_tstack.shape[0]:
             flash_idx = self.flash_tstack.shape[0] - 1
-        self.whole_datamap = self.base_datamap + self.flash_tstack[flash_idx]
+        self.whole_datamap = utils.add_counts(self.base_datamap, self.flash_tstack[flash_idx])
 
     def update_dicts(self, indices):
         self.sub_datamaps_idx_dict = indices
@@ -1990,7 +2568,8 @@ class TemporalExperiment():
     This temporal experiment will run on a loop based on the action selections instead of on the time to make it easier
     to integrate the agent/gym stuff :)
     """
-    def __init__(self, clock, microscope, temporal_datamap, exp_runtime, bleach=True, bleach_mode="default"):
+    def __init__(self, clock, microscope, temporal_datamap, exp_runtime, bleach=True, bleach_mode="default",
+                 seed=None):
         self.clock = clock
         self.microscope = microscope
         self.temporal_datamap = temporal_datamap
@@ -1998,6 +2577,9 @@ class TemporalExperiment():
         self.flash_tstep = 0
         self.bleach = bleach
         self.bleach_mode = bleach_mode
+        # Every (partial) acquisition of the experiment draws the independent streams of its index
+        self.seed = seed
+        self.num_acquisitions = 0
 
     def play_action(self, pdt, p_ex, p_sted):
         """
@@ -2011,8 +2593,6 @@ class TemporalExperiment():
         """
         indices = {"flashes": self.flash_tstep}
         intensity = numpy.zeros(self.temporal_datamap.whole_datamap[self.temporal_datamap.roi].shape).astype(float)
-        prob_ex = numpy.ones(self.temporal_datamap.whole_datamap.shape).astype(float)
-        prob_sted = numpy.ones(self.temporal_datamap.whole_datamap.shape).astype(float)
         action_required_time = numpy.sum(pdt) * 1e6   # this assumes a pdt given in sec * 1e-6
         action_completed_time = self.clock.current_time + action_required_time
         # +1 ensures no weird business if tha last acq completed as the dmap updated
@@ -2027,13 +2607,16 @@ class TemporalExperiment():
         # if len(dmap_times) == 0, this means the acquisition is not interupted and we can just do it whole
         # if not, then we need to split the acquisition
         if len(dmap_times) == 0:
+            acquisition_id, self.num_acquisitions = self.num_acquisitions, self.num_acquisitions + 1
             acq, bleached, temporal_acq_elts = self.microscope.get_signal_and_bleach(self.temporal_datamap,
                                                                                      self.temporal_datamap.pixelsize,
                                                                                      pdt, p_ex, p_sted,
                                                                                      indices=indices,
                                                                                      acquired_intensity=intensity,
                                                                                      bleach=self.bleach, update=True,
-                                                                                     bleach_mode=self.bleach_mode)
+                                                                                     bleach_mode=self.bleach_mode,
+                                                                                     seed=self.seed,
+                                                                                     acquisition_id=acquisition_id)
 
             intensity = temporal_acq_elts["intensity"]
             self.clock.current_time += action_required_time
@@ -2092,6 +2675,7 @@ class TemporalExperiment():
                 indices = {"flashes": key}
                 self.temporal_datamap.update_whole_datamap(key)
                 self.temporal_datamap.update_dicts(indices)
+                acquisition_id, self.num_acquisitions = self.num_acquisitions, self.num_acquisitions + 1
                 acq, bleached, temporal_acq_elts = self.microscope.get_signal_and_bleach(self.temporal_datamap,
                                                                                          self.temporal_datamap.pixelsize,
                                                                                          pdt, p_ex, p_sted,
@@ -2101,11 +2685,9 @@ class TemporalExperiment():
                                                                                          bleach_mode=self.bleach_mode,
                                                                                          update=True,
                                                                                          pixel_list=acq_pixel_list,
-                                                                                         prob_ex=prob_ex,
-                                                                                         prob_sted=prob_sted)
+                                                                                         seed=self.seed,
+                                                                                         acquisition_id=acquisition_id)
 
                 intensity = temporal_acq_elts["intensity"]
-                prob_ex = temporal_acq_elts["prob_ex"]
-                prob_sted = temporal_acq_elts["prob_sted"]
 
             return acq, bleached
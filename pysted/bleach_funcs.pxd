@@ -0,0 +1,72 @@
+'''C-level interface of the photobleaching functions.
+
+The raster kernels release the GIL when the bleaching and sampling functions
+have a C implementation. The implementations are found from the Python-callable
+functions with ``get_c_survival_func`` and ``get_c_sample_func`` which return
+``NULL`` for functions that are only callable from Python.
+'''
+
+cimport numpy
+from pysted._rng cimport RNG
+
+# Types of the molecule counts of the stacked sub datamaps (see pysted.utils.COUNT_DTYPES)
+ctypedef fused COUNTDTYPE_t:
+    numpy.uint8_t
+    numpy.uint16_t
+    numpy.int32_t
+    numpy.int64_t
+
+ctypedef void (*survival_func_t)(
+    double[:, ::1] prob_ex,
+    double[:, ::1] prob_sted,
+    double[:, ::1] step_prob_ex,
+    double[:, ::1] step_prob_sted,
+    numpy.int32_t[:, ::1] mask,
+    int num_mask
+) noexcept nogil
+
+ctypedef void (*sample_func_t)(
+    numpy.int64_t[:, :, ::1] sub_datamaps,
+    int row,
+    int col,
+    numpy.int32_t[:, ::1] mask,
+    int num_mask,
+    double[:, ::1] prob_ex,
+    double[:, ::1] prob_sted,
+    RNG *rng
+) noexcept nogil
+
+cdef void c_default_update_survival_probabilities(
+    double[:, ::1] prob_ex,
+    double[:, ::1] prob_sted,
+    double[:, ::1] step_prob_ex,
+    double[:, ::1] step_prob_sted,
+    numpy.int32_t[:, ::1] mask,
+    int num_mask
+) noexcept nogil
+
+cdef void c_sample_molecules(
+    numpy.int64_t[:, :, ::1] sub_datamaps,
+    int row,
+    int col,
+    numpy.int32_t[:, ::1] mask,
+    int num_mask,
+    double[:, ::1] prob_ex,
+    double[:, ::1] prob_sted,
+    RNG *rng
+) noexcept nogil
+
+cdef void sample_counts(
+    COUNTDTYPE_t[:, :, ::1] sub_datamaps,
+    int row,
+    int col,
+    numpy.int32_t[:, ::1] mask,
+    int num_mask,
+    double[:, ::1] prob_ex,
+    double[:, ::1] prob_sted,
+    RNG *rng
+) noexcept nogil
+
+cdef RNG *get_shared_rng() noexcept nogil
+cdef survival_func_t get_c_survival_func(object func)
+cdef sample_func_t get_c_sample_func(object func)
@@ -1,5 +1,9 @@
 
 '''Cython implementations of the photobleaching functions.
+
+Every function is callable from Python such that users can provide their own
+implementation to the microscopes. The default functions also have a C
+implementation (``c_*``) which the raster kernels call without the GIL.
 '''
 
 import time
@@ -9,7 +13,12 @@ cimport cython
 import copy
 
 from libc.math cimport exp
-from libc.stdlib cimport rand, srand, RAND_MAX
+from libc.stdlib cimport RAND_MAX
+from pysted._rng cimport RNG, binomial
+
+# Generator of the Python-callable functions, the kernels position it on the
+# stream of every pixel before calling them
+cdef RNG shared_rng
 
 INTDTYPE = numpy.int32
 INT64DTYPE = numpy.int64
@@ -27,7 +36,7 @@ def default_update_survival_probabilities(object self,
                    float p_ex,
                    float p_sted,
                    float step,
-                   dict bleached_sub_datamaps_dict,
+                   object bleached_sub_datamaps_dict,
                    int row,
                    int col,
                    int h,
@@ -83,7 +92,7 @@ def default_update_survival_probabilities(object self,
 @cython.boundscheck(False)  # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
 def sample_molecules(object self,
-                   dict bleached_sub_datamaps_dict,
+                   object bleached_sub_datamaps_dict,
                    int row,
                    int col,
                    int h,
@@ -94,6 +103,13 @@ def sample_molecules(object self,
     """
     Binomial sampling of the number of molecules at each position within the datamap.
 
+    The number of surviving molecules is sampled from a single binomial variate per position (see
+    :func:`pysted._rng.binomial`) which takes a constant expected time whatever the number of molecules. Positions
+    whose survival probability is 1 are left untouched.
+
+    The random variates are drawn from the generator returned by ``get_shared_rng`` which the raster kernels position
+    on the random stream of the acquired pixel.
+
     :param bleached_sub_datamaps_dict: The datamaps of the bleached subregions.
     :param row: The row of the datamap.
     :param col: The column of the datamap.
@@ -103,18 +119,11 @@ def sample_molecules(object self,
     :param prob_ex: The excitation survival probability.
     :param prob_sted: The STED survival probability.
     """
-    cdef int s, sprime, t, tprime, o
-    cdef int sampled_value
-    cdef float prob
-    cdef float rsamp
-    cdef float maxval
-    cdef float sampled_prob
-    cdef int current
+    cdef int s, sprime, t, tprime
+    cdef double prob
+    cdef long long current
     cdef numpy.ndarray[INT64DTYPE_t, ndim=2] datamap
     cdef str key
-    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] copied_datamap
-
-    maxval = float(RAND_MAX)
 
     for key in bleached_sub_datamaps_dict:
         datamap = bleached_sub_datamaps_dict[key]
@@ -122,15 +131,137 @@ def sample_molecules(object self,
             s = sprime + row
             t = tprime + col
             current = datamap[s, t]
-            if current > 0:
-                # Calculates the binomial sampling
-                sampled_value = 0
-                prob = prob_ex[sprime, tprime] * prob_sted[sprime, tprime]
-                # For each count we sample a random variable
-                for o in range(current):
-                    rsamp = rand()
-                    sampled_prob = rsamp / maxval
-                    if sampled_prob <= prob:
-                        sampled_value += 1
-                datamap[s, t] = sampled_value
-        bleached_sub_datamaps_dict[key] = datamap
+            prob = prob_ex[sprime, tprime] * prob_sted[sprime, tprime]
+            # Every molecule survives, the count is left untouched
+            if (current > 0) and (prob < 1.0):
+                datamap[s, t] = binomial(&shared_rng, current, prob)
+
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void c_default_update_survival_probabilities(
+    double[:, ::1] prob_ex,
+    double[:, ::1] prob_sted,
+    double[:, ::1] step_prob_ex,
+    double[:, ::1] step_prob_sted,
+    numpy.int32_t[:, ::1] mask,
+    int num_mask
+) noexcept nogil:
+    '''
+    C implementation of ``default_update_survival_probabilities``.
+
+    The survival probabilities of a step, ``exp(-k * step)``, are precomputed by the
+    :class:`~pysted.bank.ParameterBank` of the acquisition.
+
+    :param prob_ex: The excitation survival probability.
+    :param prob_sted: The STED survival probability.
+    :param step_prob_ex: The excitation survival probability of the step.
+    :param step_prob_sted: The STED survival probability of the step.
+    :param mask: The positions of the emitters in the laser footprint.
+    :param num_mask: The number of positions in the mask.
+    '''
+    cdef int m, s, t
+    for m in range(num_mask):
+        s = mask[m, 0]
+        t = mask[m, 1]
+        prob_ex[s, t] = prob_ex[s, t] * step_prob_ex[s, t]
+        prob_sted[s, t] = prob_sted[s, t] * step_prob_sted[s, t]
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void c_sample_molecules(
+    numpy.int64_t[:, :, ::1] sub_datamaps,
+    int row,
+    int col,
+    numpy.int32_t[:, ::1] mask,
+    int num_mask,
+    double[:, ::1] prob_ex,
+    double[:, ::1] prob_sted,
+    RNG *rng
+) noexcept nogil:
+    '''
+    C implementation of ``sample_molecules``.
+
+    :param sub_datamaps: The datamaps of the bleached subregions stacked in a 3D array.
+    :param row: The row of the datamap.
+    :param col: The column of the datamap.
+    :param mask: The positions of the emitters in the laser footprint.
+    :param num_mask: The number of positions in the mask.
+    :param prob_ex: The excitation survival probability.
+    :param prob_sted: The STED survival probability.
+    :param rng: The random generator of the acquisition.
+    '''
+    sample_counts(sub_datamaps, row, col, mask, num_mask, prob_ex, prob_sted, rng)
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void sample_counts(
+    COUNTDTYPE_t[:, :, ::1] sub_datamaps,
+    int row,
+    int col,
+    numpy.int32_t[:, ::1] mask,
+    int num_mask,
+    double[:, ::1] prob_ex,
+    double[:, ::1] prob_sted,
+    RNG *rng
+) noexcept nogil:
+    '''
+    Implementation of ``c_sample_molecules`` for the sub datamaps stacked in any type of the molecule counts. The
+    number of molecules only decreases such that the counts never overflow their type.
+
+    :param sub_datamaps: The datamaps of the bleached subregions stacked in a 3D array.
+    :param row: The row of the datamap.
+    :param col: The column of the datamap.
+    :param mask: The positions of the emitters in the laser footprint.
+    :param num_mask: The number of positions in the mask.
+    :param prob_ex: The excitation survival probability.
+    :param prob_sted: The STED survival probability.
+    :param rng: The random generator of the acquisition.
+    '''
+    cdef int l, m, s, t, sprime, tprime
+    cdef long long current
+    cdef double prob
+
+    for l in range(sub_datamaps.shape[0]):
+        for m in range(num_mask):
+            sprime = mask[m, 0]
+            tprime = mask[m, 1]
+            s = sprime + row
+            t = tprime + col
+            current = sub_datamaps[l, s, t]
+            prob = prob_ex[sprime, tprime] * prob_sted[sprime, tprime]
+            # Every molecule survives, the count is left untouched
+            if (current > 0) and (prob < 1.0):
+                sub_datamaps[l, s, t] = <COUNTDTYPE_t>binomial(rng, current, prob)
+
+cdef survival_func_t get_c_survival_func(object func):
+    '''
+    Returns the C implementation of a function updating the survival probabilities.
+
+    :param func: A Python-callable function updating the survival probabilities.
+
+    :returns: A pointer to the C implementation or ``NULL`` if the function is only callable from Python.
+    '''
+    if func is default_update_survival_probabilities:
+        return c_default_update_survival_probabilities
+    return NULL
+
+cdef sample_func_t get_c_sample_func(object func):
+    '''
+    Returns the C implementation of a function sampling the molecules.
+
+    :param func: A Python-callable function sampling the molecules.
+
+    :returns: A pointer to the C implementation or ``NULL`` if the function is only callable from Python.
+    '''
+    if func is sample_molecules:
+        return c_sample_molecules
+    return NULL
+
+cdef RNG *get_shared_rng() noexcept nogil:
+    '''
+    Returns the random generator of the Python-callable functions.
+
+    :returns: A pointer to the generator.
+    '''
+    return &shared_rng
@@ -24,8 +24,52 @@ static PyObject* calculate_amplitude(PyObject *self, PyObject* args) {
     return Py_BuildValue("d", amplitude);
 }
 
+static PyObject* calculate_amplitudes(PyObject *self, PyObject* args) {
+    /* Compute the amplitudes of a 2D gaussian at the points (x, y) at the given
+    radius and write them in out. The coordinates and the output are contiguous
+    buffers of doubles of the same length (e.g. numpy float64 arrays).
+
+    args : buffer, buffer, buffer, double
+    return : None
+    */
+    Py_buffer x, y, out;
+    double d_airy;
+    if (!PyArg_ParseTuple(args, "y*y*w*d", &x, &y, &out, &d_airy)) {
+        return NULL;
+    }
+    if ((x.len != y.len) || (x.len != out.len) || (x.len % sizeof(double) != 0)) {
+        PyBuffer_Release(&x);
+        PyBuffer_Release(&y);
+        PyBuffer_Release(&out);
+        PyErr_SetString(PyExc_ValueError, "x, y and out must be buffers of doubles of the same length");
+        return NULL;
+    }
+
+    const double *x_data = (const double *) x.buf;
+    const double *y_data = (const double *) y.buf;
+    double *out_data = (double *) out.buf;
+    Py_ssize_t n = x.len / sizeof(double);
+
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t i = 0; i < n; i++) {
+        double d_scaled = sqrt(pow(x_data[i], 2) + pow(y_data[i], 2)) / d_airy;
+        if (d_scaled == 0) {
+            out_data[i] = 1;
+        } else {
+            out_data[i] = pow(j1(M_PI * d_scaled) / (M_PI * d_scaled), 2);
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&x);
+    PyBuffer_Release(&y);
+    PyBuffer_Release(&out);
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef cMethods[] = {
     {"calculate_amplitude", calculate_amplitude, METH_VARARGS, "Return the amplitude of a 2D gaussian at the point (x, y) at the given radius."},
+    {"calculate_amplitudes", calculate_amplitudes, METH_VARARGS, "Write in out the amplitudes of a 2D gaussian at the points (x, y) at the given radius."},
     {NULL, NULL, 0, NULL} // sentinel (?!?)
 };
 
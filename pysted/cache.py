@@ -0,0 +1,186 @@
+'''This module implements the on-disk cache of the lasers of a microscope.
+
+Every entry is stored in its own ``.npy`` file named after a stable hash of
+the parameters of the components and the exact pixel size. Entries are written
+to a temporary file and atomically renamed, such that many processes can share
+the same cache directory. Entries are memory-mapped on load and the least
+recently used entries are evicted when the cache grows over its maximal size.
+
+.. code-block:: python
+
+    store = cache.LaserCache("~/.cache/pysted", max_size=2**30)
+    key = store.key(20e-9, laser_ex, laser_sted, detector, objective, fluo)
+    lasers = store.load(key)
+    if lasers is None:
+        lasers = compute_lasers()
+        store.save(key, lasers)
+'''
+
+import collections.abc
+import hashlib
+import os
+import tempfile
+
+import numpy
+
+# Increment when the computation of the lasers changes to invalidate the entries
+CACHE_VERSION = 1
+
+DEFAULT_DIRECTORY = os.environ.get("PYSTED_CACHE_DIR", ".pysted_cache")
+
+
+def canonical(value):
+    '''Return a canonical string representation of a value that does not depend
+    on the process (e.g. the order of the keys of a dict or the memory address
+    of an array).
+
+    :param value: A number, a string, a sequence, a dict, a numpy array or an
+                  object whose attributes are any of these.
+
+    :return: A string.
+    '''
+    if isinstance(value, collections.abc.Mapping):
+        items = sorted((canonical(key), canonical(val)) for key, val in value.items())
+        return "{" + ",".join(f"{key}:{val}" for key, val in items) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(canonical(val) for val in value) + "]"
+    if isinstance(value, numpy.ndarray):
+        data = hashlib.sha256(numpy.ascontiguousarray(value).tobytes()).hexdigest()
+        return f"array({value.dtype.str},{value.shape},{data})"
+    if isinstance(value, (bool, numpy.bool_)):
+        return repr(bool(value))
+    if isinstance(value, (int, numpy.integer)):
+        return repr(int(value))
+    if isinstance(value, (float, numpy.floating)):
+        return repr(float(value))
+    if isinstance(value, str) or value is None:
+        return repr(value)
+    return f"{type(value).__name__}{canonical(vars(value))}"
+
+
+def digest(*values):
+    '''Compute a stable hash of some values.
+
+    :param values: Any values supported by :func:`canonical`.
+
+    :return: A hexadecimal string.
+    '''
+    return hashlib.sha256(canonical(list(values)).encode("utf-8")).hexdigest()
+
+
+class LaserCache:
+    '''Content-addressed store of the lasers of a microscope.
+
+    :param directory: The directory of the cache. Defaults to the environment
+                      variable ``PYSTED_CACHE_DIR`` or ``.pysted_cache``.
+    :param max_size: The maximal size of the cache (bytes). The least recently
+                     used entries are removed when it is exceeded. ``None`` for
+                     no limit.
+    '''
+    def __init__(self, directory=None, max_size=None):
+        if directory is None:
+            directory = DEFAULT_DIRECTORY
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+
+    @staticmethod
+    def key(datamap_pixelsize, *components):
+        '''Compute the key of an entry.
+
+        :param datamap_pixelsize: The size of a pixel in the simulated image (m).
+        :param components: The components of the microscope used to compute the
+                           entry.
+
+        :return: A hexadecimal string.
+        '''
+        return digest(CACHE_VERSION, float(datamap_pixelsize), list(components))
+
+    def path(self, key):
+        '''Return the path of the file of an entry.
+
+        :param key: The key of the entry.
+
+        :return: A path.
+        '''
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def load(self, key):
+        '''Load an entry of the cache.
+
+        :param key: The key of the entry.
+
+        :return: A tuple of the read-only memory-mapped arrays of the entry or
+                 ``None`` if the entry is not in the cache.
+        '''
+        path = self.path(key)
+        try:
+            stack = numpy.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        try:
+            # mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return tuple(stack)
+
+    def save(self, key, arrays):
+        '''Save an entry in the cache.
+
+        The entry is written in a temporary file which is atomically renamed,
+        such that concurrent readers never see a partial entry.
+
+        :param key: The key of the entry.
+        :param arrays: A sequence of 2D arrays of the same shape.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                numpy.save(file, numpy.stack(arrays))
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        '''Remove the least recently used entries until the size of the cache
+        is below :attr:`max_size`.
+        '''
+        if self.max_size is None:
+            return
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".npy"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def clear(self):
+        '''Remove all entries of the cache.
+        '''
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
@@ -3,12 +3,15 @@
 
 Currently implemented microscopes are 
 
+* ``AdaptiveMicroscope``
 * ``DyMINMicroscope``
 * ``DyMINRESCueMicroscope``
 * ``RESCueMicroscope``
 
-Implementing their own microscope requires to reimplement the ``get_signal_and_bleach`` 
-method of a ``base.Microscope``.
+The adaptive microscopes are configurations of an ``AdaptiveMicroscope`` whose acquisition
+is described by a policy table. Implementing their own adaptive scheme only requires to
+provide a policy (see ``AdaptiveMicroscope``), other microscopes require to reimplement
+the ``get_signal_and_bleach`` method of a ``base.Microscope``.
 
 .. rubric:: References
 
@@ -23,26 +26,72 @@ import time
 import random
 
 from pysted import base, utils, raster, bleach_funcs
-
-class DyMINMicroscope(base.Microscope):
-    '''Implements a ``DyMINMicroscope``.
-
-    Refer to [Heine2017]_ for details about DyMIN microscopy.
-
-    The DyMIN acquisition parameters are controlled with the `opts` variable. Other number 
-    of DyMIN steps can be implemented by simply changing the length of each parameters.
+from pysted.bank import ParameterBank
+
+class AdaptiveMicroscope(base.Microscope):
+    '''Implements an adaptive-illumination microscope driven by a policy table.
+
+    Every pixel is acquired in successive steps. At each step, the photons detected
+    during the decision time are compared to the thresholds of the step to decide whether
+    the acquisition of the pixel continues. The policy is a dict of sequences with
+    one element per step
+
+    +---------------------+-----------------------------------------------------------+
+    | Key                 | Details                                                   |
+    +=====================+===========================================================+
+    | ``scale_power``     | The scaling of the STED power (default: 1).               |
+    +---------------------+-----------------------------------------------------------+
+    | ``decision_time``   | The time spent for the decision, negative for the pixel   |
+    |                     | dwell time (s).                                           |
+    +---------------------+-----------------------------------------------------------+
+    | ``lower_threshold`` | The action ``lower_action`` is taken if the photons are   |
+    |                     | below this threshold (default: -1, never).                |
+    +---------------------+-----------------------------------------------------------+
+    | ``upper_threshold`` | The action ``upper_action`` is taken if this threshold is |
+    |                     | positive and the photons are above it (default: -1).      |
+    +---------------------+-----------------------------------------------------------+
+    | ``lower_action``,   | One of ``"continue"``, ``"stop"`` (discard the photons of |
+    | ``upper_action``    | the step), ``"accept"`` (add the photons of the step) or  |
+    |                     | ``"extrapolate"`` (add the photons of the step scaled to  |
+    |                     | the pixel dwell time). Default: ``"stop"`` and            |
+    |                     | ``"extrapolate"``.                                        |
+    +---------------------+-----------------------------------------------------------+
+    | ``accumulate``      | Whether the photons are added to the pixel when the       |
+    |                     | acquisition continues (default: False).                   |
+    +---------------------+-----------------------------------------------------------+
+    | ``truncate``        | Whether the extrapolated photons are truncated to an      |
+    |                     | integer (default: False).                                 |
+    +---------------------+-----------------------------------------------------------+
+    | ``label``,          | The label of the pixel when the acquisition continues,    |
+    | ``lower_label``,    | when the lower or the upper action is taken (default:     |
+    | ``upper_label``     | the index of the step).                                   |
+    +---------------------+-----------------------------------------------------------+
+
+    The acquisition of every policy is done by the compiled
+    :func:`~pysted.raster.raster_func_adaptive`, such that new adaptive schemes only require
+    to implement :meth:`get_policy`.
 
     .. code-block:: python
 
-        opts = {
-            "scale_power" : [0, 0.25, 1.0], # Percentage of STED power 
-            "decision_time" : [10e-6, 10e-6, -1], # Time to acquire photons
-            "threshold_count" : [8, 8, 0] # Minimal number of photons for next step
+        policy = {
+            "scale_power" : [0., 1.],
+            "decision_time" : [5e-6, -1],
+            "lower_threshold" : [3, -1],
+            "accumulate" : [False, True]
         }
+        microscope = AdaptiveMicroscope(laser_ex, laser_sted, detector, objective, fluo, policy=policy)
     '''
-    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False, opts=None, verbose=False):
+    ACTIONS = {
+        "continue" : raster.ACTION_CONTINUE,
+        "stop" : raster.ACTION_STOP,
+        "accept" : raster.ACTION_ACCEPT,
+        "extrapolate" : raster.ACTION_EXTRAPOLATE
+    }
+
+    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False, policy=None, verbose=False,
+                 cache_dir=None, cache_max_size=None):
         """
-        Instantiates the ``DyMINMicroscope``
+        Instantiates the ``AdaptiveMicroscope``
 
         :param excitation: A :class:`~pysted.base.GaussianBeam` object
                         representing the excitation laser beam.
@@ -55,29 +104,65 @@ class DyMINMicroscope(base.Microscope):
         :param fluo: A :class:`~pysted.base.Fluorescence` object describing the
                     fluorescence molecules to be used.
         :param load_cache: A bool which determines whether or not the microscope's lasers will be generated from scratch
-                        (load_cache=False) or if they will be loaded from the previous save (load_cache=True). Generating
-                        the lasers from scratch can take a long time (takes longer as the pixel_size decreases), so
-                        loading the cache can save time when doing multiple experiments using the same pixel_size.    
+                        (load_cache=False) or if they will be loaded from the previous save (load_cache=True).
+        :param policy: A dict describing the steps of the acquisition (see :class:`AdaptiveMicroscope`).
+        :param cache_dir: The directory of the on-disk cache of the lasers (see :class:`~pysted.cache.LaserCache`).
+        :param cache_max_size: The maximal size (bytes) of the on-disk cache.
         """
-        super(DyMINMicroscope, self).__init__(excitation, sted, detector, objective, fluo, load_cache=load_cache, verbose=verbose)
+        super(AdaptiveMicroscope, self).__init__(excitation, sted, detector, objective, fluo, load_cache=load_cache, verbose=verbose,
+            cache_dir=cache_dir, cache_max_size=cache_max_size)
+        self.policy = policy
 
-        if isinstance(opts, type(None)):
-            opts = {
-                "scale_power" : [0., 0.25, 1.],
-                "decision_time" : [10.0e-6, 10.0e-6, -1],
-                "threshold_count" : [8, 8, 0]
-            }
-        required_keys = ["scale_power", "decision_time", "threshold_count"]
-        assert all(k in opts for k in required_keys), "Missing keys in opts. {}".format(required_keys)
-        self.opts = opts
+    def get_policy(self):
+        """
+        Returns the policy of the acquisition. Subclasses implement their acquisition scheme by overriding this method.
+
+        :return: A dict describing the steps of the acquisition (see :class:`AdaptiveMicroscope`).
+        """
+        return self.policy
+
+    def compile_policy(self, policy):
+        """
+        Converts a policy to the arrays used by :func:`~pysted.raster.raster_func_adaptive`, filling the missing keys with
+        their default values.
+
+        :param policy: A dict describing the steps of the acquisition (see :class:`AdaptiveMicroscope`).
+
+        :return: A dict of 1D arrays.
+        """
+        assert "decision_time" in policy, "Missing key `decision_time` in policy"
+        num_steps = len(policy["decision_time"])
+        defaults = {
+            "scale_power" : 1.,
+            "lower_threshold" : -1.,
+            "upper_threshold" : -1.,
+            "lower_action" : "stop",
+            "upper_action" : "extrapolate",
+            "accumulate" : False,
+            "truncate" : False,
+            "label" : numpy.arange(num_steps),
+            "lower_label" : policy.get("label", numpy.arange(num_steps)),
+            "upper_label" : policy.get("label", numpy.arange(num_steps)),
+        }
+        compiled = {}
+        for key, default in defaults.items():
+            values = numpy.broadcast_to(policy.get(key, default), (num_steps,))
+            if key in ("lower_action", "upper_action"):
+                compiled[key] = numpy.array([self.ACTIONS[value] for value in values], dtype=numpy.int32)
+            elif key in ("accumulate", "truncate"):
+                compiled[key] = numpy.array(values, dtype=numpy.int32)
+            else:
+                compiled[key] = numpy.array(values, dtype=numpy.float64)
+        compiled["decision_time"] = numpy.array(policy["decision_time"], dtype=numpy.float64)
+        return compiled
 
     def get_signal_and_bleach(self, datamap, pixelsize, pdt, p_ex, p_sted, indices=None, acquired_intensity=None,
                                   pixel_list=None, bleach=True, update=True, seed=None, filter_bypass=False,
                                   bleach_func=bleach_funcs.default_update_survival_probabilities,
-                                  sample_func=bleach_funcs.sample_molecules):
+                                  sample_func=bleach_funcs.sample_molecules, psf_energy=None, acquisition_id=0):
         """
         This function acquires the signal and bleaches simultaneously.
-        
+
         It makes a call to compiled C code for speed, so make sure the raster.pyx file is compiled!
 
         :param datamap: The datamap on which the acquisition is done, either a Datamap object or TemporalDatamap
@@ -90,78 +175,143 @@ class DyMINMicroscope(base.Microscope):
                        ROI being imaged. (W)
         :param indices: A dictionary containing the indices of the subdatamaps used. This is used to apply bleaching to
                         the future subdatamaps. If acquiring on a static Datamap, leave as None.
-        :param acquired_intensity: The result of the last incomplete acquisition. This is useful in a time routine where
-                                   flashes can occur mid acquisition. Leave as None if it is not the case. (array)
+        :param acquired_intensity: Unused, kept for compatibility with :meth:`~pysted.base.Microscope.get_signal_and_bleach`.
         :param pixel_list: The list of pixels to be iterated on. If none, a pixel_list of a raster scan will be
                            generated. (list of tuples (row, col))
         :param bleach: Determines whether bleaching is active or not. (Bool)
         :param update: Determines whether the datamap is updated in place. If set to false, the datamap can still be
                        updated later with the returned bleached datamap. (Bool)
-        :param seed: Sets a seed for the random number generator.
+        :param seed: Sets a seed for the random number generator. Either an int, a ``numpy.random.SeedSequence`` or a
+                     ``numpy.random.Generator`` (see :func:`~pysted.utils.rng_key`).
         :param filter_bypass: Whether or not to filter the pixel list.
                               This is useful if you know your pixel list is adequate and ordered differently from a
                               raster scan (i.e. a left to right, row by row scan), as filtering the list return it
                               in raster order.
                               If pixel_list is none, this must be True then.
         :param bleach_func: The bleaching function to be applied.
-        :param steps: list containing the pixeldwelltimes for the sub steps of an acquisition. Is none by default.
-                      Should be used if trying to implement a DyMin type acquisition, where decisions are made
-                      after some time on whether or not to continue the acq.
+        :param sample_func: The sampling function of the molecules to be applied.
+        :param psf_energy: The fraction of the energy of the effective PSF and of the photobleaching rates kept in the
+                           footprint of the laser (see :meth:`~pysted.base.Microscope.get_signal_and_bleach`).
+        :param acquisition_id: The index of the acquisition among the acquisitions made with the same seed (see
+                               :meth:`~pysted.base.Microscope.get_signal_and_bleach`).
 
         :return: returned_acquired_photons, the acquired photon for the acquisition.
                  bleached_sub_datamaps_dict, a dict containing the results of bleaching on the subdatamaps
-                 acquired_intensity, the intensity of the acquisition, used for interrupted acquisitions
+                 labels, the label of the last step of the policy executed on every pixel
         """
-        datamap_roi = datamap.whole_datamap[datamap.roi]
-        pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape)
-        p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape)
-        p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape)
-
         datamap_pixelsize = datamap.pixelsize
         i_ex, i_sted, psf_det = self.cache(datamap_pixelsize)
         if datamap.roi is None:
             datamap.set_roi(i_ex)
 
+        # A virtually padded datamap is acquired on the window of its ROI (see base.Datamap.crop_window)
+        padded_datamap = None
+        if getattr(datamap, "virtual_padding", False):
+            padded_datamap, datamap = datamap, datamap.crop_window(i_ex)
+
         datamap_roi = datamap.whole_datamap[datamap.roi]
-        pixel_list = utils.pixel_list_filter(datamap_roi, pixel_list, pixelsize, datamap_pixelsize)
-
-        ratio = utils.pxsize_ratio(pixelsize, datamap_pixelsize)
-        rows_pad, cols_pad = datamap.roi_corners['tl'][0], datamap.roi_corners['tl'][1]
-        laser_pad = i_ex.shape[0] // 2
-
-        prob_ex = numpy.ones(datamap.whole_datamap.shape)
-        prob_sted = numpy.ones(datamap.whole_datamap.shape)
-        bleached_datamap = numpy.copy(datamap.whole_datamap)
-        returned_photons = numpy.zeros(datamap.whole_datamap[datamap.roi].shape)
-        scaled_power = numpy.zeros(datamap.whole_datamap[datamap.roi].shape)
-        acquired_intensity = numpy.zeros(datamap.whole_datamap[datamap.roi].shape)
-
-        bleached_sub_datamaps_dict = {}
-        if isinstance(indices, type(None)):
-            indices = 0 
-        for key in datamap.sub_datamaps_dict:
-            bleached_sub_datamaps_dict[key] = numpy.copy(datamap.sub_datamaps_dict[key].astype(numpy.int64))
-
-        if isinstance(seed, type(None)):
-            seed = 0
-        for key, value in self.opts.items():
-            if isinstance(value, list):
-                self.opts[key] = numpy.array(value)
-            self.opts[key] = self.opts[key].astype(float)
-
-        raster_func = raster.raster_func_dymin
-        raster_func(self, datamap, acquired_intensity, numpy.array(pixel_list).astype(numpy.int32), ratio, rows_pad,
-                    cols_pad, laser_pad, prob_ex, prob_sted, returned_photons, scaled_power, pdt, p_ex, p_sted,
-                    bleach, bleached_sub_datamaps_dict, seed, bleach_func, sample_func, [])
-
-        if update and bleach:
+        pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape)
+        p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape)
+        p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape)
+        if not filter_bypass:
+            pixel_list = utils.pixel_list_filter(datamap_roi, pixel_list, pixelsize, datamap_pixelsize)
+
+        returned_photons = numpy.zeros(datamap_roi.shape)
+        labels = numpy.zeros(datamap_roi.shape)
+
+        bleached_sub_datamaps_dict = datamap.sub_datamaps_dict.counts()
+
+        key = utils.rng_key(utils.acquisition_seed(seed, acquisition_id))
+
+        # The effective PSF and bleaching rates of every step are computed once
+        policy = self.compile_policy(self.get_policy())
+        banks = []
+        for scale_power, decision_time in zip(policy["scale_power"], policy["decision_time"]):
+            banks.append(ParameterBank(self, datamap_pixelsize, p_ex, scale_power * p_sted,
+                                       pdt if decision_time < 0 else decision_time, energy=psf_energy))
+
+        raster.raster_func_adaptive(self, datamap, utils.as_pixel_array(pixel_list), returned_photons,
+                                    labels, pdt, p_ex, p_sted, policy, banks, bleach, bleached_sub_datamaps_dict,
+                                    key, bleach_func, sample_func)
+
+        if update and bleach and (padded_datamap is not None):
+            padded_datamap.paste_window(datamap.origin, bleached_sub_datamaps_dict)
+        elif update and bleach:
             datamap.sub_datamaps_dict = bleached_sub_datamaps_dict
             datamap.base_datamap = datamap.sub_datamaps_dict["base"]
             datamap.whole_datamap = numpy.copy(datamap.base_datamap)
 
-        return returned_photons, bleached_sub_datamaps_dict, scaled_power
+        return returned_photons, bleached_sub_datamaps_dict, labels
+
+class DyMINMicroscope(AdaptiveMicroscope):
+    '''Implements a ``DyMINMicroscope``.
+
+    Refer to [Heine2017]_ for details about DyMIN microscopy.
+
+    The DyMIN acquisition parameters are controlled with the `opts` variable. Other number 
+    of DyMIN steps can be implemented by simply changing the length of each parameters.
+
+    .. code-block:: python
+
+        opts = {
+            "scale_power" : [0, 0.25, 1.0], # Percentage of STED power 
+            "decision_time" : [10e-6, 10e-6, -1], # Time to acquire photons
+            "threshold_count" : [8, 8, 0] # Minimal number of photons for next step
+        }
+    '''
+    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False, opts=None, verbose=False,
+                 cache_dir=None, cache_max_size=None):
+        """
+        Instantiates the ``DyMINMicroscope``
+
+        :param excitation: A :class:`~pysted.base.GaussianBeam` object
+                        representing the excitation laser beam.
+        :param sted: A :class:`~pysted.base.DonutBeam` object representing the
+                    STED laser beam.
+        :param detector: A :class:`~pysted.base.Detector` object describing the
+                        microscope detector.
+        :param objective: A :class:`~pysted.base.Objective` object describing the
+                        microscope objective.
+        :param fluo: A :class:`~pysted.base.Fluorescence` object describing the
+                    fluorescence molecules to be used.
+        :param load_cache: A bool which determines whether or not the microscope's lasers will be generated from scratch
+                        (load_cache=False) or if they will be loaded from the previous save (load_cache=True). Generating
+                        the lasers from scratch can take a long time (takes longer as the pixel_size decreases), so
+                        loading the cache can save time when doing multiple experiments using the same pixel_size.    
+        :param cache_dir: The directory of the on-disk cache of the lasers (see :class:`~pysted.cache.LaserCache`).
+        :param cache_max_size: The maximal size (bytes) of the on-disk cache.
+        """
+        super(DyMINMicroscope, self).__init__(excitation, sted, detector, objective, fluo, load_cache=load_cache, verbose=verbose,
+            cache_dir=cache_dir, cache_max_size=cache_max_size)
+
+        if isinstance(opts, type(None)):
+            opts = {
+                "scale_power" : [0., 0.25, 1.],
+                "decision_time" : [10.0e-6, 10.0e-6, -1],
+                "threshold_count" : [8, 8, 0]
+            }
+        required_keys = ["scale_power", "decision_time", "threshold_count"]
+        assert all(k in opts for k in required_keys), "Missing keys in opts. {}".format(required_keys)
+        self.opts = opts
+
+    def get_policy(self):
+        """
+        Returns the policy of the DyMIN acquisition. The acquisition of a pixel is stopped at the first step where
+        the number of photons is below ``threshold_count``, only the photons of the last step are kept.
+
+        :return: A dict describing the steps of the acquisition (see :class:`AdaptiveMicroscope`).
+        """
+        num_steps = len(self.opts["scale_power"])
+        return {
+            "scale_power" : self.opts["scale_power"],
+            "decision_time" : self.opts["decision_time"],
+            "lower_threshold" : self.opts["threshold_count"],
+            "lower_action" : "stop",
+            "accumulate" : numpy.arange(num_steps) == num_steps - 1,
+            "label" : self.opts["scale_power"],
+        }
 
-class DyMINRESCueMicroscope(base.Microscope):
+class DyMINRESCueMicroscope(AdaptiveMicroscope):
     """
     Implements a `DyMINRESCueMicroscope`.
 
@@ -180,7 +330,8 @@ class DyMINRESCueMicroscope(base.Microscope):
             "threshold_count" : [8, 8, 0] # Minimal number of photons for next step
         }
     """    
-    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False, opts=None, verbose=False):
+    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False, opts=None, verbose=False,
+                 cache_dir=None, cache_max_size=None):
         """
         Instantiates the `DyMINRESCueMicroscope`
 
@@ -198,8 +349,11 @@ class DyMINRESCueMicroscope(base.Microscope):
                         (load_cache=False) or if they will be loaded from the previous save (load_cache=True). Generating
                         the lasers from scratch can take a long time (takes longer as the pixel_size decreases), so
                         loading the cache can save time when doing multiple experiments using the same pixel_size.    
+        :param cache_dir: The directory of the on-disk cache of the lasers (see :class:`~pysted.cache.LaserCache`).
+        :param cache_max_size: The maximal size (bytes) of the on-disk cache.
         """        
-        super(DyMINRESCueMicroscope, self).__init__(excitation, sted, detector, objective, fluo, load_cache=load_cache, verbose=verbose)
+        super(DyMINRESCueMicroscope, self).__init__(excitation, sted, detector, objective, fluo, load_cache=load_cache, verbose=verbose,
+            cache_dir=cache_dir, cache_max_size=cache_max_size)
 
         if isinstance(opts, type(None)):
             opts = {
@@ -211,150 +365,32 @@ class DyMINRESCueMicroscope(base.Microscope):
         assert all(k in opts for k in required_keys), "Missing keys in opts. {}".format(required_keys)
         self.opts = opts
 
-    def get_signal_and_bleach(self, datamap, pixelsize, pdt, p_ex, p_sted, indices=None, acquired_intensity=None,
-                                  pixel_list=None, bleach=True, update=True, seed=None, filter_bypass=False,
-                                  bleach_func=bleach_funcs.default_update_survival_probabilities,
-                                  sample_func=bleach_funcs.sample_molecules):
+    def get_policy(self):
         """
-        This function acquires the signal and bleaches simultaneously.
+        Returns the policy of the DyMINRESCue acquisition. The DyMIN steps are followed by a RESCue decision at the
+        last step: the photons are extrapolated to the pixel dwell time and truncated to an integer if they exceed the
+        ``threshold_count`` of the last step (label 4), otherwise the pixel is acquired for another pixel dwell time (label 3).
 
-        :param datamap: The datamap on which the acquisition is done, either a Datamap object or TemporalDatamap
-        :param pixelsize: The pixelsize of the acquisition. (m)
-        :param pdt: The pixel dwelltime. Can be either a single float value or an array of the same size as the ROI
-                    being imaged. (s)
-        :param p_ex: The excitation beam power. Can be either a single float value or an array of the same size as the
-                     ROI being imaged. (W)
-        :param p_sted: The depletion beam power. Can be either a single float value or an array of the same size as the
-                       ROI being imaged. (W)
-        :param indices: A dictionary containing the indices of the subdatamaps used. This is used to apply bleaching to
-                        the future subdatamaps. If acquiring on a static Datamap, leave as None.
-        :param acquired_intensity: The result of the last incomplete acquisition. This is useful in a time routine where
-                                   flashes can occur mid acquisition. Leave as None if it is not the case. (array)
-        :param pixel_list: The list of pixels to be iterated on. If none, a pixel_list of a raster scan will be
-                           generated. (list of tuples (row, col))
-        :param bleach: Determines whether bleaching is active or not. (Bool)
-        :param update: Determines whether the datamap is updated in place. If set to false, the datamap can still be
-                       updated later with the returned bleached datamap. (Bool)
-        :param seed: Sets a seed for the random number generator.
-        :param filter_bypass: Whether or not to filter the pixel list.
-                              This is useful if you know your pixel list is adequate and ordered differently from a
-                              raster scan (i.e. a left to right, row by row scan), as filtering the list return it
-                              in raster order.
-                              If pixel_list is none, this must be True then.
-        :param bleach_func: The bleaching function to be applied.
-        :param steps: list containing the pixeldwelltimes for the sub steps of an acquisition. Is none by default.
-                      Should be used if trying to implement a DyMin type acquisition, where decisions are made
-                      after some time on whether or not to continue the acq.
-
-        :return: returned_acquired_photons, the acquired photon for the acquisition.
-                 bleached_sub_datamaps_dict, a dict containing the results of bleaching on the subdatamaps
-                 acquired_intensity, the intensity of the acquisition, used for interrupted acquisitions
+        :return: A dict describing the steps of the acquisition (see :class:`AdaptiveMicroscope`).
         """
-        datamap_roi = datamap.whole_datamap[datamap.roi]
-        pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape)
-        p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape)
-        p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape)
-
-        datamap_pixelsize = datamap.pixelsize
-        i_ex, i_sted, psf_det = self.cache(datamap_pixelsize)
-        if datamap.roi is None:
-            datamap.set_roi(i_ex)
-
-        datamap_roi = datamap.whole_datamap[datamap.roi]
-        pixel_list = utils.pixel_list_filter(datamap_roi, pixel_list, pixelsize, datamap_pixelsize)
-
-        ratio = utils.pxsize_ratio(pixelsize, datamap_pixelsize)
-        rows_pad, cols_pad = datamap.roi_corners['tl'][0], datamap.roi_corners['tl'][1]
-        laser_pad = i_ex.shape[0] // 2
-
-        prob_ex = numpy.ones(datamap.whole_datamap.shape)
-        prob_sted = numpy.ones(datamap.whole_datamap.shape)
-        bleached_datamap = numpy.copy(datamap.whole_datamap)
-        returned_photons = numpy.zeros(datamap.whole_datamap[datamap.roi].shape)
-        scaled_power = numpy.zeros(datamap.whole_datamap[datamap.roi].shape)
-
-        bleached_sub_datamaps_dict = {}
-        if isinstance(indices, type(None)):
-            indices = 0
-        for key in datamap.sub_datamaps_dict:
-            bleached_sub_datamaps_dict[key] = numpy.copy(datamap.sub_datamaps_dict[key].astype(numpy.int64))
-
-        uniform_ex = numpy.all(p_ex == p_ex[0, 0])
-        uniform_sted = numpy.all(p_sted == p_sted[0, 0])
-        uniform_pdt = numpy.all(pdt == pdt[0, 0])
-        is_uniform = uniform_sted and uniform_ex and uniform_pdt
-        if is_uniform:
-            effectives = []
-            for i in range(len(self.opts["scale_power"])):
-                effective = self.get_effective(datamap.pixelsize, p_ex[0, 0], self.opts["scale_power"][i] * p_sted[0, 0])
-                effectives.append(effective)
-
-        for (row, col) in pixel_list:
-            row_slice = slice(row + rows_pad - laser_pad, row + rows_pad + laser_pad + 1)
-            col_slice = slice(col + cols_pad - laser_pad, col + cols_pad + laser_pad + 1)
-
-            pdts, p_exs, p_steds = numpy.zeros(len(self.opts["scale_power"])), numpy.zeros(len(self.opts["scale_power"])), numpy.zeros(len(self.opts["scale_power"]))
-            for i, (scale_power, decision_time, threshold_count) in enumerate(zip(self.opts["scale_power"], self.opts["decision_time"], self.opts["threshold_count"])):
-
-                if not is_uniform:
-                    effective = self.get_effective(datamap_pixelsize, p_ex[row, col], scale_power * p_sted[row, col])
-                else:
-                    effective = effectives[i]
-                h, w = effective.shape
-
-                # Uses the bleached datamap
-                bleached_datamap = numpy.zeros(bleached_sub_datamaps_dict["base"].shape, dtype=numpy.int32)
-                for key in bleached_sub_datamaps_dict:
-                    bleached_datamap += bleached_sub_datamaps_dict[key]
-
-                pixel_intensity = numpy.sum(effective * bleached_datamap[row_slice, col_slice])
-                pixel_photons = self.detector.get_signal(self.fluo.get_photons(pixel_intensity), decision_time, self.sted.rate)
-
-                # Stores the action taken for futures bleaching
-                pdts[i] = decision_time
-                p_exs[i] = p_ex[row, col]
-                p_steds[i] = scale_power * p_sted[row, col]
-                if i == len(self.opts["scale_power"]) - 1:
-                    if (threshold_count > 0) and (pixel_photons > threshold_count):
-                        scaled_power[row, col] = 4
-                        returned_photons[row, col] += (pixel_photons * pdt[row, col] / decision_time).astype(int)
-                        break
-                    else:
-                        scaled_power[row, col] = 3
-                        returned_photons[row, col] += pixel_photons
-
-                        # Acquire another time as in RESCue
-                        pdts[i] += pdt[row, col]
-                        pixel_photons = self.detector.get_signal(self.fluo.get_photons(pixel_intensity), pdt[row, col], self.sted.rate)
-                        returned_photons[row, col] += pixel_photons
-                else:
-                    # If signal is less than threshold count then skip pixel
-                    scaled_power[row, col] = scale_power
-                    if pixel_photons < threshold_count:
-                        break
-
-                    # # Update the photon counts only on the last pixel power scale
-                    # if scale_power > 0.:
-                    #     returned_photons[row, col] += pixel_photons
-
-            # We add row_slice.start and col_slice.start to recenter the slice
-            mask = (numpy.argwhere(bleached_datamap[row_slice, col_slice] > 0) + numpy.array([[row_slice.start, col_slice.start]])).tolist()
-            if bleach and (len(mask) > 0):
-                for _p_ex, _p_sted, _pdt in zip(p_exs, p_steds, pdts):
-                    if _pdt > 0:
-                        bleach_func(self, i_ex, i_sted, _p_ex, _p_sted,
-                                    _pdt, bleached_sub_datamaps_dict,
-                                    row, col, h, w, mask, prob_ex, prob_sted, None, None)
-                sample_func(self, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex, prob_sted)
-
-        if update and bleach:
-            datamap.sub_datamaps_dict = bleached_sub_datamaps_dict
-            datamap.base_datamap = datamap.sub_datamaps_dict["base"]
-            datamap.whole_datamap = numpy.copy(datamap.base_datamap)
-
-        return returned_photons, bleached_sub_datamaps_dict, scaled_power
+        scale_power = list(self.opts["scale_power"])
+        threshold_count = list(self.opts["threshold_count"])
+        num_steps = len(scale_power)
+        return {
+            "scale_power" : scale_power + [scale_power[-1]],
+            "decision_time" : list(self.opts["decision_time"]) + [-1.],
+            "lower_threshold" : threshold_count[:-1] + [-1., -1.],
+            "lower_action" : "stop",
+            "upper_threshold" : [-1.] * (num_steps - 1) + [threshold_count[-1], -1.],
+            "upper_action" : "extrapolate",
+            "accumulate" : [False] * (num_steps - 1) + [True, True],
+            "truncate" : True,
+            "label" : scale_power[:-1] + [3, 3],
+            "lower_label" : scale_power[:-1] + [3, 3],
+            "upper_label" : scale_power[:-1] + [4, 4],
+        }
 
-class RESCueMicroscope(base.Microscope):
+class RESCueMicroscope(AdaptiveMicroscope):
     """
     Implements a `RESCueMicroscope`.
 
@@ -371,7 +407,8 @@ class RESCueMicroscope(base.Microscope):
             "decision_time" : [10e-6, -1] # Time spent for the decision
         }
     """       
-    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False, opts=None, verbose=False):
+    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False, opts=None, verbose=False,
+                 cache_dir=None, cache_max_size=None):
         """
         Instantiates the `RESCueMicroscope`
 
@@ -389,8 +426,11 @@ class RESCueMicroscope(base.Microscope):
                         (load_cache=False) or if they will be loaded from the previous save (load_cache=True). Generating
                         the lasers from scratch can take a long time (takes longer as the pixel_size decreases), so
                         loading the cache can save time when doing multiple experiments using the same pixel_size.    
+        :param cache_dir: The directory of the on-disk cache of the lasers (see :class:`~pysted.cache.LaserCache`).
+        :param cache_max_size: The maximal size (bytes) of the on-disk cache.
         """              
-        super(RESCueMicroscope, self).__init__(excitation, sted, detector, objective, fluo, load_cache=load_cache, verbose=verbose)
+        super(RESCueMicroscope, self).__init__(excitation, sted, detector, objective, fluo, load_cache=load_cache, verbose=verbose,
+            cache_dir=cache_dir, cache_max_size=cache_max_size)
 
         if isinstance(opts, type(None)):
             opts = {
@@ -402,101 +442,22 @@ class RESCueMicroscope(base.Microscope):
         assert all(k in opts for k in required_keys), "Missing keys in opts. {}".format(required_keys)
         self.opts = opts
 
-    def get_signal_and_bleach(self, datamap, pixelsize, pdt, p_ex, p_sted, indices=None, acquired_intensity=None,
-                                  pixel_list=None, bleach=True, update=True, seed=None, filter_bypass=False,
-                                  bleach_func=bleach_funcs.default_update_survival_probabilities,
-                                  sample_func=bleach_funcs.sample_molecules):
+    def get_policy(self):
         """
-        This function acquires the signal and bleaches simultaneously. 
-        
-        It makes a call to compiled C code for speed, so make sure the raster.pyx file is compiled!
-
-        :param datamap: The datamap on which the acquisition is done, either a Datamap object or TemporalDatamap
-        :param pixelsize: The pixelsize of the acquisition. (m)
-        :param pdt: The pixel dwelltime. Can be either a single float value or an array of the same size as the ROI
-                    being imaged. (s)
-        :param p_ex: The excitation beam power. Can be either a single float value or an array of the same size as the
-                     ROI being imaged. (W)
-        :param p_sted: The depletion beam power. Can be either a single float value or an array of the same size as the
-                       ROI being imaged. (W)
-        :param indices: A dictionary containing the indices of the subdatamaps used. This is used to apply bleaching to
-                        the future subdatamaps. If acquiring on a static Datamap, leave as None.
-        :param acquired_intensity: The result of the last incomplete acquisition. This is useful in a time routine where
-                                   flashes can occur mid acquisition. Leave as None if it is not the case. (array)
-        :param pixel_list: The list of pixels to be iterated on. If none, a pixel_list of a raster scan will be
-                           generated. (list of tuples (row, col))
-        :param bleach: Determines whether bleaching is active or not. (Bool)
-        :param update: Determines whether the datamap is updated in place. If set to false, the datamap can still be
-                       updated later with the returned bleached datamap. (Bool)
-        :param seed: Sets a seed for the random number generator.
-        :param filter_bypass: Whether or not to filter the pixel list.
-                              This is useful if you know your pixel list is adequate and ordered differently from a
-                              raster scan (i.e. a left to right, row by row scan), as filtering the list return it
-                              in raster order.
-                              If pixel_list is none, this must be True then.
-        :param bleach_func: The bleaching function to be applied.
-        :param steps: list containing the pixeldwelltimes for the sub steps of an acquisition. Is none by default.
-                      Should be used if trying to implement a DyMin type acquisition, where decisions are made
-                      after some time on whether or not to continue the acq.
+        Returns the policy of the RESCue acquisition. The acquisition of a pixel is stopped when the number of photons
+        is below the ``lower_threshold`` (label 0) or extrapolated to the pixel dwell time when it exceeds the
+        ``upper_threshold`` (label 2). Otherwise the photons are accumulated (label 1).
 
-        :return: returned_acquired_photons, the acquired photon for the acquisition.
-                 bleached_sub_datamaps_dict, a dict containing the results of bleaching on the subdatamaps
-                 acquired_intensity, the intensity of the acquisition, used for interrupted acquisitions
+        :return: A dict describing the steps of the acquisition (see :class:`AdaptiveMicroscope`).
         """
-        datamap_roi = datamap.whole_datamap[datamap.roi]
-        pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape)
-        p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape)
-        p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape)
-
-        datamap_pixelsize = datamap.pixelsize
-        i_ex, i_sted, psf_det = self.cache(datamap_pixelsize)
-        if datamap.roi is None:
-            datamap.set_roi(i_ex)
-
-        datamap_roi = datamap.whole_datamap[datamap.roi]
-        pixel_list = utils.pixel_list_filter(datamap_roi, pixel_list, pixelsize, datamap_pixelsize)
-
-        ratio = utils.pxsize_ratio(pixelsize, datamap_pixelsize)
-        rows_pad, cols_pad = datamap.roi_corners['tl'][0], datamap.roi_corners['tl'][1]
-        laser_pad = i_ex.shape[0] // 2
-
-        prob_ex = numpy.ones(datamap.whole_datamap.shape)
-        prob_sted = numpy.ones(datamap.whole_datamap.shape)
-        bleached_datamap = numpy.copy(datamap.whole_datamap)
-        returned_photons = numpy.zeros(datamap.whole_datamap[datamap.roi].shape)
-        thresholds = numpy.zeros(datamap.whole_datamap[datamap.roi].shape)
-        acquired_intensity = numpy.zeros(datamap.whole_datamap[datamap.roi].shape)
-
-        bleached_sub_datamaps_dict = {}
-        if isinstance(indices, type(None)):
-            indices = 0
-        for key in datamap.sub_datamaps_dict:
-            bleached_sub_datamaps_dict[key] = numpy.copy(datamap.sub_datamaps_dict[key].astype(numpy.int64))
-
-        uniform_ex = numpy.all(p_ex == p_ex[0, 0])
-        uniform_sted = numpy.all(p_sted == p_sted[0, 0])
-        uniform_pdt = numpy.all(pdt == pdt[0, 0])
-        is_uniform = uniform_sted and uniform_ex and uniform_pdt
-        if is_uniform:
-            effectives = []
-            for i in range(len(self.opts["decision_time"])):
-                effective = self.get_effective(datamap.pixelsize, p_ex[0, 0], p_sted[0, 0])
-                effectives.append(effective)
-
-        if isinstance(seed, type(None)):
-            seed = 0
-        for key, value in self.opts.items():
-            if isinstance(value, list):
-                self.opts[key] = numpy.array(value)
-            self.opts[key] = self.opts[key].astype(float)
-        raster_func = raster.raster_func_rescue
-        raster_func(self, datamap, acquired_intensity, numpy.array(pixel_list).astype(numpy.int32), ratio, rows_pad,
-                    cols_pad, laser_pad, prob_ex, prob_sted, returned_photons, thresholds, pdt, p_ex, p_sted,
-                    bleach, bleached_sub_datamaps_dict, seed, bleach_func, sample_func, [])
-
-        if update and bleach:
-            datamap.sub_datamaps_dict = bleached_sub_datamaps_dict
-            datamap.base_datamap = datamap.sub_datamaps_dict["base"]
-            datamap.whole_datamap = numpy.copy(datamap.base_datamap)
-
-        return returned_photons, bleached_sub_datamaps_dict, thresholds
+        return {
+            "decision_time" : self.opts["decision_time"],
+            "lower_threshold" : self.opts["lower_threshold"],
+            "lower_action" : "stop",
+            "upper_threshold" : self.opts["upper_threshold"],
+            "upper_action" : "extrapolate",
+            "accumulate" : True,
+            "label" : 1,
+            "lower_label" : 0,
+            "upper_label" : 2,
+        }
@@ -0,0 +1,212 @@
+'''This module implements the acquisition of a mosaic of tiles over a sample larger than a field of view.
+
+The ROI of the datamap is split in square tiles (the fields of view of the mosaic) which are acquired with
+:meth:`~pysted.base.Microscope.get_signal_and_bleach` in a pool of processes. The sub datamaps of the ROI and of
+the halo of the laser around it are copied once in a shared memory block, on which every process builds a virtually
+padded datamap (see :class:`~pysted.base.Datamap`) without copy. A tile is acquired on the window of its field of view
+and of the halo of the laser around it (see :meth:`~pysted.base.Datamap.crop_window`), which is bleached in place in
+the shared sub datamaps. The photons of the tiles are stitched in the image of the mosaic and the bleached sub
+datamaps are the shared ones, written back in the datamap.
+
+The laser bleaches the halo of a tile, which belongs to the neighbouring tiles. The bleaching cross-talk between
+the tiles is resolved by colouring the tiles as a 2 x 2 checkerboard, as the tiles of a parallel acquisition (see
+:func:`~pysted.raster.raster_func_c_self_bleach_split_g`): every tile at (even row, even column) of the mosaic is
+acquired first, then the tiles at (even row, odd column), (odd row, even column) and (odd row, odd column). Two tiles
+of the same colour are separated by a tile, such that their windows never overlap when the tiles are at least twice
+the halo of the laser, and they are acquired concurrently. A tile is therefore acquired after the bleaching of its
+neighbours of the previous colours, whose halos are handed off through the shared sub datamaps, and before the one of
+its neighbours of the next colours. As every tile is acquired with its own child of the seed, the mosaic does not
+depend on the number of processes for a fixed seed.
+
+.. code-block:: python
+
+    datamap = base.Datamap(molecules, datamap_pixelsize, copy=False, virtual_padding=True)
+    datamap.set_roi(i_ex, "max")
+    photons, bleached_sub_datamaps_dict = mosaic.acquire_mosaic(microscope, datamap, pixelsize, pdt, p_ex, p_sted,
+                                                                 tile_size=256, seed=42)
+'''
+
+import concurrent.futures
+
+from multiprocessing import shared_memory
+
+import numpy
+
+from pysted import base, utils
+
+# State of the processes of the pool, set by _init_worker
+_worker = {}
+
+
+def split_tiles(roi, tile_size):
+    '''Splits a ROI in square tiles coloured as a 2 x 2 checkerboard.
+
+    :param roi: The ROI of the datamap, a tuple of slices (see :meth:`~pysted.base.Datamap.set_roi`)
+    :param tile_size: The size of the tiles, the tiles of the last row and column being cropped to the ROI
+
+    :returns: A list of the tiles, tuples of the rows and columns (slices) of the tile in the datamap and of its colour,
+              in raster order
+    '''
+    tiles = []
+    for i, row in enumerate(range(roi[0].start, roi[0].stop, tile_size)):
+        for j, col in enumerate(range(roi[1].start, roi[1].stop, tile_size)):
+            rows = slice(row, min(row + tile_size, roi[0].stop))
+            cols = slice(col, min(col + tile_size, roi[1].stop))
+            tiles.append((rows, cols, (i % 2) * 2 + j % 2))
+    return tiles
+
+
+def _init_worker(microscope, name, shape, dtype, names, pixelsize, sparse):
+    '''Builds the virtually padded datamap of the shared sub datamaps in a process of the pool.
+
+    :param microscope: The :class:`~pysted.base.Microscope` acquiring the tiles
+    :param name: The name of the shared memory block of the sub datamaps
+    :param shape: The shape of the stacked sub datamaps
+    :param dtype: The type of the stacked sub datamaps
+    :param names: The names of the sub datamaps
+    :param pixelsize: The size of a pixel of the datamap (m)
+    :param sparse: The ``sparse`` attribute of the datamap
+    '''
+    memory = shared_memory.SharedMemory(name=name)
+    stack = numpy.ndarray(shape, dtype=dtype, buffer=memory.buf)
+    datamap = base.Datamap(stack[0], pixelsize, sparse=sparse, dtype=dtype, copy=False, virtual_padding=True)
+    datamap.sub_datamaps_dict = base.SubDatamaps.from_stack(names, stack)
+    _worker.update(memory=memory, microscope=microscope, datamap=datamap, laser=microscope.cache(pixelsize)[0])
+
+
+def _acquire_tile(rows, cols, pixelsize, pdt, p_ex, p_sted, bleach, seed, kwargs):
+    '''Acquires a tile of the mosaic in a process of the pool, bleaching the shared sub datamaps in place.
+
+    :param rows: The rows of the tile in the shared sub datamaps (slice)
+    :param cols: The columns of the tile in the shared sub datamaps (slice)
+    :param pixelsize: The pixelsize of the acquisition (m)
+    :param pdt: The pixel dwelltime of the tile, a float or an array of the shape of the tile (s)
+    :param p_ex: The excitation beam power of the tile (W)
+    :param p_sted: The depletion beam power of the tile (W)
+    :param bleach: Determines whether bleaching is active or not
+    :param seed: The ``numpy.random.SeedSequence`` of the tile
+    :param kwargs: The other arguments of :meth:`~pysted.base.Microscope.get_signal_and_bleach`
+
+    :returns: The acquired photons of the tile
+    '''
+    datamap = _worker["datamap"]
+    datamap.set_roi(_worker["laser"], {"rows": [rows.start, rows.stop - 1], "cols": [cols.start, cols.stop - 1]})
+    photons, _, _ = _worker["microscope"].get_signal_and_bleach(datamap, pixelsize, pdt, p_ex, p_sted, bleach=bleach,
+                                                                update=True, seed=seed, **kwargs)
+    return photons
+
+
+def acquire_mosaic(microscope, datamap, pixelsize, pdt, p_ex, p_sted, tile_size=256, max_workers=None, bleach=True,
+                   update=True, seed=None, **kwargs):
+    '''Acquires the ROI of a datamap as a mosaic of tiles in a pool of processes.
+
+    The window of the ROI and of the halo of the laser around it is copied in a shared memory block, the tiles are
+    acquired with :meth:`~pysted.base.Microscope.get_signal_and_bleach` in the order of their colour (see
+    :mod:`pysted.mosaic`) and the photons of the tiles are stitched in the image of the ROI. Flashes are not supported.
+
+    :param microscope: A :class:`~pysted.base.Microscope` object, which is sent once to every process
+    :param datamap: The :class:`~pysted.base.Datamap` whose ROI is acquired. If its ROI is not set, its whole extent is
+                    acquired (as with ``set_roi(laser, "max")``).
+    :param pixelsize: The pixelsize of the acquisition. (m)
+    :param pdt: The pixel dwelltime. Can be either a single float value or an array of the same size as the ROI. (s)
+    :param p_ex: The excitation beam power, as *pdt*. (W)
+    :param p_sted: The depletion beam power, as *pdt*. (W)
+    :param tile_size: The size of the (square) tiles in pixels of the datamap. It is rounded up to a multiple of the
+                      ratio of the pixel size to the datamap pixel size and must be at least twice the halo of the
+                      laser.
+    :param max_workers: The number of processes of the pool. If None, the number of processors of the machine. If 1,
+                        the tiles are acquired in the calling process, with the same result.
+    :param bleach: Determines whether bleaching is active or not. (Bool)
+    :param update: Determines whether the datamap is updated in place with the bleached window (see
+                   :meth:`~pysted.base.Datamap.paste_window`). (Bool)
+    :param seed: Sets a seed for the random number generator. Either an int, a ``numpy.random.SeedSequence`` or a
+                 ``numpy.random.Generator`` from which the key of the mosaic is drawn. The tile ``i`` of
+                 :func:`split_tiles` is acquired with the ``i``-th child of the seed spawned with ``spawn``.
+    :param kwargs: The other arguments of :meth:`~pysted.base.Microscope.get_signal_and_bleach`, e.g. ``bleach_func``
+                   or ``num_threads``, which must be picklable
+
+    :returns: The acquired photons of the ROI.
+              The bleached sub datamaps of the window of the ROI, a :class:`~pysted.base.SubDatamaps` object.
+    '''
+    i_ex, _, _ = microscope.cache(datamap.pixelsize)
+    if datamap.roi is None:
+        datamap.set_roi(i_ex, "max")
+    if datamap.contains_sub_datamaps.get("flashes", False):
+        raise ValueError("Datamaps with flashes cannot be acquired as a mosaic")
+    roi_shape = datamap.whole_datamap[datamap.roi].shape
+    ratio = utils.pxsize_ratio(pixelsize, datamap.pixelsize)
+    tile_size = ((tile_size + ratio - 1) // ratio) * ratio
+    rows_pad, cols_pad = utils.pad_values(i_ex)
+    if tile_size < 2 * max(rows_pad, cols_pad):
+        raise ValueError(f"The tiles of size {tile_size} must be at least twice the halo of "
+                         f"{max(rows_pad, cols_pad)} pixels of the laser such that the tiles of a colour do not "
+                         f"overlap")
+
+    # The tiles are split in the window of the ROI, whose ROI is at the halo of the laser
+    origin = (datamap.roi[0].start - rows_pad, datamap.roi[1].start - cols_pad)
+    roi = (slice(rows_pad, rows_pad + roi_shape[0]), slice(cols_pad, cols_pad + roi_shape[1]))
+    tiles = split_tiles(roi, tile_size)
+    if isinstance(seed, numpy.random.SeedSequence):
+        root = seed
+    elif isinstance(seed, numpy.random.Generator):
+        root = numpy.random.SeedSequence(utils.rng_key(seed))
+    else:
+        root = numpy.random.SeedSequence(seed)
+    seeds = root.spawn(len(tiles))
+    params = tuple(param if isinstance(param, (float, numpy.floating))
+                   else utils.float_to_array_verifier(param, roi_shape, copy=False)
+                   for param in (pdt, p_ex, p_sted))
+
+    names = list(datamap.sub_datamaps_dict)
+    stack = datamap.sub_datamaps_dict.counts(copy=False).stack
+    shape = (len(stack), roi_shape[0] + 2 * rows_pad, roi_shape[1] + 2 * cols_pad)
+    memory = shared_memory.SharedMemory(create=True, size=max(1, int(numpy.prod(shape)) * stack.itemsize))
+    try:
+        # The window is cropped in the shared memory block as by Datamap.crop_window
+        shared = numpy.ndarray(shape, dtype=stack.dtype, buffer=memory.buf)
+        shared[...] = 0
+        rows, cols, window_rows, window_cols = datamap.window_bounds(origin, shape[1:])
+        shared[:, window_rows, window_cols] = stack[:, rows, cols]
+        initargs = (microscope, memory.name, shape, stack.dtype, names, datamap.pixelsize,
+                    getattr(datamap, "sparse", None))
+
+        photons = numpy.zeros((int(numpy.ceil(roi_shape[0] / ratio)), int(numpy.ceil(roi_shape[1] / ratio))))
+        if max_workers == 1:
+            _init_worker(*initargs)
+            executor = None
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                                              initargs=initargs)
+        try:
+            # The colours are acquired one after the other, the tiles of a colour concurrently
+            for colour in range(4):
+                arguments, positions = [], []
+                for i, (rows, cols, tile_colour) in enumerate(tiles):
+                    if tile_colour != colour:
+                        continue
+                    window = (slice(rows.start - roi[0].start, rows.stop - roi[0].start),
+                              slice(cols.start - roi[1].start, cols.stop - roi[1].start))
+                    arguments.append((rows, cols, pixelsize,
+                                      *(param if numpy.ndim(param) == 0 else param[window] for param in params),
+                                      bleach, seeds[i], kwargs))
+                    positions.append((window[0].start // ratio, window[1].start // ratio))
+                if executor is None:
+                    results = [_acquire_tile(*args) for args in arguments]
+                else:
+                    results = executor.map(_acquire_tile, *zip(*arguments)) if arguments else []
+                for (row, col), tile_photons in zip(positions, results):
+                    photons[row:row + tile_photons.shape[0], col:col + tile_photons.shape[1]] = tile_photons
+        finally:
+            if executor is None:
+                _worker.clear()
+            else:
+                executor.shutdown()
+        bleached_sub_datamaps_dict = base.SubDatamaps.from_stack(names, numpy.array(shared))
+        del shared
+    finally:
+        memory.close()
+        memory.unlink()
+
+    if update and bleach:
+        datamap.paste_window(origin, bleached_sub_datamaps_dict)
+    return photons, bleached_sub_datamaps_dict
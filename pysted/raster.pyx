@@ -7,18 +7,31 @@ The Cython implementation is used to speed up the calculation of the raster func
 '''
 
 import time
+import warnings
 import numpy
 from matplotlib import pyplot as plt
 cimport numpy
-import scipy
+import scipy, scipy.constants
 cimport cython
 
-from libc.math cimport exp
-from libc.stdlib cimport rand, srand, RAND_MAX
+from libc.math cimport exp, floor
+from libc.stdint cimport uint64_t
+from libc.stdlib cimport malloc, free
+from cython.parallel cimport prange, threadid
+from pysted._rng cimport RNG, seed_stream, binomial, poisson
+from pysted.bleach_funcs cimport (COUNTDTYPE_t, survival_func_t, sample_func_t,
+                                  c_default_update_survival_probabilities, c_sample_molecules, sample_counts,
+                                  get_c_survival_func, get_c_sample_func, get_shared_rng)
+
+from pysted import bleach_funcs
+from pysted.bank import ParameterBank
 
 INTDTYPE = numpy.int32
 INT64DTYPE = numpy.int64
 FLOATDTYPE = numpy.float64
+# Types of the molecule counts of the stacked sub datamaps (see COUNTDTYPE_t)
+COUNT_DTYPES = (numpy.dtype(numpy.uint8), numpy.dtype(numpy.uint16), numpy.dtype(numpy.int32),
+                numpy.dtype(numpy.int64))
 
 ctypedef numpy.int32_t INTDTYPE_t
 ctypedef numpy.int64_t INT64DTYPE_t
@@ -43,6 +56,852 @@ def reset_prob(
         prob_ex[s, t] = 1.0
         prob_sted[s, t] = 1.0
 
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void combine_footprint(
+    object bleached_sub_datamaps_dict,
+    numpy.ndarray[INT64DTYPE_t, ndim=2] footprint,
+    int row,
+    int col
+):
+    '''Sums the sub datamaps over the laser footprint whose top left corner is at (row, col)
+
+    Only the ``footprint.shape`` window of every sub datamap is read such that the cost
+    of combining the sub datamaps does not depend on the size of the datamap.
+
+    :param bleached_sub_datamaps_dict: Dictionary with the different parts of the datamap
+    :param footprint: 2D array of the shape of the laser in which the sum is written
+    :param row: The row of the top left corner of the footprint in the datamap
+    :param col: The column of the top left corner of the footprint in the datamap
+    '''
+    cdef int s, t
+    cdef int h = footprint.shape[0]
+    cdef int w = footprint.shape[1]
+    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] current_datamap
+
+    for s in range(h):
+        for t in range(w):
+            footprint[s, t] = 0
+    for key in bleached_sub_datamaps_dict:
+        current_datamap = bleached_sub_datamaps_dict[key]
+        for s in range(h):
+            for t in range(w):
+                footprint[s, t] += current_datamap[row + s, col + t]
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef int gather_footprint(
+    COUNTDTYPE_t[:, :, ::1] sub_datamaps,
+    INT64DTYPE_t[:, ::1] footprint,
+    INTDTYPE_t[:, ::1] mask,
+    int row,
+    int col
+) noexcept nogil:
+    '''Sums the stacked sub datamaps over the laser footprint whose top left corner is at (row, col) and lists the
+    positions of the emitters in the footprint
+
+    :param sub_datamaps: 3D array of the sub datamaps stacked along the first axis
+    :param footprint: 2D array of the shape of the laser in which the sum is written
+    :param mask: 2D array of shape (footprint.size, 2) in which the positions of the emitters are written
+    :param row: The row of the top left corner of the footprint in the datamap
+    :param col: The column of the top left corner of the footprint in the datamap
+
+    :returns: The number of positions written in the mask
+    '''
+    cdef int l, s, t
+    cdef int h = footprint.shape[0]
+    cdef int w = footprint.shape[1]
+    cdef int num_mask = 0
+
+    for s in range(h):
+        for t in range(w):
+            footprint[s, t] = 0
+    for l in range(sub_datamaps.shape[0]):
+        for s in range(h):
+            for t in range(w):
+                footprint[s, t] += sub_datamaps[l, row + s, col + t]
+    for s in range(h):
+        for t in range(w):
+            if footprint[s, t] > 0:
+                mask[num_mask, 0] = s
+                mask[num_mask, 1] = t
+                num_mask += 1
+    return num_mask
+
+cdef struct EmitterIndex:
+    # Compressed sparse rows of the occupied positions of the stacked sub datamaps: the columns of the emitters of row
+    # r are cols[row_ptr[r]:row_ptr[r] + row_len[r]] in increasing order
+    numpy.intp_t *row_ptr
+    numpy.intp_t *row_len
+    INTDTYPE_t *cols
+    # Whether the bleached emitters are removed from their row when they are visited
+    bint prune
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef tuple index_emitters(COUNTDTYPE_t[:, :, ::1] sub_datamaps):
+    '''Lists the occupied positions of the stacked sub datamaps as compressed sparse rows
+
+    The emitters of every row are counted in a first pass and their columns are written in a second pass.
+
+    :param sub_datamaps: 3D array of the sub datamaps stacked along the first axis
+
+    :returns: A tuple of the start of every row in the columns, the number of emitters of every row and the columns of
+              the emitters sorted by row and column
+    '''
+    cdef int k, s, t
+    cdef numpy.intp_t n
+    cdef int num_layers = sub_datamaps.shape[0]
+    cdef int height = sub_datamaps.shape[1]
+    cdef int width = sub_datamaps.shape[2]
+    cdef numpy.intp_t[::1] row_ptr = numpy.empty(height + 1, dtype=numpy.intp)
+    cdef numpy.intp_t[::1] row_len = numpy.empty(height, dtype=numpy.intp)
+    cdef INTDTYPE_t[::1] cols
+
+    with nogil:
+        row_ptr[0] = 0
+        for s in range(height):
+            n = 0
+            for t in range(width):
+                for k in range(num_layers):
+                    if sub_datamaps[k, s, t] != 0:
+                        n += 1
+                        break
+            row_len[s] = n
+            row_ptr[s + 1] = row_ptr[s] + n
+
+    cols = numpy.empty(row_ptr[height], dtype=numpy.int32)
+    with nogil:
+        for s in range(height):
+            n = row_ptr[s]
+            for t in range(width):
+                for k in range(num_layers):
+                    if sub_datamaps[k, s, t] != 0:
+                        cols[n] = t
+                        n += 1
+                        break
+    return numpy.asarray(row_ptr), numpy.asarray(row_len), numpy.asarray(cols)
+
+cdef bint use_emitter_index(object sparse, numpy.intp_t num_emitters, numpy.intp_t num_positions):
+    '''Decides if the emitters are found with the sparse index of the datamap
+
+    :param sparse: The ``sparse`` attribute of the datamap (see :class:`~pysted.base.Datamap`)
+    :param num_emitters: The number of occupied positions of the datamap
+    :param num_positions: The number of positions of the datamap
+
+    :returns: ``sparse`` if set, otherwise whether at most half of the positions are occupied
+    '''
+    if sparse is None:
+        return num_emitters * 2 <= num_positions
+    return sparse
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef int gather_emitters(
+    COUNTDTYPE_t[:, :, ::1] sub_datamaps,
+    EmitterIndex *emitters,
+    INT64DTYPE_t[:, ::1] footprint,
+    INTDTYPE_t[:, ::1] mask,
+    int row,
+    int col
+) noexcept nogil:
+    '''Sums the stacked sub datamaps at the emitters of the laser footprint whose top left corner is at (row, col) and
+    lists their positions
+
+    Only the emitters of the index within the footprint are visited, such that the cost depends on the number of
+    emitters under the laser instead of the size of the laser. Contrary to ``gather_footprint``, the footprint is only
+    written at the positions of the mask. The bleached emitters are removed from the index if ``emitters.prune`` is
+    set. Without index (``emitters`` is NULL), the whole footprint is gathered with ``gather_footprint``.
+
+    :param sub_datamaps: 3D array of the sub datamaps stacked along the first axis
+    :param emitters: The sparse index of the emitters of the sub datamaps or NULL
+    :param footprint: 2D array of the shape of the laser in which the sum is written
+    :param mask: 2D array of shape (footprint.size, 2) in which the positions of the emitters are written
+    :param row: The row of the top left corner of the footprint in the datamap
+    :param col: The column of the top left corner of the footprint in the datamap
+
+    :returns: The number of positions written in the mask
+    '''
+    cdef int l, s, t
+    cdef int h = footprint.shape[0]
+    cdef int w = footprint.shape[1]
+    cdef int num_mask = 0
+    cdef numpy.intp_t begin, end, lo, hi, mid, k, kept
+    cdef INT64DTYPE_t total
+
+    if emitters == NULL:
+        return gather_footprint(sub_datamaps, footprint, mask, row, col)
+
+    for s in range(h):
+        begin = emitters.row_ptr[row + s]
+        end = begin + emitters.row_len[row + s]
+
+        # First emitter of the row at the left of the footprint
+        lo, hi = begin, end
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if emitters.cols[mid] < col:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        k, kept = lo, lo
+        while (k < end) and (emitters.cols[k] < col + w):
+            t = emitters.cols[k] - col
+            total = 0
+            for l in range(sub_datamaps.shape[0]):
+                total += sub_datamaps[l, row + s, col + t]
+            if total > 0:
+                footprint[s, t] = total
+                mask[num_mask, 0] = s
+                mask[num_mask, 1] = t
+                num_mask += 1
+                if emitters.prune:
+                    emitters.cols[kept] = emitters.cols[k]
+                kept += 1
+            k += 1
+
+        # Removes the bleached emitters from the row
+        if emitters.prune and (kept < k):
+            while k < end:
+                emitters.cols[kept] = emitters.cols[k]
+                kept += 1
+                k += 1
+            emitters.row_len[row + s] = kept - begin
+    return num_mask
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void prune_emitters(COUNTDTYPE_t[:, :, ::1] sub_datamaps, EmitterIndex *emitters) noexcept nogil:
+    '''Removes the bleached emitters from every row of the index
+
+    :param sub_datamaps: 3D array of the sub datamaps stacked along the first axis
+    :param emitters: The sparse index of the emitters of the sub datamaps
+    '''
+    cdef int l, r
+    cdef numpy.intp_t k, kept, begin
+    cdef INT64DTYPE_t total
+
+    for r in range(sub_datamaps.shape[1]):
+        begin = emitters.row_ptr[r]
+        kept = begin
+        for k in range(begin, begin + emitters.row_len[r]):
+            total = 0
+            for l in range(sub_datamaps.shape[0]):
+                total += sub_datamaps[l, r, emitters.cols[k]]
+            if total > 0:
+                emitters.cols[kept] = emitters.cols[k]
+                kept += 1
+        emitters.row_len[r] = kept - begin
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void integrate_occupancy(COUNTDTYPE_t[:, :, ::1] sub_datamaps, numpy.intp_t[:, ::1] table) noexcept nogil:
+    '''Computes the summed-area table of the occupied positions of the stacked sub datamaps
+
+    ``table[r, c]`` is the number of occupied positions in the rows ``[0, r)`` and the columns ``[0, c)``.
+
+    :param sub_datamaps: 3D array of the sub datamaps stacked along the first axis
+    :param table: 2D array of shape (rows + 1, columns + 1) of the sub datamaps in which the table is written
+    '''
+    cdef int l, r, c
+    cdef numpy.intp_t line
+    cdef INT64DTYPE_t total
+
+    for c in range(sub_datamaps.shape[2] + 1):
+        table[0, c] = 0
+    for r in range(sub_datamaps.shape[1]):
+        table[r + 1, 0] = 0
+        line = 0
+        for c in range(sub_datamaps.shape[2]):
+            total = 0
+            for l in range(sub_datamaps.shape[0]):
+                total += sub_datamaps[l, r, c]
+            if total > 0:
+                line += 1
+            table[r + 1, c + 1] = table[r, c + 1] + line
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef inline numpy.intp_t count_occupied(numpy.intp_t[:, ::1] table, int row, int col, int h, int w) noexcept nogil:
+    '''Counts the occupied positions of the laser footprint whose top left corner is at (row, col) from the
+    summed-area table of the occupied positions
+
+    :param table: The summed-area table of the occupied positions (see ``integrate_occupancy``)
+    :param row: The row of the top left corner of the footprint in the datamap
+    :param col: The column of the top left corner of the footprint in the datamap
+    :param h: The height of the footprint
+    :param w: The width of the footprint
+
+    :returns: The number of occupied positions
+    '''
+    return table[row + h, col + w] - table[row, col + w] - table[row + h, col] + table[row, col]
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef int count_bleached(
+    COUNTDTYPE_t[:, :, ::1] sub_datamaps,
+    INTDTYPE_t[:, ::1] mask,
+    int num_mask,
+    int row,
+    int col
+) noexcept nogil:
+    '''Counts the positions of the mask whose molecules are all bleached
+
+    :param sub_datamaps: 3D array of the sub datamaps stacked along the first axis
+    :param mask: 2D array with the positions of the emitters in the footprint
+    :param num_mask: The number of positions in the mask
+    :param row: The row of the top left corner of the footprint in the datamap
+    :param col: The column of the top left corner of the footprint in the datamap
+
+    :returns: The number of bleached positions
+    '''
+    cdef int l, m
+    cdef int bleached = 0
+    cdef INT64DTYPE_t total
+
+    for m in range(num_mask):
+        total = 0
+        for l in range(sub_datamaps.shape[0]):
+            total += sub_datamaps[l, row + mask[m, 0], col + mask[m, 1]]
+        if total == 0:
+            bleached += 1
+    return bleached
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void reset_survival(
+    FLOATDTYPE_t[:, ::1] prob_ex,
+    FLOATDTYPE_t[:, ::1] prob_sted,
+    INTDTYPE_t[:, ::1] mask,
+    int num_mask
+) noexcept nogil:
+    '''Resets the probability of survival of the fluorophores in the mask to 1.0
+
+    :param prob_ex: 2D array with the probability of survival of the fluorophores under excitation
+    :param prob_sted: 2D array with the probability of survival of the fluorophores under sted
+    :param mask: 2D array with the positions of the fluorophores
+    :param num_mask: The number of positions in the mask
+    '''
+    cdef int m
+    for m in range(num_mask):
+        prob_ex[mask[m, 0], mask[m, 1]] = 1.0
+        prob_sted[mask[m, 0], mask[m, 1]] = 1.0
+
+cdef tuple stack_banks(list banks, tuple shape):
+    '''Concatenates the arrays of the banks of an acquisition such that they can be indexed without the GIL
+
+    The arrays are cropped to the smallest window containing the compact window of every bank (see
+    :attr:`~pysted.bank.ParameterBank.window`).
+
+    :param banks: A list of :class:`~pysted.bank.ParameterBank`
+    :param shape: The shape of the ROI
+
+    :returns: A tuple of the concatenated effective PSFs and STED survival probabilities, the stacked excitation survival
+              probabilities of every bank, the stacked indices of every bank in the concatenated arrays and the row and
+              column of the window in the arrays of the banks, or None if a bank does not store its arrays
+    '''
+    cdef int offset = 0
+    cdef list indices = []
+
+    if not all(bank.is_stored for bank in banks):
+        return None
+    for bank in banks:
+        indices.append(numpy.broadcast_to(bank.indices, shape) + offset)
+        offset += len(bank.effectives)
+    windows = numpy.array([bank.window for bank in banks])
+    rows = slice(windows[:, 0].min(), windows[:, 1].max())
+    cols = slice(windows[:, 2].min(), windows[:, 3].max())
+    return (
+        numpy.ascontiguousarray(numpy.concatenate([bank.effectives[:, rows, cols] for bank in banks]),
+                                dtype=numpy.float64),
+        numpy.ascontiguousarray(numpy.stack([bank.prob_ex[rows, cols] for bank in banks]), dtype=numpy.float64),
+        numpy.ascontiguousarray(numpy.concatenate([bank.prob_sted[:, rows, cols] for bank in banks]),
+                                dtype=numpy.float64),
+        numpy.ascontiguousarray(numpy.stack(indices), dtype=numpy.intp),
+        rows.start,
+        cols.start
+    )
+
+def scans_without_gil(object bank, bint bleach, object bleach_func, object sample_func):
+    '''Whether an acquisition is done by the scan without the GIL of :func:`raster_func_c_self_bleach_split_g`, which
+    is required by its parallel mode
+
+    :param bank: The :class:`~pysted.bank.ParameterBank` of the acquisition
+    :param bleach: Boolean to indicate if the sample should be bleached
+    :param bleach_func: Function to bleach the sample
+    :param sample_func: Function to sample the sample
+
+    :returns: True if the bank stores or interpolates its arrays and, with bleaching, the bleaching and sampling
+              functions have a C implementation
+    '''
+    cdef survival_func_t c_survival_func
+
+    if not (bank.is_stored or ((bank.grid_size is not None) and not bank.is_uniform)):
+        return False
+    if not bleach:
+        return True
+    # The survival probabilities of uniform imaging parameters are the ones of the bank
+    c_survival_func = c_default_update_survival_probabilities if bank.is_uniform else get_c_survival_func(bleach_func)
+    return (c_survival_func != NULL) and (get_c_sample_func(sample_func) != NULL)
+
+cdef object warn_untrimmed(list banks, tuple laser_shape):
+    '''Warns that the compact window of the banks is not used by the Python-callable functions, which visit the
+    whole laser
+
+    :param banks: A list of :class:`~pysted.bank.ParameterBank`
+    :param laser_shape: The shape of the laser
+    '''
+    if any(tuple(bank.window) != (0, laser_shape[0], 0, laser_shape[1]) for bank in banks):
+        warnings.warn("The compact window of the bank (psf_energy) is only used by the scan without the GIL, the "
+                      "whole laser is visited with Python-callable bleaching and sampling functions.")
+
+cdef struct Grid:
+    # Arrays of the nodes of the interpolation grid of a bank (see ParameterBank.get_corners) cropped to the footprint
+    # and flattened, of shape (nodes, h * w)
+    FLOATDTYPE_t *effectives
+    FLOATDTYPE_t *k_sted
+    # Nodes and weights of the corners of the cell of every pixel of the ROI, of shape (rows * cols, 4) for the
+    # effective PSF and (rows * cols, 8) for the STED photobleaching rates
+    numpy.intp_t *effective_nodes
+    FLOATDTYPE_t *effective_weights
+    numpy.intp_t *k_sted_nodes
+    FLOATDTYPE_t *k_sted_weights
+    # Pixel dwell time of every pixel of the ROI
+    FLOATDTYPE_t *pdt
+    int cols
+    int w
+    int size
+
+cdef tuple stack_grid(object bank, tuple shape):
+    '''Crops the nodes of the interpolation grid of a bank which does not store its arrays such that they can be
+    interpolated without the GIL
+
+    :param bank: A :class:`~pysted.bank.ParameterBank` in the interpolation mode
+    :param shape: The shape of the ROI
+
+    :returns: A tuple of the arrays of ``stack_banks``, in which the effective PSFs and the survival probabilities are
+              single arrays of the shape of the footprint, and of the arrays of the ``Grid`` of the bank, or None if
+              the bank is not in the interpolation mode
+    '''
+    if bank.is_stored or (bank.grid_size is None) or bank.is_uniform:
+        return None
+    effectives, k_sted, effective_nodes, effective_weights, k_sted_nodes, k_sted_weights, pdt = bank.get_corners()
+    rows = slice(bank.window[0], bank.window[1])
+    cols = slice(bank.window[2], bank.window[3])
+    footprint_shape = (1, rows.stop - rows.start, cols.stop - cols.start)
+    return (
+        (numpy.zeros(footprint_shape, dtype=numpy.float64),
+         numpy.ones(footprint_shape, dtype=numpy.float64),
+         numpy.ones(footprint_shape, dtype=numpy.float64),
+         numpy.zeros((1, *shape), dtype=numpy.intp),
+         rows.start,
+         cols.start),
+        # The arrays are copied such that the memoryviews are writeable and C-contiguous
+        (numpy.array(effectives[:, rows, cols], dtype=numpy.float64, order="C"),
+         numpy.array(k_sted[:, rows, cols], dtype=numpy.float64, order="C"),
+         numpy.array(effective_nodes, dtype=numpy.intp, order="C"),
+         numpy.array(effective_weights, dtype=numpy.float64, order="C"),
+         numpy.array(k_sted_nodes, dtype=numpy.intp, order="C"),
+         numpy.array(k_sted_weights, dtype=numpy.float64, order="C"),
+         numpy.array(pdt, dtype=numpy.float64, order="C"))
+    )
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void interpolate_grid(Grid *grid, int row, int col, INTDTYPE_t[:, ::1] mask, int num_mask,
+                           FLOATDTYPE_t[:, ::1] effective, FLOATDTYPE_t[:, ::1] prob_sted) noexcept nogil:
+    '''Interpolates the effective PSF and the STED survival probability of a pixel at the positions of the emitters
+
+    The arrays are the ones of :meth:`~pysted.bank.ParameterBank.get` for the positions of the mask.
+
+    :param grid: The interpolation grid of the bank
+    :param row: The row of the pixel in the ROI
+    :param col: The column of the pixel in the ROI
+    :param mask: 2D array with the positions of the emitters
+    :param num_mask: The number of positions in the mask
+    :param effective: 2D array of the effective PSF, updated at the positions of the mask
+    :param prob_sted: 2D array of the STED survival probability, updated at the positions of the mask
+    '''
+    cdef int m, c, s, t
+    cdef numpy.intp_t pixel = <numpy.intp_t>row * grid.cols + col
+    cdef numpy.intp_t position
+    cdef double value, rate
+
+    for m in range(num_mask):
+        s, t = mask[m, 0], mask[m, 1]
+        position = s * grid.w + t
+        value = 0.0
+        for c in range(4):
+            value += grid.effective_weights[4 * pixel + c] * \
+                     grid.effectives[grid.effective_nodes[4 * pixel + c] * grid.size + position]
+        rate = 0.0
+        for c in range(8):
+            rate += grid.k_sted_weights[8 * pixel + c] * \
+                    grid.k_sted[grid.k_sted_nodes[8 * pixel + c] * grid.size + position]
+        effective[s, t] = value
+        prob_sted[s, t] = exp(-1. * rate * grid.pdt[pixel])
+
+cdef object stack_sub_datamaps(object bleached_sub_datamaps_dict):
+    '''Stacks the sub datamaps in a 3D array
+
+    The stack of a :class:`~pysted.base.SubDatamaps` is used in place, without copy, when it is
+    a writeable C-contiguous array of one of the types of the molecule counts (see
+    :attr:`~pysted.utils.COUNT_DTYPES`). Otherwise it is copied, in int64 if it is not of these types.
+
+    :param bleached_sub_datamaps_dict: Dictionary with the different parts of the datamap
+
+    :returns: A 3D array of the sub datamaps in the order of the keys of the dictionary
+    '''
+    stack = getattr(bleached_sub_datamaps_dict, "stack", None)
+    if stack is not None:
+        if stack.dtype not in COUNT_DTYPES:
+            return numpy.array(stack, dtype=numpy.int64, order="C")
+        if stack.flags.c_contiguous and stack.flags.writeable:
+            return stack
+        return numpy.array(stack, order="C")
+    return numpy.ascontiguousarray(numpy.stack(list(bleached_sub_datamaps_dict.values())), dtype=numpy.int64)
+
+cdef void unstack_sub_datamaps(object bleached_sub_datamaps_dict, object sub_datamaps):
+    '''Copies the stacked sub datamaps in place in the arrays of the dictionary
+
+    :param bleached_sub_datamaps_dict: Dictionary with the different parts of the datamap
+    :param sub_datamaps: 3D array of the sub datamaps in the order of the keys of the dictionary
+    '''
+    if getattr(bleached_sub_datamaps_dict, "stack", None) is sub_datamaps:
+        return
+    for key, sub_datamap in zip(bleached_sub_datamaps_dict, sub_datamaps):
+        bleached_sub_datamaps_dict[key][...] = sub_datamap
+
+cdef struct Detection:
+    # Energy of an emitted photon (J)
+    double e_photon
+    # Photon collection and detection efficiency of the detector
+    double efficiency
+    bint noise
+    # Background and dark counts per second of detection accounting for the gating
+    double background
+    double darkcount
+
+cdef Detection get_detection(object self):
+    '''Extracts the parameters of the photon detection of a microscope
+
+    :param self: The microscope
+
+    :returns: A ``Detection`` struct
+    '''
+    cdef Detection detection
+    detection.e_photon = scipy.constants.c * scipy.constants.h / self.fluo.lambda_
+    detection.efficiency = self.detector.pcef * self.detector.pdef
+    detection.noise = self.detector.noise
+    detection.background = self.detector.background * self.detector.det_width * self.sted.rate
+    detection.darkcount = self.detector.darkcount * self.detector.det_width * self.sted.rate
+    return detection
+
+cdef double detect_photons(Detection *detection, RNG *rng, double intensity, double dwelltime) noexcept nogil:
+    '''Computes the detected signal of a pixel from its acquired intensity
+
+    Scalar equivalent of ``self.detector.get_signal(self.fluo.get_photons(intensity), dwelltime, self.sted.rate)``
+    which samples the same distributions from the random generator of the kernels.
+
+    :param detection: The parameters of the detection
+    :param rng: The random generator of the acquisition
+    :param intensity: The acquired intensity
+    :param dwelltime: The time spent to detect the emitted photons (s)
+
+    :returns: The detected signal (in photons)
+    '''
+    cdef double signal
+    cdef long long photons = <long long>floor(intensity / detection.e_photon)
+
+    signal = binomial(rng, photons, detection.efficiency) * dwelltime
+    if detection.noise:
+        signal = poisson(rng, signal)
+    if detection.background > 0:
+        signal += poisson(rng, detection.background * dwelltime)
+    if detection.darkcount > 0:
+        signal += poisson(rng, detection.darkcount * dwelltime)
+    return signal
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void raster_tile(
+    INTDTYPE_t[:, ::1] pixels,
+    int start,
+    int stop,
+    int ratio,
+    int row_offset,
+    int col_offset,
+    bint bleach,
+    FLOATDTYPE_t[:, :] acquired_intensity,
+    COUNTDTYPE_t[:, :, ::1] sub_datamaps,
+    EmitterIndex *emitters,
+    numpy.intp_t[:, ::1] occupancy,
+    int refresh,
+    FLOATDTYPE_t[:, :, ::1] effectives,
+    FLOATDTYPE_t[:, ::1] bank_prob_ex,
+    FLOATDTYPE_t[:, :, ::1] bank_prob_sted,
+    numpy.intp_t[:, ::1] indices,
+    Grid *grid,
+    INT64DTYPE_t[:, ::1] footprint,
+    INTDTYPE_t[:, ::1] mask,
+    FLOATDTYPE_t[:, ::1] survival_ex,
+    FLOATDTYPE_t[:, ::1] survival_sted,
+    FLOATDTYPE_t[:, ::1] effective,
+    FLOATDTYPE_t[:, ::1] prob_sted,
+    survival_func_t c_survival_func,
+    sample_func_t c_sample_func,
+    numpy.intp_t[::1] streams,
+    uint64_t seed
+) noexcept nogil:
+    '''Acquires and bleaches the pixels ``pixels[start:stop]`` in order
+
+    :param pixels: 2D array with the position of the pixels to be acquired
+    :param start: The index of the first pixel to acquire
+    :param stop: The index after the last pixel to acquire
+    :param ratio: The ratio of the pixel size to the datamap pixel size
+    :param row_offset: The row of the footprint in the window of the laser
+    :param col_offset: The column of the footprint in the window of the laser
+    :param bleach: Boolean to indicate if the sample should be bleached
+    :param acquired_intensity: 2D array to store the acquired intensity
+    :param sub_datamaps: 3D array of the sub datamaps stacked along the first axis
+    :param emitters: The sparse index of the emitters of the sub datamaps or NULL to visit the whole footprint
+    :param occupancy: The summed-area table of the occupied positions of the sub datamaps
+    :param refresh: The minimal number of pixels between two updates of ``occupancy`` once emitters were bleached, 0
+                    to never update it
+    :param effectives: 3D array of the effective PSFs of the bank
+    :param bank_prob_ex: 2D array of the survival probability under excitation of the bank
+    :param bank_prob_sted: 3D array of the survival probabilities under sted of the bank
+    :param indices: 2D array of the index of every pixel of the ROI in the arrays of the bank
+    :param grid: The interpolation grid of a bank which does not store its arrays (see ``stack_grid``), from which the
+                 arrays of every pixel are interpolated instead of being read from the arrays of the bank, or NULL
+    :param footprint: Buffer of the shape of the footprint
+    :param mask: Buffer of shape (footprint.size, 2) for the positions of the emitters
+    :param survival_ex: Buffer of the shape of the footprint filled with ones
+    :param survival_sted: Buffer of the shape of the footprint filled with ones
+    :param effective: Buffer of the shape of the footprint for the interpolated effective PSF
+    :param prob_sted: Buffer of the shape of the footprint for the interpolated survival probability under sted
+    :param c_survival_func: The C function updating the survival probabilities
+    :param c_sample_func: The C function sampling the molecules. As ``c_sample_molecules`` is the only C implementation,
+                          the sub datamaps of the compact types of the molecule counts are sampled with its
+                          implementation for every type, ``sample_counts``
+    :param streams: 1D array of the random stream of every pixel
+    :param seed: The key of the random generator
+    '''
+    cdef int n, m, row, col, sprime, tprime, index, num_mask
+    cdef int h = footprint.shape[0]
+    cdef int w = footprint.shape[1]
+    cdef int bleached = 0
+    cdef int last_refresh = start
+    cdef double value
+    cdef RNG rng
+
+    for n in range(start, stop):
+        index = indices[pixels[n, 0], pixels[n, 1]]
+
+        # Top left corner of the footprint in the datamap
+        row, col = pixels[n, 0] + row_offset, pixels[n, 1] + col_offset
+
+        # There is nothing to acquire nor to bleach without emitters under the laser
+        if count_occupied(occupancy, row, col, h, w) == 0:
+            continue
+
+        # Combines the sub datamaps over the laser footprint and keeps track
+        # of the position of the emitters
+        num_mask = gather_emitters(sub_datamaps, emitters, footprint, mask, row, col)
+
+        # The arrays of the pixel are read from the bank or interpolated at the positions of the emitters
+        if grid == NULL:
+            effective, prob_sted = effectives[index], bank_prob_sted[index]
+        else:
+            interpolate_grid(grid, pixels[n, 0], pixels[n, 1], mask, num_mask, effective, prob_sted)
+
+        # Calculates the acquired intensity
+        value = 0.0
+        for m in range(num_mask):
+            sprime, tprime = mask[m, 0], mask[m, 1]
+            value += effective[sprime, tprime] * footprint[sprime, tprime]
+        acquired_intensity[pixels[n, 0] // ratio, pixels[n, 1] // ratio] += value
+
+        # Bleaches the sample
+        if bleach:
+            c_survival_func(survival_ex, survival_sted, bank_prob_ex, prob_sted, mask, num_mask)
+            seed_stream(&rng, seed, streams[n])
+            if COUNTDTYPE_t is numpy.int64_t:
+                c_sample_func(sub_datamaps, row, col, mask, num_mask, survival_ex, survival_sted, &rng)
+            else:
+                sample_counts(sub_datamaps, row, col, mask, num_mask, survival_ex, survival_sted, &rng)
+            reset_survival(survival_ex, survival_sted, mask, num_mask)
+
+            # The table only overestimates the emitters once they bleach and is periodically updated
+            if refresh > 0:
+                bleached += count_bleached(sub_datamaps, mask, num_mask, row, col)
+                if (bleached > 0) and (n - last_refresh >= refresh):
+                    integrate_occupancy(sub_datamaps, occupancy)
+                    bleached, last_refresh = 0, n
+
+cdef tuple tile_pixel_list(numpy.ndarray[INTDTYPE_t, ndim=2] pixel_list, int tile_size):
+    '''Splits a pixel list in square tiles coloured such that the laser footprints of the pixels of two different
+    tiles of the same colour never overlap
+
+    The tiles are coloured as a 2 x 2 checkerboard. Two tiles of the same colour are thus separated by at least one tile
+    such that a ``tile_size`` larger or equal to the laser footprint is sufficient.
+
+    :param pixel_list: 2D array with the position of the pixels to be acquired
+    :param tile_size: The size of the tiles
+
+    :returns: A tuple of the reordered pixel list, the index of every reordered pixel in the pixel list, the bounds of
+              every tile in the reordered pixel list and the bounds of every colour in the tiles
+    '''
+    if len(pixel_list) == 0:
+        return (pixel_list, numpy.zeros(0, dtype=numpy.intp), numpy.zeros(1, dtype=numpy.intp),
+                numpy.zeros(5, dtype=numpy.intp))
+    tile_rows = pixel_list[:, 0] // tile_size
+    tile_cols = pixel_list[:, 1] // tile_size
+    colours = (tile_rows % 2) * 2 + tile_cols % 2
+    tiles = tile_rows * (tile_cols.max() + 1) + tile_cols
+
+    # The sort is stable such that the order of the pixel list is kept within a tile
+    order = numpy.lexsort((tiles, colours))
+    tiles, colours = tiles[order], colours[order]
+    tile_starts = numpy.flatnonzero(numpy.diff(tiles, prepend=-1))
+    tile_bounds = numpy.append(tile_starts, len(order)).astype(numpy.intp)
+    colour_bounds = numpy.searchsorted(colours[tile_starts], numpy.arange(5)).astype(numpy.intp)
+    return numpy.ascontiguousarray(pixel_list[order]), order.astype(numpy.intp), tile_bounds, colour_bounds
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef object raster_stack(
+        COUNTDTYPE_t[:, :, ::1] sub_datamaps,
+        FLOATDTYPE_t[:, :] intensity,
+        object pixel_list,
+        int ratio,
+        bint bleach,
+        tuple stacked,
+        tuple grid_arrays,
+        object sparse,
+        object num_threads,
+        survival_func_t c_survival_func,
+        sample_func_t c_sample_func,
+        uint64_t seed
+):
+    '''Scan without the GIL of :func:`raster_func_c_self_bleach_split_g` on the stacked sub datamaps
+
+    The function is specialized for every type of the molecule counts such that the sub datamaps are bleached in place
+    in their compact type.
+
+    :param sub_datamaps: 3D array of the sub datamaps stacked along the first axis, bleached in place
+    :param intensity: 2D array to store the acquired intensity
+    :param pixel_list: 2D array with the position of the pixels to be acquired
+    :param ratio: The ratio of the pixel size to the datamap pixel size
+    :param bleach: Boolean to indicate if the sample should be bleached
+    :param stacked: The arrays of the bank returned by ``stack_banks``
+    :param grid_arrays: The arrays of the interpolation grid of the bank returned by ``stack_grid``, or None if the bank
+                        stores its arrays
+    :param sparse: Whether the emitters are found from the sparse index of the occupied positions (see
+                   :class:`~pysted.base.Datamap`)
+    :param num_threads: The number of threads of the tiled acquisition. If None, the pixel list is acquired in order
+    :param c_survival_func: The C function updating the survival probabilities
+    :param c_sample_func: The C function sampling the molecules (see ``raster_tile``)
+    :param seed: The key of the random generator
+    '''
+    cdef int h, w, c, k, start, stop, tile_size, tid, threads, row_offset, col_offset, refresh
+    cdef int max_len = len(pixel_list)
+    cdef FLOATDTYPE_t[:, :, ::1] effectives, banks_prob_ex, banks_prob_sted
+    cdef numpy.intp_t[:, :, ::1] indices
+    cdef INT64DTYPE_t[:, :, ::1] footprints
+    cdef INTDTYPE_t[:, :, ::1] masks
+    cdef FLOATDTYPE_t[:, :, ::1] survivals_ex, survivals_sted
+    cdef INTDTYPE_t[:, ::1] pixels
+    cdef numpy.intp_t[::1] tile_bounds, colour_bounds
+    cdef numpy.intp_t[::1] streams
+    cdef numpy.intp_t[::1] emitter_row_ptr, emitter_row_len
+    cdef INTDTYPE_t[::1] emitter_cols
+    cdef EmitterIndex emitter_index
+    cdef EmitterIndex *emitters = NULL
+    cdef numpy.intp_t[:, ::1] occupancy
+    cdef FLOATDTYPE_t[:, :, ::1] grid_effectives, grid_k_sted, effective_weights, k_sted_weights, buffers_effective
+    cdef FLOATDTYPE_t[:, :, ::1] buffers_prob_sted
+    cdef numpy.intp_t[:, :, ::1] effective_nodes, k_sted_nodes
+    cdef FLOATDTYPE_t[:, ::1] grid_pdt
+    cdef Grid grid
+    cdef Grid *c_grid = NULL
+
+    effectives, banks_prob_ex, banks_prob_sted, indices, row_offset, col_offset = stacked
+
+    # The footprint is the compact window of the bank
+    h, w = effectives.shape[1], effectives.shape[2]
+
+    # The arrays of the pixels are interpolated from the nodes of the grid of a bank which does not store them
+    if grid_arrays is not None:
+        grid_effectives, grid_k_sted, effective_nodes, effective_weights, k_sted_nodes, k_sted_weights, grid_pdt = \
+            grid_arrays
+        grid.effectives = &grid_effectives[0, 0, 0]
+        grid.k_sted = &grid_k_sted[0, 0, 0]
+        grid.effective_nodes = &effective_nodes[0, 0, 0]
+        grid.effective_weights = &effective_weights[0, 0, 0]
+        grid.k_sted_nodes = &k_sted_nodes[0, 0, 0]
+        grid.k_sted_weights = &k_sted_weights[0, 0, 0]
+        grid.pdt = &grid_pdt[0, 0]
+        grid.cols = grid_pdt.shape[1]
+        grid.w = w
+        grid.size = h * w
+        c_grid = &grid
+
+    # The emitters are visited from a sparse index of the occupied positions. The tiles of a colour may share the
+    # rows of the index such that the bleached emitters are only removed between the colours in the parallel mode
+    emitter_row_ptr, emitter_row_len, emitter_cols = index_emitters(sub_datamaps)
+    if use_emitter_index(sparse, emitter_cols.shape[0], sub_datamaps.shape[1] * sub_datamaps.shape[2]):
+        emitter_index.row_ptr = &emitter_row_ptr[0]
+        emitter_index.row_len = &emitter_row_len[0]
+        emitter_index.cols = &emitter_cols[0]
+        emitter_index.prune = bleach and (num_threads is None)
+        emitters = &emitter_index
+
+    # The pixels without emitters under the laser are skipped from a summed-area table of the occupied positions.
+    # As the emitters only bleach, an outdated table never skips an occupied footprint. The table is updated after
+    # a number of pixels over which the update costs at most a laser footprint per pixel
+    occupancy = numpy.zeros((sub_datamaps.shape[1] + 1, sub_datamaps.shape[2] + 1), dtype=numpy.intp)
+    integrate_occupancy(sub_datamaps, occupancy)
+    refresh = max(1, (sub_datamaps.shape[1] * sub_datamaps.shape[2]) // (h * w))
+
+    # Buffers of every thread
+    threads = 1 if num_threads is None else max(1, num_threads)
+    footprints = numpy.zeros((threads, h, w), dtype=numpy.int64)
+    masks = numpy.zeros((threads, h * w, 2), dtype=numpy.int32)
+    survivals_ex = numpy.ones((threads, h, w), dtype=numpy.float64)
+    survivals_sted = numpy.ones((threads, h, w), dtype=numpy.float64)
+    buffers_effective = numpy.zeros((threads, h, w), dtype=numpy.float64)
+    buffers_prob_sted = numpy.ones((threads, h, w), dtype=numpy.float64)
+
+    if num_threads is None:
+        pixels = pixel_list
+        streams = numpy.arange(max_len, dtype=numpy.intp)
+        with nogil:
+            raster_tile(pixels, 0, max_len, ratio, row_offset, col_offset, bleach, intensity, sub_datamaps,
+                        emitters, occupancy, refresh, effectives, banks_prob_ex[0], banks_prob_sted, indices[0],
+                        c_grid, footprints[0], masks[0], survivals_ex[0], survivals_sted[0], buffers_effective[0],
+                        buffers_prob_sted[0], c_survival_func, c_sample_func, streams, seed)
+    else:
+        # The tiles are a multiple of ratio such that two tiles never write the same pixel of the image
+        tile_size = ((max(h, w) + ratio - 1) // ratio) * ratio
+        pixels, streams, tile_bounds, colour_bounds = tile_pixel_list(pixel_list, tile_size)
+        for c in range(4):
+            start, stop = colour_bounds[c], colour_bounds[c + 1]
+            for k in prange(start, stop, nogil=True, num_threads=threads, schedule="dynamic"):
+                tid = threadid()
+                raster_tile(pixels, tile_bounds[k], tile_bounds[k + 1], ratio, row_offset, col_offset, bleach,
+                            intensity, sub_datamaps, emitters, occupancy, 0, effectives, banks_prob_ex[0],
+                            banks_prob_sted, indices[0], c_grid, footprints[tid], masks[tid], survivals_ex[tid],
+                            survivals_sted[tid], buffers_effective[tid], buffers_prob_sted[tid], c_survival_func,
+                            c_sample_func, streams, seed)
+
+            # The tiles of a colour share the index and the table which are only updated between the colours
+            if bleach:
+                if emitters != NULL:
+                    prune_emitters(sub_datamaps, emitters)
+                integrate_occupancy(sub_datamaps, occupancy)
+
 @cython.boundscheck(False)  # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
 def raster_func_c_self_bleach_split_g(
@@ -51,583 +910,766 @@ def raster_func_c_self_bleach_split_g(
         numpy.ndarray[FLOATDTYPE_t, ndim=2] acquired_intensity,
         numpy.ndarray[INTDTYPE_t, ndim=2] pixel_list,
         int ratio,
-        int rows_pad,
-        int cols_pad,
-        int laser_pad,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_sted,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] pdt_roi,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] p_ex_roi,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] p_sted_roi,
+        object pdt_roi,
+        object p_ex_roi,
+        object p_sted_roi,
         bint bleach,
-        dict bleached_sub_datamaps_dict,
-        int seed,
+        object bleached_sub_datamaps_dict,
+        uint64_t seed,
         object bleach_func,
         object sample_func,
-        list steps
+        object bank=None,
+        object num_threads=None
 ):
     '''
     Raster and photobleaching implementation of a STED microscope acquisition.
 
     ``raster_func_c_self_bleach`` executes the simultaneous acquisition and bleaching routine for the case where the
-    excitation power (p_ex) AND/OR sted power (p_sted) AND/OR pixel dwell time vary through the sample. 
+    excitation power (p_ex) AND/OR sted power (p_sted) AND/OR pixel dwell time vary through the sample.
     This function thus requires these parameters to be passed as arrays of floats the same size as the ROI being imaged.
 
     Additionally, this function seperately bleaches the different parts composing the datamap (i.e. the base and flash
     components of the datamap are bleached separately).
 
-    To speed up the calculation, the position of the emitters are kept in memory and only 
+    To speed up the calculation, the position of the emitters are kept in memory and only
     those positions are updated by the bleaching method.
 
+    When the bank stores its arrays, or interpolates them from the nodes of its grid, and the bleaching and sampling
+    functions have a C implementation (see ``bleach_funcs.pxd``), the scan is done without the GIL on the sub datamaps
+    stacked in a 3D array, such that independent acquisitions can run concurrently in threads. Otherwise, the
+    Python-callable functions are called at every pixel.
+
+    A single acquisition is parallelized with ``num_threads``. The pixel list is then split in square tiles of the size
+    of the laser footprint (rounded up to a multiple of ``ratio``) coloured as a 2 x 2 checkerboard, such that the
+    footprints of the pixels of two tiles of the same colour never overlap. The colours are acquired one after the
+    other and the tiles of a colour concurrently with OpenMP. The visiting order thus differs from the pixel list:
+    every pixel of the tiles at (even row, even column) is acquired first, then the tiles at (even row, odd column),
+    (odd row, even column) and (odd row, odd column), the order of the pixel list being kept within a tile. A pixel
+    is therefore bleached by its neighbours of the tiles of the previous colours before it is acquired, instead of by
+    its preceding neighbours only. As every pixel samples its own random stream, the result does not depend on
+    ``num_threads`` for a fixed seed. The parallel mode requires the scan without the GIL described above and the pixel
+    list is acquired in order otherwise.
+
+    The random variates of a pixel are drawn from a counter-based generator keyed by ``seed`` and the index of the
+    pixel in the pixel list, such that they do not depend on the visiting order nor on the thread acquiring the pixel.
+
+    In the scan without the GIL, the emitters under the laser are found from a compressed sparse row index of the
+    occupied positions of the sub datamaps, from which the emitters are removed once bleached, such that the cost of a
+    pixel depends on the number of emitters under the laser instead of the size of the laser. The index is used when
+    ``datamap.sparse`` is True, or when at most half of the positions of the datamap are occupied if it is None (see
+    :class:`~pysted.base.Datamap`). The result is the same with or without the index. The pixels without emitters
+    under the laser are skipped in constant time from a summed-area table of the occupied positions, which is updated
+    periodically as the emitters bleach. The footprint of the laser is the compact window of the bank (see
+    :attr:`~pysted.bank.ParameterBank.window`), which is the whole laser unless the bank was built with ``energy``.
+
     :param datamap: The datamap on which the acquisition is done, either a Datamap object or TemporalDatamap
     :param acquired_intensity: 2D array to store the acquired intensity
     :param pixel_list: 2D array with the position of the pixels to be acquired
     :param ratio: The ratio of the pixel size to the datamap pixel size
-    :param rows_pad: The number of rows to pad the datamap
-    :param cols_pad: The number of columns to pad the datamap
-    :param laser_pad: The number of pixels to pad the laser
-    :param prob_ex: 2D array with the probability of survival of the fluorophores under excitation
-    :param prob_sted: 2D array with the probability of survival of the fluorophores under sted
-    :param pdt_roi: 2D array with the pixel dwell time
-    :param p_ex_roi: 2D array with the excitation power
-    :param p_sted_roi: 2D array with the sted power
+    :param pdt_roi: 2D array with the pixel dwell time, which may be a read-only view (see
+                    :func:`~pysted.utils.float_to_array_verifier`)
+    :param p_ex_roi: 2D array with the excitation power, which may be a read-only view
+    :param p_sted_roi: 2D array with the sted power, which may be a read-only view
     :param bleach: Boolean to indicate if the sample should be bleached
     :param bleached_sub_datamaps_dict: Dictionary with the different parts of the datamap to be bleached
-    :param seed: Seed for the random number generator
+    :param seed: The key of the random generator (see :func:`~pysted.utils.rng_key`)
     :param bleach_func: Function to bleach the sample
     :param sample_func: Function to sample the sample
-    :param steps: List with the different steps of the acquisition
+    :param bank: A :class:`~pysted.bank.ParameterBank` of the imaging parameters of the ROI. If None, an exact bank
+                 of the unique imaging parameters is computed
+    :param num_threads: The number of threads of the tiled acquisition. If None, the pixel list is acquired in order
     '''
 
-    cdef int row, col
+    cdef int row, col, s, t
     cdef int sprime, tprime
     cdef int h, w
-    cdef int current
+    cdef int n
     cdef int max_len = len(pixel_list)
     cdef FLOATDTYPE_t value
-    cdef int sampled_value
-    cdef int prob
-    cdef int rsamp
-    cdef FLOATDTYPE_t pdt, p_ex, p_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] pre_effective, effective
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] effective
     cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] k_ex, k_sted
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex, prob_sted
     cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] i_ex, i_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] photons_ex, photons_sted
-    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] bleached_datamap
-    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] current_datamap
-    cdef FLOATDTYPE_t duty_cycle
-    cdef FLOATDTYPE_t step
+    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] footprint
     cdef list mask
-    cdef bint uniform_sted, uniform_ex, uniform_pdt, is_uniform, is_single_datamap
-
-    if seed == 0:
-        # if no seed is passed, calculates a 'pseudo-random' seed form the time in ns
-        srand(int(str(time.time_ns())[15:]))
-    else:
-        srand(seed)
+    cdef bint is_uniform, is_default_bleach
+    cdef tuple stacked, grid_arrays = None
+    cdef survival_func_t c_survival_func
+    cdef sample_func_t c_sample_func
 
     i_ex, i_sted, _ = self.cache(datamap.pixelsize)
 
-    # Calculate the bleaching rate once if the scanning powers and dwelltimes do not vary to
-    # increase speed
-    uniform_ex = numpy.all(p_ex_roi == p_ex_roi[0, 0])
-    uniform_sted = numpy.all(p_sted_roi == p_sted_roi[0, 0])
-    uniform_pdt = numpy.all(pdt_roi == pdt_roi[0, 0])
-    is_uniform = uniform_sted and uniform_ex and uniform_pdt
-
-    if is_uniform:
-        p_ex = p_ex_roi[0, 0]
-        p_sted = p_sted_roi[0, 0]
-        pdt = pdt_roi[0, 0]
-        photons_ex = self.fluo.get_photons(i_ex * p_ex, self.excitation.lambda_)
-        duty_cycle = self.sted.tau * self.sted.rate
-        photons_sted = self.fluo.get_photons(i_sted * p_sted * duty_cycle, self.sted.lambda_)
-
-        # Calculates photobleaching constants
-        k_sted = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, pdt,)
-        k_ex = k_sted * 0.
-
-        # Calculates prob ex and sted once
-        prob_ex = numpy.exp(-1. * k_ex * pdt)
-        prob_sted = numpy.exp(-1. * k_sted * pdt)
-
-        # Calculates effective psf
-        effective = self.get_effective(datamap.pixelsize, p_ex, p_sted)
-    else:
-        k_sted = None
-        k_ex = None
-
-        # Calculates effective psf to get the shape
-        effective = self.get_effective(datamap.pixelsize, p_ex_roi[0, 0], p_sted_roi[0, 0])
+    # The effective PSF and the photobleaching rates of the unique imaging
+    # parameters are computed once before scanning
+    if bank is None:
+        bank = ParameterBank(self, datamap.pixelsize, p_ex_roi, p_sted_roi, pdt_roi)
+    is_uniform = bank.is_uniform
+    effective, k_ex, k_sted, prob_ex, prob_sted = bank.get(0, 0)
+    is_default_bleach = bleach_func is bleach_funcs.default_update_survival_probabilities
 
     h, w = effective.shape[0], effective.shape[1]
-    is_single_datamap = len(bleached_sub_datamaps_dict.keys()) > 1
 
-    for (row, col) in pixel_list:
+    # The survival probabilities of uniform imaging parameters are the ones of the bank
+    c_survival_func = c_default_update_survival_probabilities if is_uniform else get_c_survival_func(bleach_func)
+    c_sample_func = get_c_sample_func(sample_func)
+    if scans_without_gil(bank, bleach, bleach_func, sample_func):
+        stacked = stack_banks([bank], (pdt_roi.shape[0], pdt_roi.shape[1]))
+        if stacked is None:
+            stacked, grid_arrays = stack_grid(bank, (pdt_roi.shape[0], pdt_roi.shape[1]))
+        sub_datamaps = stack_sub_datamaps(bleached_sub_datamaps_dict)
+        if sub_datamaps.dtype == numpy.uint8:
+            raster_stack[numpy.uint8_t](
+                sub_datamaps, acquired_intensity, pixel_list, ratio, bleach, stacked, grid_arrays,
+                getattr(datamap, "sparse", None), num_threads, c_survival_func, c_sample_func, seed)
+        elif sub_datamaps.dtype == numpy.uint16:
+            raster_stack[numpy.uint16_t](
+                sub_datamaps, acquired_intensity, pixel_list, ratio, bleach, stacked, grid_arrays,
+                getattr(datamap, "sparse", None), num_threads, c_survival_func, c_sample_func, seed)
+        elif sub_datamaps.dtype == numpy.int32:
+            raster_stack[numpy.int32_t](
+                sub_datamaps, acquired_intensity, pixel_list, ratio, bleach, stacked, grid_arrays,
+                getattr(datamap, "sparse", None), num_threads, c_survival_func, c_sample_func, seed)
+        else:
+            raster_stack[numpy.int64_t](
+                sub_datamaps, acquired_intensity, pixel_list, ratio, bleach, stacked, grid_arrays,
+                getattr(datamap, "sparse", None), num_threads, c_survival_func, c_sample_func, seed)
+        if bleach:
+            unstack_sub_datamaps(bleached_sub_datamaps_dict, sub_datamaps)
+        return
+    warn_untrimmed([bank], (i_ex.shape[0], i_ex.shape[1]))
+
+    # The Python-callable functions read the sub datamaps as int64, which are not modified without bleaching
+    if hasattr(bleached_sub_datamaps_dict, "promote"):
+        bleached_sub_datamaps_dict.promote(numpy.int64)
+        if not bleach:
+            bleached_sub_datamaps_dict.stack.flags.writeable = False
+
+    # Reusable buffer holding the sum of the sub datamaps under the laser
+    footprint = numpy.zeros((h, w), dtype=numpy.int64)
+
+    for n in range(max_len):
+        row, col = pixel_list[n, 0], pixel_list[n, 1]
         if not is_uniform:
-            pdt = pdt_roi[row, col]
-            p_ex = p_ex_roi[row, col]
-            p_sted = p_sted_roi[row, col]
-            effective = self.get_effective(datamap.pixelsize, p_ex, p_sted)
+            effective, k_ex, k_sted, prob_ex, prob_sted = bank.get(row, col)
 
         mask = []
 
-        # Combines the datamaps into a single datamap
-        bleached_datamap = numpy.zeros(bleached_sub_datamaps_dict["base"].shape, dtype=numpy.int64)
-        for key in bleached_sub_datamaps_dict:
-            current_datamap = bleached_sub_datamaps_dict[key]
-            for s in range(row, row + h):
-                for t in range(col, col + w):
-                    bleached_datamap[s, t] += current_datamap[s, t]
+        # Combines the sub datamaps over the laser footprint only
+        combine_footprint(bleached_sub_datamaps_dict, footprint, row, col)
 
         # Calculates the acquired intensity and keeps track of the position
         # of the emitters
         value = 0.0
-        sprime = 0
-        for s in range(row, row + h):
-            tprime = 0
-            for t in range(col, col + w):
-                if bleach and (bleached_datamap[s, t] > 0):
+        for sprime in range(h):
+            for tprime in range(w):
+                if bleach and (footprint[sprime, tprime] > 0):
                     mask.append((sprime, tprime))
-                value += effective[sprime, tprime] * bleached_datamap[s, t]
-                tprime += 1
-            sprime += 1
-            
+                value += effective[sprime, tprime] * footprint[sprime, tprime]
+
         # Sets intensity value
         acquired_intensity[int(row / ratio), int(col / ratio)] += value
 
         # Bleaches the sample
         if bleach:
-            if not is_uniform:
-                # reset_prob(mask, prob_ex, prob_sted)
-                prob_ex = numpy.ones_like(prob_ex, dtype=numpy.float64)
-                prob_sted = numpy.ones_like(prob_sted, dtype=numpy.float64)
-                bleach_func(self, i_ex, i_sted, p_ex, p_sted, pdt, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex,
-                            prob_sted, k_ex, k_sted)
+            if not (is_uniform or is_default_bleach):
+                # The survival probabilities of the bank are the ones of the default
+                # bleaching function, other functions compute their own
+                prob_ex = numpy.ones((h, w), dtype=numpy.float64)
+                prob_sted = numpy.ones((h, w), dtype=numpy.float64)
+                bleach_func(self, i_ex, i_sted, p_ex_roi[row, col], p_sted_roi[row, col], pdt_roi[row, col],
+                            bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex, prob_sted, k_ex, k_sted)
+            seed_stream(get_shared_rng(), seed, n)
             sample_func(self, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex, prob_sted)
 
 @cython.boundscheck(False)  # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
-def raster_func_dymin(
+def raster_func_batch(
         object self,
-        object datamap,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] acquired_intensity,
+        COUNTDTYPE_t[:, :, :, ::1] sub_datamaps,
+        numpy.ndarray[FLOATDTYPE_t, ndim=3] acquired_intensity,
         numpy.ndarray[INTDTYPE_t, ndim=2] pixel_list,
         int ratio,
-        int rows_pad,
-        int cols_pad,
-        int laser_pad,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_sted,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] returned_photons,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] scaled_power,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] pdt_roi,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] p_ex_roi,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] p_sted_roi,
         bint bleach,
-        dict bleached_sub_datamaps_dict,
-        int seed,
-        object bleach_func,
-        object sample_func,
-        list steps
+        numpy.ndarray[numpy.uint64_t, ndim=1] keys,
+        object bank,
+        object sparse=None,
+        object num_threads=None
 ):
-    """
-    Implements the raster scanning and photobleaching of DyMIN microscopy
-
-    :param datamap: The datamap on which the acquisition is done, either a Datamap object or TemporalDatamap
-    :param acquired_intensity: 2D array to store the acquired intensity
+    '''
+    Raster and photobleaching implementation of the acquisition of a batch of datamaps with the default photobleaching
+    functions.
+
+    Every datamap is acquired as by the scan without the GIL of :func:`raster_func_c_self_bleach_split_g`, with the
+    same pixel list, from a single bank of the imaging parameters of the batch. The bank is built on the imaging
+    parameters of the datamaps stacked along the rows, such that the index of the pixel (row, col) of the datamap ``i``
+    is the one of the pixel (``i`` * rows + row, col) of the bank. The datamaps are independent and are acquired
+    concurrently with ``num_threads``. The random variates of the datamap ``i`` are keyed by ``keys[i]``, such that its
+    acquisition is the one of :func:`raster_func_c_self_bleach_split_g` with the key ``keys[i]``.
+
+    :param sub_datamaps: 4D array of the sub datamaps of every datamap, of shape (datamaps, sub datamaps, rows, columns),
+                         bleached in place, of one of the types of the molecule counts (see ``COUNT_DTYPES``)
+    :param acquired_intensity: 3D array to store the acquired intensity of every datamap
     :param pixel_list: 2D array with the position of the pixels to be acquired
     :param ratio: The ratio of the pixel size to the datamap pixel size
-    :param rows_pad: The number of rows to pad the datamap
-    :param cols_pad: The number of columns to pad the datamap
-    :param laser_pad: The number of pixels to pad the laser
-    :param prob_ex: 2D array with the probability of survival of the fluorophores under excitation
-    :param prob_sted: 2D array with the probability of survival of the fluorophores under sted
-    :param pdt_roi: 2D array with the pixel dwell time
-    :param p_ex_roi: 2D array with the excitation power
-    :param p_sted_roi: 2D array with the sted power
     :param bleach: Boolean to indicate if the sample should be bleached
-    :param bleached_sub_datamaps_dict: Dictionary with the different parts of the datamap to be bleached
-    :param seed: Seed for the random number generator
-    :param bleach_func: Function to bleach the sample
-    :param sample_func: Function to sample the sample
-    :param steps: List with the different steps of the acquisition    
-    """
-    cdef int row, col, i
-    cdef int sprime, tprime
-    cdef int h, w
-    cdef int current
+    :param keys: 1D array of the key of the random generator of every datamap (see :func:`~pysted.utils.rng_key`)
+    :param bank: A stored :class:`~pysted.bank.ParameterBank` of the imaging parameters of the datamaps stacked along
+                 the rows
+    :param sparse: Whether the emitters are found from a sparse index of the datamaps (see
+                   :class:`~pysted.base.Datamap`)
+    :param num_threads: The number of threads acquiring the datamaps. If None, the datamaps are acquired in order in
+                        the calling thread
+    '''
+    cdef int i, n, tid, threads, refresh, row_offset, col_offset, h, w
+    cdef int num_datamaps = sub_datamaps.shape[0]
     cdef int max_len = len(pixel_list)
-    cdef FLOATDTYPE_t value
-    cdef int sampled_value
-    cdef int prob
-    cdef int rsamp
-    cdef FLOATDTYPE_t pdt, p_ex, p_sted, _pdt, _p_ex, _p_sted
-    cdef float scale_power, decision_time, threshold_count
-    cdef int pixel_photons
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] pre_effective, effective
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=3] effectives, k_exs, k_steds
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] k_ex, k_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] i_ex, i_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] photons_ex, photons_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] pdts, p_exs, p_steds
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] SCALE_POWER, DECISION_TIME, THRESHOLD_COUNT
-    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] bleached_datamap, current_datamap
-    cdef FLOATDTYPE_t duty_cycle
-    cdef FLOATDTYPE_t step
-    cdef list mask
-    cdef int num_steps
-    cdef bint uniform_sted, uniform_ex, uniform_pdt, is_uniform
-
-    if seed == 0:
-        # if no seed is passed, calculates a 'pseudo-random' seed form the time in ns
-        srand(int(str(time.time_ns())[15:]))
-    else:
-        srand(seed)
-
-    i_ex, i_sted, _ = self.cache(datamap.pixelsize)
-    # Calculate the bleaching rate once if the scanning powers and dwelltimes do not vary to
-    # increase speed
-    uniform_ex = numpy.all(p_ex_roi == p_ex_roi[0, 0])
-    uniform_sted = numpy.all(p_sted_roi == p_sted_roi[0, 0])
-    uniform_pdt = numpy.all(pdt_roi == pdt_roi[0, 0])
-    if uniform_sted and uniform_ex and uniform_pdt:
-        p_ex = p_ex_roi[0, 0]
-        p_sted = p_sted_roi[0, 0]
-        pdt = pdt_roi[0, 0]
-        photons_ex = self.fluo.get_photons(i_ex * p_ex, self.excitation.lambda_)
-        duty_cycle = self.sted.tau * self.sted.rate
-        photons_sted = self.fluo.get_photons(i_sted * p_sted * duty_cycle, self.sted.lambda_)
-        k_sted = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, pdt,)
-        k_ex = k_sted * 0.
-    else:
-        k_sted = None
-        k_ex = None
-
-    pre_effective = self.get_effective(datamap.pixelsize, p_ex_roi[0, 0], p_sted_roi[0, 0])
-    h, w = pre_effective.shape[0], pre_effective.shape[1]
-
-    prob_ex = numpy.ones_like(pre_effective, dtype=numpy.float64)
-    prob_sted = numpy.ones_like(pre_effective, dtype=numpy.float64)
-
-    # Extracts DyMIN parameters
-    SCALE_POWER = self.opts["scale_power"]
-    DECISION_TIME = self.opts["decision_time"]
-    THRESHOLD_COUNT = self.opts["threshold_count"]
-    num_steps = len(self.opts["scale_power"])
-
-    is_uniform = uniform_sted and uniform_ex and uniform_pdt
-    if is_uniform:
-        # Pre-calculates necessary variables
-        effectives = numpy.zeros((num_steps, h, w), dtype=numpy.float64)
-        k_steds = numpy.zeros((num_steps, h, w), dtype=numpy.float64)
-        k_exs = numpy.zeros((num_steps, h, w), dtype=numpy.float64)
-        for i in range(num_steps):
-            effective = self.get_effective(datamap.pixelsize, p_ex, SCALE_POWER[i] * p_sted)
-            effectives[i] = effective
-
-            decision_time = DECISION_TIME[i]
-            if decision_time < 0.:
-                decision_time = pdt_roi[0, 0]
-
-            # Must be recalculated
-            photons_ex = self.fluo.get_photons(i_ex * p_ex, self.excitation.lambda_)
-            photons_sted = self.fluo.get_photons(i_sted * SCALE_POWER[i] * p_sted * duty_cycle, self.sted.lambda_)
-
-            k_steds[i] = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, decision_time, )
-            k_exs[i] = k_steds[i] * 0.
-
-    pdts, p_exs, p_steds = numpy.zeros(num_steps, dtype=numpy.float64), numpy.zeros(num_steps, dtype=numpy.float64), numpy.zeros(num_steps, dtype=numpy.float64)
+    cdef tuple stacked
+    cdef FLOATDTYPE_t[:, :, ::1] effectives, banks_prob_ex, banks_prob_sted
+    cdef numpy.intp_t[:, :, ::1] indices
+    cdef COUNTDTYPE_t[:, :, :, ::1] batch = sub_datamaps
+    cdef FLOATDTYPE_t[:, :, :] intensity = acquired_intensity
+    cdef INT64DTYPE_t[:, :, ::1] footprints
+    cdef INTDTYPE_t[:, :, ::1] masks
+    cdef FLOATDTYPE_t[:, :, ::1] survivals_ex, survivals_sted, buffers_effective, buffers_prob_sted
+    cdef numpy.intp_t[:, :, ::1] occupancy
+    cdef INTDTYPE_t[:, ::1] pixels = pixel_list
+    cdef numpy.intp_t[::1] streams = numpy.arange(max_len, dtype=numpy.intp)
+    cdef uint64_t[::1] batch_keys = keys
+    cdef numpy.intp_t[::1] emitter_row_ptr, emitter_row_len
+    cdef INTDTYPE_t[::1] emitter_cols
+    cdef list emitter_arrays = []
+    cdef EmitterIndex *emitter_indexes
+    cdef EmitterIndex *emitters
+
+    stacked = stack_banks([bank], (bank.shape[0], bank.shape[1]))
+    if stacked is None:
+        raise ValueError("The bank of a batch must store its arrays")
+    effectives, banks_prob_ex, banks_prob_sted, indices, row_offset, col_offset = stacked
+    indices = numpy.ascontiguousarray(numpy.reshape(indices, (num_datamaps, -1, bank.shape[1])))
+    h, w = effectives.shape[1], effectives.shape[2]
+
+    # Summed-area tables of the occupied positions of every datamap (see raster_func_c_self_bleach_split_g)
+    occupancy = numpy.zeros((num_datamaps, batch.shape[2] + 1, batch.shape[3] + 1), dtype=numpy.intp)
+    refresh = max(1, (batch.shape[2] * batch.shape[3]) // (h * w))
+
+    # Buffers of every thread
+    threads = 1 if num_threads is None else max(1, num_threads)
+    footprints = numpy.zeros((threads, h, w), dtype=numpy.int64)
+    masks = numpy.zeros((threads, h * w, 2), dtype=numpy.int32)
+    survivals_ex = numpy.ones((threads, h, w), dtype=numpy.float64)
+    survivals_sted = numpy.ones((threads, h, w), dtype=numpy.float64)
+    buffers_effective = numpy.zeros((threads, h, w), dtype=numpy.float64)
+    buffers_prob_sted = numpy.ones((threads, h, w), dtype=numpy.float64)
+
+    emitter_indexes = <EmitterIndex*>malloc(num_datamaps * sizeof(EmitterIndex))
+    if emitter_indexes == NULL:
+        raise MemoryError()
+    try:
+        for i in range(num_datamaps):
+            integrate_occupancy(batch[i], occupancy[i])
+
+            # The sparse index of a datamap is only used by the thread acquiring it, the bleached emitters are
+            # always removed
+            emitter_indexes[i].cols = NULL
+            emitter_row_ptr, emitter_row_len, emitter_cols = index_emitters(sub_datamaps[i])
+            if use_emitter_index(sparse, emitter_cols.shape[0], batch.shape[2] * batch.shape[3]):
+                emitter_arrays.append((emitter_row_ptr, emitter_row_len, emitter_cols))
+                emitter_indexes[i].row_ptr = &emitter_row_ptr[0]
+                emitter_indexes[i].row_len = &emitter_row_len[0]
+                emitter_indexes[i].cols = &emitter_cols[0]
+                emitter_indexes[i].prune = bleach
+
+        if num_threads is None:
+            with nogil:
+                for i in range(num_datamaps):
+                    emitters = &emitter_indexes[i] if emitter_indexes[i].cols != NULL else NULL
+                    raster_tile(pixels, 0, max_len, ratio, row_offset, col_offset, bleach, intensity[i], batch[i],
+                                emitters, occupancy[i], refresh, effectives, banks_prob_ex[0], banks_prob_sted,
+                                indices[i], NULL, footprints[0], masks[0], survivals_ex[0], survivals_sted[0],
+                                buffers_effective[0], buffers_prob_sted[0], c_default_update_survival_probabilities,
+                                c_sample_molecules, streams, batch_keys[i])
+        else:
+            for i in prange(num_datamaps, nogil=True, num_threads=threads, schedule="dynamic"):
+                tid = threadid()
+                emitters = &emitter_indexes[i] if emitter_indexes[i].cols != NULL else NULL
+                raster_tile(pixels, 0, max_len, ratio, row_offset, col_offset, bleach, intensity[i], batch[i],
+                            emitters, occupancy[i], refresh, effectives, banks_prob_ex[0], banks_prob_sted,
+                            indices[i], NULL, footprints[tid], masks[tid], survivals_ex[tid], survivals_sted[tid],
+                            buffers_effective[tid], buffers_prob_sted[tid], c_default_update_survival_probabilities,
+                            c_sample_molecules, streams, batch_keys[i])
+    finally:
+        free(emitter_indexes)
 
-    for (row, col) in pixel_list:
-        pdts = pdts * 0.
-        p_exs = p_exs * 0.
-        p_steds = p_steds * 0.
-        mask = []
-
-        # Uses the bleached datamap
-        bleached_datamap = numpy.zeros(bleached_sub_datamaps_dict["base"].shape, dtype=numpy.int64)
-        for key in bleached_sub_datamaps_dict:
-            current_datamap = bleached_sub_datamaps_dict[key]
-            for s in range(row, row + h):
-                for t in range(col, col + w):
-                    bleached_datamap[s, t] += current_datamap[s, t]
-
-        # Creates the masked values
-        sprime = 0
-        for s in range(row, row + h):
-            tprime = 0
-            for t in range(col, col + w):
-                if bleached_datamap[s, t] > 0:
-                    mask.append((sprime, tprime))
-                tprime += 1
-            sprime += 1
-
-        # DyMIN implementation for every step
-        for i in range(num_steps):
-
-            scale_power = SCALE_POWER[i]
-            decision_time = DECISION_TIME[i]
-            threshold_count = THRESHOLD_COUNT[i]
-
-            if decision_time < 0.:
-                decision_time = pdt_roi[row, col]
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+@cython.cdivision(True)
+def raster_func_mean_field(
+        numpy.ndarray[FLOATDTYPE_t, ndim=2] acquired_intensity,
+        numpy.ndarray[INTDTYPE_t, ndim=2] pixel_list,
+        int ratio,
+        bint bleach,
+        numpy.ndarray[FLOATDTYPE_t, ndim=3] sub_datamaps,
+        object bank,
+        tuple roi_shape
+):
+    '''
+    Deterministic (mean-field) raster and photobleaching implementation of the acquisition with the default
+    photobleaching functions.
 
-            if not is_uniform:
-                effective = self.get_effective(datamap.pixelsize, p_ex_roi[row, col], scale_power * p_sted_roi[row, col])
-            else:
-                effective = effectives[i]
+    The sub datamaps hold the expected number of molecules of every position. The pixels are acquired in the order of
+    the pixel list as by :func:`raster_func_c_self_bleach_split_g`, but the molecules under the laser are multiplied by
+    their survival probability ``exp(-k * pdt)`` instead of being sampled. Since the intensity is linear in the number
+    of molecules and the expected number of surviving molecules is the survival probability times the expected number
+    of molecules, the acquired intensity and the sub datamaps are the expectations of the ones of the stochastic
+    acquisition.
 
-            # pixel_intensity = numpy.sum(effective * bleached_datamap[row_slice, col_slice])
+    :param acquired_intensity: 2D array to store the expected acquired intensity
+    :param pixel_list: 2D array with the position of the pixels to be acquired
+    :param ratio: The ratio of the pixel size to the datamap pixel size
+    :param bleach: Boolean to indicate if the sample should be bleached
+    :param sub_datamaps: 3D array of the expected molecules of the sub datamaps stacked along the first axis, bleached in
+                         place
+    :param bank: A stored :class:`~pysted.bank.ParameterBank` of the imaging parameters
+    :param roi_shape: The shape of the ROI
+    '''
+    cdef int n, k, s, t, row, col, index, h, w, row_offset, col_offset
+    cdef int max_len = len(pixel_list)
+    cdef int num_layers = sub_datamaps.shape[0]
+    cdef double value, total, survival
+    cdef tuple stacked
+    cdef FLOATDTYPE_t[:, :, ::1] effectives, banks_prob_ex, banks_prob_sted
+    cdef numpy.intp_t[:, :, ::1] indices
+    cdef FLOATDTYPE_t[:, :, ::1] expected = sub_datamaps
+    cdef FLOATDTYPE_t[:, :] intensity = acquired_intensity
+    cdef INTDTYPE_t[:, ::1] pixels = pixel_list
+    cdef numpy.intp_t[:, ::1] occupancy
+
+    stacked = stack_banks([bank], roi_shape)
+    if stacked is None:
+        raise ValueError("The bank of a mean-field acquisition must store its arrays")
+    effectives, banks_prob_ex, banks_prob_sted, indices, row_offset, col_offset = stacked
+    h, w = effectives.shape[1], effectives.shape[2]
+
+    # The expected molecules never reach zero once bleached, such that the summed-area table of the occupied positions
+    # is computed once
+    occupancy = numpy.zeros((sub_datamaps.shape[1] + 1, sub_datamaps.shape[2] + 1), dtype=numpy.intp)
+    numpy.cumsum(numpy.cumsum(numpy.any(sub_datamaps != 0, axis=0), axis=0), axis=1, out=numpy.asarray(occupancy)[1:, 1:])
+
+    with nogil:
+        for n in range(max_len):
+            index = indices[0, pixels[n, 0], pixels[n, 1]]
+            row, col = pixels[n, 0] + row_offset, pixels[n, 1] + col_offset
+            if count_occupied(occupancy, row, col, h, w) == 0:
+                continue
+
+            # Every position is read before it is bleached as in the stochastic acquisition
             value = 0.0
-            for (sprime, tprime) in mask:
-                s = sprime + row
-                t = tprime + col
-                value += effective[sprime, tprime] * bleached_datamap[s, t]
-
-            pixel_photons = self.detector.get_signal(self.fluo.get_photons(value), decision_time, self.sted.rate)
-
-            # Stores the action taken for futures bleaching
-            pdts[i] = decision_time
-            p_exs[i] = p_ex_roi[row, col]
-            p_steds[i] = scale_power * p_sted_roi[row, col]
-
-            # If signal is less than threshold count then skip pixel
-            scaled_power[row, col] = scale_power
-            if pixel_photons < threshold_count:
-                break
+            for s in range(h):
+                for t in range(w):
+                    total = 0.0
+                    for k in range(num_layers):
+                        total = total + expected[k, row + s, col + t]
+                    if total == 0:
+                        continue
+                    value = value + effectives[index, s, t] * total
+                    if bleach:
+                        survival = banks_prob_ex[0, s, t] * banks_prob_sted[index, s, t]
+                        for k in range(num_layers):
+                            expected[k, row + s, col + t] = expected[k, row + s, col + t] * survival
+            intensity[pixels[n, 0] // ratio, pixels[n, 1] // ratio] += value
+
+# Actions of the adaptive acquisition policies
+cpdef enum:
+    ACTION_CONTINUE = 0
+    ACTION_STOP = 1
+    ACTION_ACCEPT = 2
+    ACTION_EXTRAPOLATE = 3
+
+cdef struct Policy:
+    int num_steps
+    double *decision_time
+    double *lower_threshold
+    double *upper_threshold
+    double *lower_label
+    double *upper_label
+    double *label
+    INTDTYPE_t *lower_action
+    INTDTYPE_t *upper_action
+    INTDTYPE_t *accumulate
+    INTDTYPE_t *truncate
+
+cdef bint apply_policy(Policy *policy, int i, double photons, double pdt, double decision_time,
+                       double *pixel_photons, double *label) noexcept nogil:
+    '''Takes the action of a step of an adaptive acquisition policy
+
+    :param policy: The policy of the acquisition
+    :param i: The index of the step
+    :param photons: The photons detected during the step
+    :param pdt: The pixel dwell time
+    :param decision_time: The time spent to detect the photons of the step
+    :param pixel_photons: The photons of the pixel, updated by the action
+    :param label: The label of the pixel, updated by the action
+
+    :returns: Whether the acquisition of the pixel stops
+    '''
+    cdef int action
+
+    if photons < policy.lower_threshold[i]:
+        label[0] = policy.lower_label[i]
+        action = policy.lower_action[i]
+    elif (policy.upper_threshold[i] > 0) and (photons > policy.upper_threshold[i]):
+        label[0] = policy.upper_label[i]
+        action = policy.upper_action[i]
+    else:
+        label[0] = policy.label[i]
+        action = ACTION_CONTINUE
+
+    if action == ACTION_CONTINUE:
+        if policy.accumulate[i]:
+            pixel_photons[0] += photons
+        return False
+    elif action == ACTION_ACCEPT:
+        pixel_photons[0] += photons
+    elif action == ACTION_EXTRAPOLATE:
+        if policy.truncate[i]:
+            pixel_photons[0] += <long>(photons * pdt / decision_time)
+        else:
+            pixel_photons[0] += photons * pdt / decision_time
+    return True
 
-            # Update the photon counts only on the last pixel power scale
-            if i == num_steps - 1:
-                returned_photons[row, col] += pixel_photons
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef object raster_stack_adaptive(
+        COUNTDTYPE_t[:, :, ::1] sub_datamaps,
+        INTDTYPE_t[:, ::1] pixel_list,
+        FLOATDTYPE_t[:, :] returned_photons,
+        FLOATDTYPE_t[:, :] labels,
+        FLOATDTYPE_t[:, :] pdt_roi,
+        bint bleach,
+        tuple stacked,
+        object sparse,
+        Policy *c_policy,
+        Detection *detection,
+        survival_func_t c_survival_func,
+        sample_func_t c_sample_func,
+        uint64_t seed
+):
+    '''Scan without the GIL of :func:`raster_func_adaptive` on the stacked sub datamaps
 
-        # Bleaches the sample after pixel is scanned
-        if bleach:
-            for i in range(num_steps):
-                if pdts[i] > 0:
-                    if is_uniform:
-                        k_sted, k_ex = k_steds[i], k_exs[i]
-                    bleach_func(self, i_ex, i_sted, p_exs[i], p_steds[i],
-                                pdts[i], bleached_sub_datamaps_dict,
-                                row, col, h, w, mask, prob_ex, prob_sted, k_ex, k_sted)
-            sample_func(self, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex, prob_sted)
+    The function is specialized for every type of the molecule counts such that the sub datamaps are bleached in place
+    in their compact type.
 
-            # We reset the survival probabilty
-            reset_prob(mask, prob_ex, prob_sted)
+    :param sub_datamaps: 3D array of the sub datamaps stacked along the first axis, bleached in place
+    :param pixel_list: 2D array with the position of the pixels to be acquired
+    :param returned_photons: 2D array to store the detected photons
+    :param labels: 2D array to store the label of every pixel
+    :param pdt_roi: 2D array with the pixel dwell time
+    :param bleach: Boolean to indicate if the sample should be bleached
+    :param stacked: The arrays of the banks of the steps returned by ``stack_banks``
+    :param sparse: Whether the emitters are found from the sparse index of the occupied positions (see
+                   :class:`~pysted.base.Datamap`)
+    :param c_policy: The policy of the acquisition
+    :param detection: The parameters of the detection
+    :param c_survival_func: The C function updating the survival probabilities
+    :param c_sample_func: The C function sampling the molecules (see ``raster_tile``)
+    :param seed: The key of the random generator
+    '''
+    cdef int row, col, i, h, w, n, m, index, num_mask, num_executed, top, left, row_offset, col_offset
+    cdef int sprime, tprime
+    cdef int max_len = pixel_list.shape[0]
+    cdef FLOATDTYPE_t value
+    cdef FLOATDTYPE_t decision_time
+    cdef double pixel_photons, label
+    cdef FLOATDTYPE_t[:, :, ::1] effectives, banks_prob_ex, banks_prob_sted
+    cdef numpy.intp_t[:, :, ::1] indices
+    cdef INT64DTYPE_t[:, ::1] footprint_buffer
+    cdef INTDTYPE_t[:, ::1] mask_buffer
+    cdef FLOATDTYPE_t[:, ::1] survival_ex, survival_sted
+    cdef RNG rng
+    cdef numpy.intp_t[::1] emitter_row_ptr, emitter_row_len
+    cdef INTDTYPE_t[::1] emitter_cols
+    cdef EmitterIndex emitter_index
+    cdef EmitterIndex *emitters = NULL
+    cdef numpy.intp_t[:, ::1] occupancy
+    cdef int refresh, bleached, last_refresh
+
+    effectives, banks_prob_ex, banks_prob_sted, indices, row_offset, col_offset = stacked
+
+
+    # The footprint is the compact window of the banks
+    h, w = effectives.shape[1], effectives.shape[2]
+    emitter_row_ptr, emitter_row_len, emitter_cols = index_emitters(sub_datamaps)
+    if use_emitter_index(sparse, emitter_cols.shape[0], sub_datamaps.shape[1] * sub_datamaps.shape[2]):
+        emitter_index.row_ptr = &emitter_row_ptr[0]
+        emitter_index.row_len = &emitter_row_len[0]
+        emitter_index.cols = &emitter_cols[0]
+        emitter_index.prune = bleach
+        emitters = &emitter_index
+    occupancy = numpy.zeros((sub_datamaps.shape[1] + 1, sub_datamaps.shape[2] + 1), dtype=numpy.intp)
+    integrate_occupancy(sub_datamaps, occupancy)
+    refresh = max(1, (sub_datamaps.shape[1] * sub_datamaps.shape[2]) // (h * w))
+    bleached, last_refresh = 0, 0
+    footprint_buffer = numpy.zeros((h, w), dtype=numpy.int64)
+    mask_buffer = numpy.zeros((h * w, 2), dtype=numpy.int32)
+    survival_ex = numpy.ones((h, w), dtype=numpy.float64)
+    survival_sted = numpy.ones((h, w), dtype=numpy.float64)
+    with nogil:
+        for n in range(max_len):
+            row, col = pixel_list[n, 0], pixel_list[n, 1]
+            top, left = row + row_offset, col + col_offset
+            seed_stream(&rng, seed, n)
+
+            # Combines the sub datamaps over the laser footprint and keeps track
+            # of the position of the emitters. The background is still detected without emitters
+            if count_occupied(occupancy, top, left, h, w) == 0:
+                num_mask = 0
+            else:
+                num_mask = gather_emitters(sub_datamaps, emitters, footprint_buffer, mask_buffer, top, left)
+
+            # Steps of the policy
+            pixel_photons, label = 0., labels[row, col]
+            num_executed = 0
+            while num_executed < c_policy.num_steps:
+                i = num_executed
+                index = indices[i, row, col]
+                num_executed += 1
+
+                decision_time = c_policy.decision_time[i]
+                if decision_time < 0.:
+                    decision_time = pdt_roi[row, col]
+
+                value = 0.0
+                for m in range(num_mask):
+                    sprime, tprime = mask_buffer[m, 0], mask_buffer[m, 1]
+                    value += effectives[index, sprime, tprime] * footprint_buffer[sprime, tprime]
+                if apply_policy(c_policy, i, <int>detect_photons(detection, &rng, value, decision_time),
+                                pdt_roi[row, col], decision_time, &pixel_photons, &label):
+                    break
+            returned_photons[row, col] += pixel_photons
+            labels[row, col] = label
+
+            # Bleaches the sample by every executed step once the pixel was acquired
+            if bleach:
+                for i in range(num_executed):
+                    c_survival_func(survival_ex, survival_sted, banks_prob_ex[i],
+                                    banks_prob_sted[indices[i, row, col]], mask_buffer, num_mask)
+                if COUNTDTYPE_t is numpy.int64_t:
+                    c_sample_func(sub_datamaps, top, left, mask_buffer, num_mask, survival_ex, survival_sted, &rng)
+                else:
+                    sample_counts(sub_datamaps, top, left, mask_buffer, num_mask, survival_ex, survival_sted, &rng)
+                reset_survival(survival_ex, survival_sted, mask_buffer, num_mask)
+
+                bleached += count_bleached(sub_datamaps, mask_buffer, num_mask, top, left)
+                if (bleached > 0) and (n - last_refresh >= refresh):
+                    integrate_occupancy(sub_datamaps, occupancy)
+                    bleached, last_refresh = 0, n
 
 @cython.boundscheck(False)  # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
-def raster_func_rescue(
+def raster_func_adaptive(
         object self,
         object datamap,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] acquired_intensity,
         numpy.ndarray[INTDTYPE_t, ndim=2] pixel_list,
-        int ratio,
-        int rows_pad,
-        int cols_pad,
-        int laser_pad,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_sted,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] returned_photons,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] thresholds,
+        numpy.ndarray[FLOATDTYPE_t, ndim=2] labels,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] pdt_roi,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] p_ex_roi,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] p_sted_roi,
-        bint bleach,   
-        dict bleached_sub_datamaps_dict,
-        int seed,
+        dict policy,
+        list banks,
+        bint bleach,
+        object bleached_sub_datamaps_dict,
+        uint64_t seed,
         object bleach_func,
-        object sample_func,
-        list steps
+        object sample_func
 ):
-    """
-    Implements the raster scanning and photobleaching of RESCue microscopy
+    '''
+    Raster and photobleaching implementation of an adaptive-illumination STED microscope acquisition.
+
+    Every pixel is acquired in successive steps described by a policy table. At each step, the photons detected
+    during the decision time of the step are compared to the thresholds of the step to decide the action to take:
+
+    * ``photons < lower_threshold`` takes the ``lower_action`` and sets the ``lower_label``;
+    * ``upper_threshold > 0`` and ``photons > upper_threshold`` takes the ``upper_action`` and sets the ``upper_label``;
+    * otherwise the photons are added to the pixel if ``accumulate`` is set, the ``label`` is set and the acquisition
+      continues with the next step.
+
+    The actions are ``ACTION_CONTINUE`` (continue with the next step, adding the photons if ``accumulate`` is set),
+    ``ACTION_STOP`` (stop and discard the photons of the step), ``ACTION_ACCEPT`` (stop and add the photons of the step)
+    and ``ACTION_EXTRAPOLATE`` (stop and add the photons of the step extrapolated to the pixel dwell time, truncated to
+    an integer if ``truncate`` is set).
+
+    The sample is then bleached by every executed step.
+
+    As :func:`raster_func_c_self_bleach_split_g`, the scan is done without the GIL when the banks store their arrays
+    and the bleaching and sampling functions have a C implementation, the emitters are found from the sparse index of
+    the datamap, the footprint of the laser is the smallest window containing the compact window of every bank, and the
+    random variates of a pixel are drawn from a counter-based generator keyed by ``seed`` and the index of the pixel in
+    the pixel list.
 
     :param datamap: The datamap on which the acquisition is done, either a Datamap object or TemporalDatamap
-    :param acquired_intensity: 2D array to store the acquired intensity
     :param pixel_list: 2D array with the position of the pixels to be acquired
-    :param ratio: The ratio of the pixel size to the datamap pixel size
-    :param rows_pad: The number of rows to pad the datamap
-    :param cols_pad: The number of columns to pad the datamap
-    :param laser_pad: The number of pixels to pad the laser
-    :param prob_ex: 2D array with the probability of survival of the fluorophores under excitation
-    :param prob_sted: 2D array with the probability of survival of the fluorophores under sted
+    :param returned_photons: 2D array to store the detected photons
+    :param labels: 2D array to store the label of the last executed step
     :param pdt_roi: 2D array with the pixel dwell time
     :param p_ex_roi: 2D array with the excitation power
     :param p_sted_roi: 2D array with the sted power
+    :param policy: A dict of 1D arrays describing every step with keys ``decision_time`` (negative for the pixel
+                   dwell time), ``scale_power``, ``lower_threshold``, ``lower_action``, ``lower_label``,
+                   ``upper_threshold``, ``upper_action``, ``upper_label``, ``accumulate`` and ``label``
+    :param banks: A list of the :class:`~pysted.bank.ParameterBank` of every step
     :param bleach: Boolean to indicate if the sample should be bleached
     :param bleached_sub_datamaps_dict: Dictionary with the different parts of the datamap to be bleached
-    :param seed: Seed for the random number generator
+    :param seed: The key of the random generator (see :func:`~pysted.utils.rng_key`)
     :param bleach_func: Function to bleach the sample
     :param sample_func: Function to sample the sample
-    :param steps: List with the different steps of the acquisition    
-    """
-    cdef int row, col, i
+    '''
+    cdef int row, col, i, s, t
     cdef int sprime, tprime
     cdef int h, w
-    cdef int current
+    cdef int n
     cdef int max_len = len(pixel_list)
     cdef FLOATDTYPE_t value
-    cdef int sampled_value
-    cdef int prob
-    cdef int rsamp
-    cdef FLOATDTYPE_t pdt, p_ex, p_sted, _pdt, _p_ex, _p_sted
-    cdef float scale_power, decision_time, threshold_count
-    cdef int pixel_photons
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] pre_effective, effective
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=3] effectives, k_exs, k_steds
+    cdef FLOATDTYPE_t decision_time
+    cdef double pixel_photons, label
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] effective
     cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] k_ex, k_sted
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] step_prob_ex, step_prob_sted
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex, prob_sted
     cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] i_ex, i_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] photons_ex, photons_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] pdts, p_exs, p_steds
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] LOWER_THRESHOLD, UPPER_THRESHOLD, DECISION_TIME
-    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] bleached_datamap, current_datamap
-    cdef FLOATDTYPE_t duty_cycle
-    cdef FLOATDTYPE_t step
-    cdef list mask
-    cdef int num_steps
-    cdef bint uniform_sted, uniform_ex, uniform_pdt, is_uniform
-
-    if seed == 0:
-        # if no seed is passed, calculates a 'pseudo-random' seed form the time in ns
-        srand(int(str(time.time_ns())[15:]))
-    else:
-        srand(seed)
+    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] footprint
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] DECISION_TIME, SCALE_POWER
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] LOWER_THRESHOLD, UPPER_THRESHOLD
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] LOWER_LABEL, UPPER_LABEL, LABEL
+    cdef numpy.ndarray[INTDTYPE_t, ndim=1] LOWER_ACTION, UPPER_ACTION, ACCUMULATE, TRUNCATE
+    cdef list mask, steps
+    cdef bint is_default_bleach
+    cdef Detection detection = get_detection(self)
+    cdef Policy c_policy
+    cdef tuple stacked
+    cdef survival_func_t c_survival_func
+    cdef sample_func_t c_sample_func
+    cdef RNG rng
 
     i_ex, i_sted, _ = self.cache(datamap.pixelsize)
-    # Calculate the bleaching rate once if the scanning powers and dwelltimes do not vary to
-    # increase speed
-    uniform_ex = numpy.all(p_ex_roi == p_ex_roi[0, 0])
-    uniform_sted = numpy.all(p_sted_roi == p_sted_roi[0, 0])
-    uniform_pdt = numpy.all(pdt_roi == pdt_roi[0, 0])
-    if uniform_sted and uniform_ex and uniform_pdt:
-        p_ex = p_ex_roi[0, 0]
-        p_sted = p_sted_roi[0, 0]
-        pdt = pdt_roi[0, 0]
-        photons_ex = self.fluo.get_photons(i_ex * p_ex, self.excitation.lambda_)
-        duty_cycle = self.sted.tau * self.sted.rate
-        photons_sted = self.fluo.get_photons(i_sted * p_sted * duty_cycle, self.sted.lambda_)
-        k_sted = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, pdt,)
-        k_ex = k_sted * 0.
-    else:
-        k_sted = None
-        k_ex = None
-
-    pre_effective = self.get_effective(datamap.pixelsize, p_ex_roi[0, 0], p_sted_roi[0, 0])
-    h, w = pre_effective.shape[0], pre_effective.shape[1]
-
-    prob_ex = numpy.ones_like(pre_effective, dtype=numpy.float64)
-    prob_sted = numpy.ones_like(pre_effective, dtype=numpy.float64)
-
-    # Extracts RESCue parameters
-    LOWER_THRESHOLD = self.opts["lower_threshold"]
-    UPPER_THRESHOLD = self.opts["upper_threshold"]
-    DECISION_TIME = self.opts["decision_time"]
-    num_steps = len(self.opts["decision_time"])
-
-    is_uniform = uniform_sted and uniform_ex and uniform_pdt
-    if is_uniform:
-        # Pre-calculates necessary variables
-        effectives = numpy.zeros((num_steps, h, w), dtype=numpy.float64)
-        k_steds = numpy.zeros((num_steps, k_sted.shape[0], k_sted.shape[1]), dtype=numpy.float64)
-        k_exs = numpy.zeros((num_steps, k_ex.shape[0], k_ex.shape[1]), dtype=numpy.float64)
-
-        for i in range(num_steps):
-            effective = self.get_effective(datamap.pixelsize, p_ex, p_sted)
-            effectives[i] = effective
+    is_default_bleach = bleach_func is bleach_funcs.default_update_survival_probabilities
+
+    # Extracts the policy
+    DECISION_TIME = numpy.ascontiguousarray(policy["decision_time"], dtype=numpy.float64)
+    SCALE_POWER = numpy.ascontiguousarray(policy["scale_power"], dtype=numpy.float64)
+    LOWER_THRESHOLD = numpy.ascontiguousarray(policy["lower_threshold"], dtype=numpy.float64)
+    UPPER_THRESHOLD = numpy.ascontiguousarray(policy["upper_threshold"], dtype=numpy.float64)
+    LOWER_ACTION = numpy.ascontiguousarray(policy["lower_action"], dtype=numpy.int32)
+    UPPER_ACTION = numpy.ascontiguousarray(policy["upper_action"], dtype=numpy.int32)
+    ACCUMULATE = numpy.ascontiguousarray(policy["accumulate"], dtype=numpy.int32)
+    TRUNCATE = numpy.ascontiguousarray(policy["truncate"], dtype=numpy.int32)
+    LOWER_LABEL = numpy.ascontiguousarray(policy["lower_label"], dtype=numpy.float64)
+    UPPER_LABEL = numpy.ascontiguousarray(policy["upper_label"], dtype=numpy.float64)
+    LABEL = numpy.ascontiguousarray(policy["label"], dtype=numpy.float64)
+
+    c_policy.num_steps = len(DECISION_TIME)
+    c_policy.decision_time = &DECISION_TIME[0]
+    c_policy.lower_threshold = &LOWER_THRESHOLD[0]
+    c_policy.upper_threshold = &UPPER_THRESHOLD[0]
+    c_policy.lower_label = &LOWER_LABEL[0]
+    c_policy.upper_label = &UPPER_LABEL[0]
+    c_policy.label = &LABEL[0]
+    c_policy.lower_action = &LOWER_ACTION[0]
+    c_policy.upper_action = &UPPER_ACTION[0]
+    c_policy.accumulate = &ACCUMULATE[0]
+    c_policy.truncate = &TRUNCATE[0]
+
+    effective = banks[0].get(0, 0)[0]
+    h, w = effective.shape[0], effective.shape[1]
 
-            decision_time = DECISION_TIME[i]
-            if decision_time < 0.:
-                decision_time = pdt_roi[0, 0]
-            k_steds[i] = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, decision_time, )
-            k_exs[i] = k_steds[i] * 0.
-
-    pdts, p_exs, p_steds = numpy.zeros(num_steps, dtype=numpy.float64), numpy.zeros(num_steps, dtype=numpy.float64), numpy.zeros(num_steps, dtype=numpy.float64)
-    for (row, col) in pixel_list:
-        pdts = pdts * 0.
-        p_exs = p_exs * 0.
-        p_steds = p_steds * 0.
+    prob_ex = numpy.ones((h, w), dtype=numpy.float64)
+    prob_sted = numpy.ones((h, w), dtype=numpy.float64)
+
+    # Reusable buffer holding the sum of the sub datamaps under the laser
+    footprint = numpy.zeros((h, w), dtype=numpy.int64)
+
+    c_survival_func = get_c_survival_func(bleach_func)
+    c_sample_func = get_c_sample_func(sample_func)
+    stacked = stack_banks(banks, (pdt_roi.shape[0], pdt_roi.shape[1]))
+    if (stacked is not None) and ((not bleach) or ((c_survival_func != NULL) and (c_sample_func != NULL))):
+        sub_datamaps = stack_sub_datamaps(bleached_sub_datamaps_dict)
+        if sub_datamaps.dtype == numpy.uint8:
+            raster_stack_adaptive[numpy.uint8_t](
+                sub_datamaps, pixel_list, returned_photons, labels, pdt_roi, bleach, stacked,
+                getattr(datamap, "sparse", None), &c_policy, &detection, c_survival_func, c_sample_func, seed)
+        elif sub_datamaps.dtype == numpy.uint16:
+            raster_stack_adaptive[numpy.uint16_t](
+                sub_datamaps, pixel_list, returned_photons, labels, pdt_roi, bleach, stacked,
+                getattr(datamap, "sparse", None), &c_policy, &detection, c_survival_func, c_sample_func, seed)
+        elif sub_datamaps.dtype == numpy.int32:
+            raster_stack_adaptive[numpy.int32_t](
+                sub_datamaps, pixel_list, returned_photons, labels, pdt_roi, bleach, stacked,
+                getattr(datamap, "sparse", None), &c_policy, &detection, c_survival_func, c_sample_func, seed)
+        else:
+            raster_stack_adaptive[numpy.int64_t](
+                sub_datamaps, pixel_list, returned_photons, labels, pdt_roi, bleach, stacked,
+                getattr(datamap, "sparse", None), &c_policy, &detection, c_survival_func, c_sample_func, seed)
+        if bleach:
+            unstack_sub_datamaps(bleached_sub_datamaps_dict, sub_datamaps)
+        return
+    warn_untrimmed(banks, (i_ex.shape[0], i_ex.shape[1]))
+
+    # The Python-callable functions read the sub datamaps as int64, which are not modified without bleaching
+    if hasattr(bleached_sub_datamaps_dict, "promote"):
+        bleached_sub_datamaps_dict.promote(numpy.int64)
+        if not bleach:
+            bleached_sub_datamaps_dict.stack.flags.writeable = False
+
+    for n in range(max_len):
+        row, col = pixel_list[n, 0], pixel_list[n, 1]
+        seed_stream(&rng, seed, n)
         mask = []
 
-        # Uses the bleached datamap
-        bleached_datamap = numpy.zeros(bleached_sub_datamaps_dict["base"].shape, dtype=numpy.int64)
-        for key in bleached_sub_datamaps_dict:
-            current_datamap = bleached_sub_datamaps_dict[key]
-            for s in range(row, row + h):
-                for t in range(col, col + w):
-                    bleached_datamap[s, t] += current_datamap[s, t]
+        # Combines the sub datamaps over the laser footprint only
+        combine_footprint(bleached_sub_datamaps_dict, footprint, row, col)
 
         # Creates the masked values
-        sprime = 0
-        for s in range(row, row + h):
-            tprime = 0
-            for t in range(col, col + w):
-                if bleached_datamap[s, t] > 0:
+        for sprime in range(h):
+            for tprime in range(w):
+                if footprint[sprime, tprime] > 0:
                     mask.append((sprime, tprime))
-                tprime += 1
-            sprime += 1
 
-        # RESCue steps
-        for i in range(num_steps):
+        # Steps of the policy, the parameters of the executed steps are kept for bleaching
+        steps = []
+        pixel_photons, label = 0., labels[row, col]
+        for i in range(c_policy.num_steps):
+            step = banks[i].get(row, col)
+            effective = step[0]
 
-            # Extract parameters
-            lower_threshold = LOWER_THRESHOLD[i]
-            upper_threshold = UPPER_THRESHOLD[i]
             decision_time = DECISION_TIME[i]
-
             if decision_time < 0.:
                 decision_time = pdt_roi[row, col]
 
-            # If non uniform laser powers we recalculate
-            if not is_uniform:
-                effective = self.get_effective(datamap.pixelsize, p_ex_roi[row, col], p_sted_roi[row, col])
-            else:
-                effective = effectives[i]
-
-            # Convolve the effective and the datamap
             value = 0.0
             for (sprime, tprime) in mask:
-                s = sprime + row
-                t = tprime + col
-                value += effective[sprime, tprime] * bleached_datamap[s, t]
-
-            pixel_photons = self.detector.get_signal(self.fluo.get_photons(value), decision_time, self.sted.rate)
-
-            # Stores the action taken for futures bleaching
-            pdts[i] = decision_time
-            p_exs[i] = p_ex_roi[row, col]
-            p_steds[i] = scale_power * p_sted_roi[row, col]
-
-            # STEPS
-            # if number of photons is less than lower_threshold
-            # we skip
-            # if number of photons is higher than upper_threshold
-            # we stop acquisition and assign number of count as total_time/decision_time
-            # if number of photons is between
-            # We continue to the next step
-            # At the final step we assign the number of acquired photons
-
-            if (lower_threshold > 0) and (pixel_photons < lower_threshold):
-                thresholds[row, col] = 0
-                # returned_photons[row, col] += (pixel_photons * pdt[row, col] / decision_time).astype(int)
+                value += effective[sprime, tprime] * footprint[sprime, tprime]
+            steps.append((i, decision_time, step))
+            if apply_policy(&c_policy, i, <int>detect_photons(&detection, &rng, value, decision_time),
+                            pdt_roi[row, col], decision_time, &pixel_photons, &label):
                 break
-            elif (upper_threshold > 0) and (pixel_photons > upper_threshold):
-                thresholds[row, col] = 2
-                returned_photons[row, col] += pixel_photons * pdt_roi[row, col] / decision_time
-                break
-            else:
-                thresholds[row, col] = 1
-                returned_photons[row, col] += pixel_photons
+        returned_photons[row, col] += pixel_photons
+        labels[row, col] = label
 
         # Bleaches the sample once the pixel was acquired
         if bleach:
-            for i in range(num_steps):
-                if pdts[i] > 0:
-                    if is_uniform:
-                        k_sted, k_ex = k_steds[i], k_exs[i]
-                    bleach_func(self, i_ex, i_sted, p_exs[i], p_steds[i],
-                                pdts[i], bleached_sub_datamaps_dict,
-                                row, col, h, w, mask, prob_ex, prob_sted, k_ex, k_sted)
+            for (i, decision_time, step) in steps:
+                _, k_ex, k_sted, step_prob_ex, step_prob_sted = step
+                if is_default_bleach:
+                    for (s, t) in mask:
+                        prob_ex[s, t] *= step_prob_ex[s, t]
+                        prob_sted[s, t] *= step_prob_sted[s, t]
+                else:
+                    bleach_func(self, i_ex, i_sted, p_ex_roi[row, col], SCALE_POWER[i] * p_sted_roi[row, col],
+                                decision_time, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex, prob_sted,
+                                k_ex, k_sted)
+            # The molecules are sampled from the stream of the pixel as in the compiled path
+            get_shared_rng()[0] = rng
             sample_func(self, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex, prob_sted)
 
+            # We reset the survival probabilty
             reset_prob(mask, prob_ex, prob_sted)
@@ -8,8 +8,9 @@ For use by FLClab (@CERVO) authorized people
 
 import numpy
 import numpy as np
-import scipy, scipy.constants, scipy.integrate
+import scipy, scipy.constants, scipy.integrate, scipy.signal
 
+import functools
 import math
 import random
 import warnings
@@ -82,6 +83,29 @@ def complex_quadrature(func, a, b, args):
     return real_integral[0] + 1j * imag_integral[0]
 
 
+def radial_quadrature(funcs, a, b, kr, order=64):
+    '''Integrate functions of :math:`\\theta` over :math:`[a, b]` for many values of :math:`kr` at once.
+
+    A fixed-order Gauss-Legendre quadrature is used such that every function is
+    evaluated once on a (len(kr), order) grid. The integrands of the beams
+    are smooth over the aperture of the objective, 64 nodes agree with the adaptive
+    Gauss-Kronrod quadrature of ``scipy.integrate.quad`` to a relative error below 1e-10.
+
+    :param funcs: A sequence of functions ``func(theta, kr)`` accepting arrays.
+    :param a: The lower bound of the integration.
+    :param b: The upper bound of the integration.
+    :param kr: A 1D array of the values of :math:`kr` for which to integrate.
+    :param order: The number of nodes of the quadrature.
+
+    :return: A tuple of 1D arrays (one per function) of the integrals for every *kr*.
+    '''
+    nodes, weights = numpy.polynomial.legendre.leggauss(order)
+    theta = (b - a) / 2 * nodes + (b + a) / 2
+    weights = weights * (b - a) / 2
+    kr = numpy.asarray(kr, dtype=numpy.float64)[:, numpy.newaxis]
+    return tuple(func(theta[numpy.newaxis, :], kr) @ weights for func in funcs)
+
+
 def fwhm(values):
     '''Compute the full width at half maximum of the Gaussian-shaped values.
 
@@ -239,18 +263,16 @@ def stack(datamap, data):
                      [0, 0, 0, 0],
                      [0, 0, 0, 0]])
 
+    The frame is computed in a single pass as the convolution of the *datamap* with
+    the *data*.
+
     :param datamap: A 2D array indicating how many data are positioned in every
-    :param data: A 2D array containing the data to replicate.
+    :param data: A 2D array containing the data to replicate. Axes have to be of odd lengths.
 
     :return: A 2D array shaped like *datamap*.
     '''
-    h_pad, w_pad = int(data.shape[0] / 2) * 2, int(data.shape[1] / 2) * 2
-    frame = numpy.zeros((datamap.shape[0] + h_pad, datamap.shape[1] + w_pad))
-    positions = numpy.where(datamap > 0)
-    numbers = datamap[positions]
-    for nb, y, x in zip(numbers, *positions):
-        frame[y:y+h_pad+1, x:x+w_pad+1] += data * nb
-    return frame[int(h_pad/2):-int(h_pad/2), int(w_pad/2):-int(w_pad/2)]
+    return scipy.signal.oaconvolve(numpy.asarray(datamap, dtype=numpy.float64),
+                                   numpy.asarray(data, dtype=numpy.float64), mode="same")
 
 
 def stack_btmod_definitive(datamap, data, data_pixelsize, img_pixelsize, pixel_list):
@@ -273,8 +295,12 @@ def stack_btmod_definitive(datamap, data, data_pixelsize, img_pixelsize, pixel_l
                      [0, 0, 0, 0],
                      [0, 0, 0, 0]])
 
+    Every position of the datamap receives the *data* centered on every pixel of the
+    *pixel_list*, which is computed in a single pass as the convolution of the scanned
+    pixels with the *data*.
+
     :param datamap: A 2D array indicating how many data are positioned in every
-    :param data: A 2D array containing the data to replicate.
+    :param data: A 2D array containing the data to replicate. Axes have to be of odd lengths.
     :param data_pixelsize: Length of a pixel in the datamap (m)
     :param img_pixelsize: Distance the laser moves in between each application of data. Must be a multiple of the
                           data_pixelsize (m)
@@ -282,85 +308,109 @@ def stack_btmod_definitive(datamap, data, data_pixelsize, img_pixelsize, pixel_l
 
     :return: A 2D array shaped like *datamap*.
     '''
-    filtered_pixel_list = pixel_list_filter(datamap, pixel_list, img_pixelsize, data_pixelsize)
-    h_pad, w_pad = int(data.shape[0] / 2) * 2, int(data.shape[1] / 2) * 2
-    modif_returned_array = numpy.zeros((datamap.shape[0] + h_pad, datamap.shape[1] + w_pad))
-    padded_datamap = numpy.pad(numpy.copy(datamap), h_pad // 2, mode="constant", constant_values=0)
+    filtered_pixel_list = numpy.array(pixel_list_filter(datamap, pixel_list, img_pixelsize, data_pixelsize),
+                                      dtype=numpy.int64).reshape(-1, 2)
+    scanned = numpy.zeros(datamap.shape)
+    numpy.add.at(scanned, (filtered_pixel_list[:, 0], filtered_pixel_list[:, 1]), 1)
+    received = scipy.signal.oaconvolve(scanned, numpy.asarray(data, dtype=numpy.float64), mode="same")
+    return received * datamap
+
+
+def correlate_effective(datamap, effective, shape=None):
+    '''Compute the intensity measured at every position of the laser in a single pass.
+
+    The intensity measured when the top left corner of the *effective* PSF is at
+    ``(row, col)`` is the sum of ``effective * datamap[row:row + h, col:col + w]``, which
+    is the valid correlation of the *datamap* with the *effective* PSF. The correlation
+    is computed with the overlap-add method and is equal to the pixel by pixel computation
+    up to floating point rounding, negative values due to rounding are clipped to 0.
 
-    for (row, col) in filtered_pixel_list:
-        modif_returned_array[row:row + h_pad + 1, col:col + w_pad + 1] += data * padded_datamap[row:row + h_pad + 1,
-                                                                                                col:col + w_pad + 1]
+    :param datamap: A 2D array of the number of molecules.
+    :param effective: A 2D array of the effective PSF.
+    :param shape: The (optional) number of rows and columns of laser positions that are
+                  needed. Only the required part of the *datamap* is then correlated.
 
-        # modif_returned_array[row:row + h_pad + 1, col:col + w_pad + 1] += data * datamap[row, col]
-    return modif_returned_array[int(h_pad / 2):-int(h_pad / 2), int(w_pad / 2):-int(w_pad / 2)]
+    :return: A 2D array of the measured intensity at every position of the laser.
+    '''
+    h, w = effective.shape
+    if shape is not None:
+        datamap = datamap[:shape[0] + h - 1, :shape[1] + w - 1]
+    correlation = scipy.signal.oaconvolve(numpy.asarray(datamap, dtype=numpy.float64),
+                                          effective[::-1, ::-1], mode="valid")
+    return numpy.maximum(correlation, 0.)
 
 
-def pixel_sampling(datamap, mode="all"):
+def pixel_sampling(datamap, mode="all", cell_size=8, ratio=1):
     '''
     Function to test different pixel sampling methods, instead of simply imaging pixel by pixel
 
+    The pixel lists are generated as int32 arrays of shape (N, 2) of the (row, col) positions which are passed as is to
+    the raster kernels.
+
     :param datamap: A 2D array of the data to be imaged, used for its shape.
     :param mode: A keyword to determine the order of pixels in the returned list. By default, all pixels are added in a
-                 raster scan (left to right, row by row) order.
-
-    :return: A list containing all the pixels in the order in which we want them to be imaged.
+                 raster scan (left to right, row by row) order. The available modes are
+
+                 * ``"all"``: raster scan of the pixels
+                 * ``"bidirectional"``: raster scan where every other row is scanned from right to left
+                 * ``"checkers"``: raster scan of the white cells of a checkerboard
+                 * ``"forsenCD"``: raster scan of the pixels containing molecules
+                 * ``"besides"``: the empty pixels surrounding the molecules
+    :param cell_size: The size of the cells of the checkerboard in ``"checkers"`` mode (pixels).
+    :param ratio: The number of pixels the laser moves in between each pixel of the ``"all"``, ``"bidirectional"`` and
+                  ``"checkers"`` modes.
+
+    :return: An int32 array of shape (N, 2) containing all the pixels in the order in which we want them to be imaged.
     '''
-    pixel_list = []
-    if mode == "all":
-        for row in range(datamap.shape[0]):
-            for col in range(datamap.shape[1]):
-                pixel_list.append((row, col))
-    elif mode == "checkers":
-        # TODO: ajouter checker_size comme param au lieu de hard codé ici
-        # TODO: regarder s'il y a une manière plus efficace de faire ça
-        checkers = numpy.zeros((datamap.shape[0], datamap.shape[1]))
-        cell_size = 8
-
-        even_row = True
-        cell_white = False
-        for row in range(0, checkers.shape[0], cell_size):
-            for col in range(0, checkers.shape[0], cell_size):
-                cell_white = not cell_white
-                if even_row:
-                    if cell_white:
-                        checkers[row:row + cell_size, col: col + cell_size] = 1
-                if not even_row:
-                    if not cell_white:
-                        checkers[row:row + cell_size, col: col + cell_size] = 1
-            even_row = not even_row
-
-        for row in range(datamap.shape[0]):
-            for col in range(datamap.shape[1]):
-                if checkers[row, col] == 1:
-                    pixel_list.append((row, col))
+    shape = datamap.shape[:2]
+    if mode in ("all", "bidirectional", "checkers"):
+        rows = numpy.arange(0, shape[0], ratio, dtype=numpy.int32)
+        cols = numpy.arange(0, shape[1], ratio, dtype=numpy.int32)
+        pixel_list = numpy.empty((len(rows), len(cols), 2), dtype=numpy.int32)
+        pixel_list[:, :, 0] = rows[:, numpy.newaxis]
+        pixel_list[:, :, 1] = cols
+        if mode == "bidirectional":
+            pixel_list[1::2, :, 1] = cols[::-1]
+        pixel_list = pixel_list.reshape(-1, 2)
+        if mode == "checkers":
+            white = (pixel_list[:, 0] // cell_size + pixel_list[:, 1] // cell_size) % 2 == 0
+            pixel_list = pixel_list[white]
     elif mode == "forsenCD":
-        positions = numpy.where(datamap > 0)
-        pixel_list = list(zip(positions[0], positions[1]))
+        pixel_list = numpy.argwhere(datamap > 0)
     elif mode == "besides":
-        pixel_list = []
-        positions = numpy.where(datamap > 0)
-        molecules = list(zip(positions[0], positions[1]))
-        padded_datamap = numpy.pad(numpy.zeros(datamap.shape), 1, mode="constant")
-        verif_matrix = numpy.zeros(datamap.shape)
-        for (row, col) in molecules:
-            interim_pixel_list = []
-            xd = numpy.where(datamap[row-1:row+2, col-1:col+2] == 0)
-            interim_pixel_list.append(list(zip(xd[0], xd[1])))
-            interim_pixel_list = interim_pixel_list[0]
-            for pixel in interim_pixel_list:
-                if verif_matrix[pixel[0] + row - 1, pixel[1] + col - 1] == 0:
-                    pixel_list.append((pixel[0] + row - 1, pixel[1] + col - 1))
-                verif_matrix[pixel[0] + row - 1, pixel[1] + col - 1] = 1
+        molecules = numpy.argwhere(datamap > 0)
+        # molecules on the first row or column have no neighbours (slicing of the original implementation)
+        molecules = molecules[(molecules[:, 0] > 0) & (molecules[:, 1] > 0)]
+        offsets = numpy.stack(numpy.meshgrid([-1, 0, 1], [-1, 0, 1], indexing="ij"), axis=-1).reshape(-1, 2)
+        pixel_list = (molecules[:, numpy.newaxis, :] + offsets[numpy.newaxis, :, :]).reshape(-1, 2)
+        pixel_list = pixel_list[(pixel_list[:, 0] < shape[0]) & (pixel_list[:, 1] < shape[1])]
+        pixel_list = pixel_list[datamap[pixel_list[:, 0], pixel_list[:, 1]] == 0]
+        _, first = numpy.unique(pixel_list[:, 0] * shape[1] + pixel_list[:, 1], return_index=True)
+        pixel_list = pixel_list[numpy.sort(first)]
     else:
-        print(f"list_mode = {mode} is not valid, retard")
+        raise ValueError(f"list_mode = {mode} is not valid")
+
+    return numpy.ascontiguousarray(pixel_list, dtype=numpy.int32).reshape(-1, 2)
 
-    return pixel_list
+
+def as_pixel_array(pixel_list):
+    '''
+    Converts a pixel list to the int32 array of shape (N, 2) which is iterated on by the raster kernels.
+
+    :param pixel_list: A sequence of (row, col) tuples or an array of shape (N, 2).
+
+    :return: A C-contiguous int32 array of shape (N, 2). No copy is made if *pixel_list* already is such an array.
+    '''
+    return numpy.ascontiguousarray(numpy.reshape(pixel_list, (-1, 2)), dtype=numpy.int32)
 
 
+@functools.lru_cache(maxsize=128)
 def pxsize_comp2(img_pixelsize, data_pixelsize):
     """
     Try number 2 for my float comparison function that hopefully will give the right values this time :)
 
+    The pixel sizes of the calls are cached since the comparison goes through their string representation.
+
     :param img_pixelsize: Acquisition pixel size. Has to be a multiple of data_pixelsize (m).
     :param data_pixelsize: Raw data pixelsize (m).
 
@@ -420,17 +470,10 @@ def pxsize_grid(img_pixelsize, data_pixelsize, datamap):
     :param data_pixelsize: Size of a pixel of the datamap (m).
     :param datamap: Raw molecule dispotion on which we wish to do an acquisition.
     
-    :return: A list of the pixels which can be iterated on (?)
+    :return: An int32 array of shape (N, 2) of the pixels which can be iterated on, in raster scan order
     """
-    img_pixelsize_int, data_pixelsize_int = pxsize_comp2(img_pixelsize, data_pixelsize)
-    ratio = int(img_pixelsize_int / data_pixelsize_int)
-
-    valid_pixels = []
-    for row in range(0, datamap.shape[0], ratio):
-        for col in range(0, datamap.shape[1], ratio):
-            valid_pixels.append((row, col))
-
-    return valid_pixels
+    ratio = pxsize_ratio(img_pixelsize, data_pixelsize)
+    return pixel_sampling(datamap, mode="all", ratio=ratio)
 
 
 def pxsize_ratio(img_pixelsize, data_pixelsize):
@@ -467,49 +510,50 @@ def pixel_list_filter(datamap, pixel_list, img_pixelsize, data_pixelsize, output
     Function to pre-filter a pixel list. Depending on the ratio between the data_pixelsize and acquisition pixelsize,
     a certain number of pixels must be skipped between laser applications.
     
-    :param pixel_list: The list of pixels passed to the acquisition function, which needs to be filtered
+    :param pixel_list: The list of pixels passed to the acquisition function, which needs to be filtered. Either a
+                       sequence of (row, col) tuples or an array of shape (N, 2).
     :param img_pixelsize: The acquisition pixelsize (m)
     :param data_pixelsize: The data pixelsize (m)
     :param output_empty: Bool to allow (or not) this function to return an empty pixel list
     
-    :return: A filtered version of the input pixel_list, from which the pixels which can't be iterated over due to the
-              pixel sizes have been removed
+    :return: A filtered version of the input pixel_list as an int32 array of shape (N, 2), from which the pixels which
+             can't be iterated over due to the pixel sizes have been removed
     """
     # figure out valid pixels to iterate on based on ratio between pixel sizes
     # imagine the laser is fixed on a grid, which is determined by the ratio
-    valid_pixels_grid = pxsize_grid(img_pixelsize, data_pixelsize, datamap)
+    ratio = pxsize_ratio(img_pixelsize, data_pixelsize)
+    shape = datamap.shape[:2]
 
-    # if no pixel_list is passed, use valid_pixels_grid to figure out which pixels to iterate on
-    # if pixel_list is passed, keep only those which are also in valid_pixels_grid
+    # if no pixel_list is passed, use the grid of valid pixels to figure out which pixels to iterate on
+    # if pixel_list is passed, keep only those which are also on the grid, in the order of their first occurrence
     if pixel_list is None:
-        pixel_list = valid_pixels_grid
-    else:
-        valid_pixels_grid_matrix = numpy.zeros(datamap.shape)
-        nb_valid_pixels = 0
-        for (row, col) in valid_pixels_grid:
-            valid_pixels_grid_matrix[row, col] = 1
-            nb_valid_pixels += 1
-        pixel_list_matrix = numpy.zeros(datamap.shape)
-        for idx, (row, col) in enumerate(pixel_list):
-            pixel_list_matrix[row, col] += idx + 1
-            if row == datamap.shape[0] - 1 and col == datamap.shape[1] - 1:
-                break
-        final_valid_pixels_matrix = pixel_list_matrix * valid_pixels_grid_matrix
-        if numpy.array_equal(final_valid_pixels_matrix, numpy.zeros(datamap.shape)):
-            if output_empty:
-                return pixel_list
-            else:
-                warnings.warn(" \nNo pixels in the list passed is valid given the ratio between pixel sizes, \n"
-                              "Iterating on valid pixels in a raster scan instead.")
-                pixel_list = valid_pixels_grid  # itérer sur les pixels valides seulement
-        else:
-            pixel_list_interim = numpy.argsort(final_valid_pixels_matrix, axis=None)
-            pixel_list_interim = numpy.unravel_index(pixel_list_interim, datamap.shape)
-            pixel_list = [(pixel_list_interim[0][i], pixel_list_interim[1][i])
-                          for i in range(len(pixel_list_interim[0]))]
-            pixel_list = pixel_list[-numpy.count_nonzero(final_valid_pixels_matrix):]
-
-    return pixel_list
+        return pixel_sampling(datamap, mode="all", ratio=ratio)
+
+    pixels = numpy.reshape(pixel_list, (-1, 2))
+    # the pixels after the bottom right pixel are not acquired
+    last = numpy.flatnonzero((pixels[:, 0] == shape[0] - 1) & (pixels[:, 1] == shape[1] - 1))
+    if len(last) > 0:
+        pixels = pixels[:last[0] + 1]
+    rows, cols = pixels[:, 0].astype(numpy.intp), pixels[:, 1].astype(numpy.intp)
+    valid = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    if ratio > 1:
+        valid &= (rows % ratio == 0) & (cols % ratio == 0)
+    if not valid.all():
+        pixels, rows, cols = pixels[valid], rows[valid], cols[valid]
+    # a pixel which is listed many times is acquired at its first occurrence
+    linear = rows * shape[1] + cols
+    if len(linear) > 0 and numpy.bincount(linear, minlength=shape[0] * shape[1]).max() > 1:
+        _, first = numpy.unique(linear, return_index=True)
+        pixels = pixels[numpy.sort(first)]
+
+    if len(pixels) == 0:
+        if output_empty:
+            return pixel_list
+        warnings.warn(" \nNo pixels in the list passed is valid given the ratio between pixel sizes, \n"
+                      "Iterating on valid pixels in a raster scan instead.")
+        return pixel_sampling(datamap, mode="all", ratio=ratio)
+
+    return numpy.ascontiguousarray(pixels, dtype=numpy.int32)
 
 
 def symmetry_verifier(array, direction="vertical", plot=False):
@@ -693,7 +737,7 @@ def molecules_survival(pre_bleach, post_bleach):
     return numpy.sum(post_bleach) / numpy.sum(pre_bleach)
 
 
-def float_to_array_verifier(float_or_array, shape):
+def float_to_array_verifier(float_or_array, shape, copy=True):
     """
     Verify if a given input is a float or an array. 
     
@@ -703,18 +747,127 @@ def float_to_array_verifier(float_or_array, shape):
     
     :param float_or_array: Either a float or an array containing floats
     :param shape: The shape we want for our array (tuple)
+    :param copy: Whether a new array is returned. Otherwise a float is broadcast to a read-only array of shape (shape)
+                 without allocation and an array is returned as is.
    
     :return: An array of the appropriate shape
     """
     if isinstance(float_or_array, (float, numpy.floating)):
+        if not copy:
+            return numpy.broadcast_to(numpy.float64(float_or_array), shape)
         returned_array = numpy.ones(shape) * float_or_array
     elif type(float_or_array) is numpy.ndarray and shape == float_or_array.shape:
-        returned_array = numpy.copy(float_or_array)
+        returned_array = numpy.copy(float_or_array) if copy else float_or_array
     else:
         raise TypeError("Has to be either a float or an array of same shape as the ROI")
     return returned_array
 
 
+# Types of the molecule counts of the datamaps, from the most compact, for which the raster kernels are compiled
+COUNT_DTYPES = raster.COUNT_DTYPES
+
+
+def promote_counts(dtype, counts):
+    """
+    Finds the type in which molecule counts are stored.
+
+    The counts are stored in `dtype`, which is promoted to the next type of `COUNT_DTYPES` only when a count does
+    not fit in it.
+
+    :param dtype: The requested type, one of `COUNT_DTYPES`
+    :param counts: An array of the counts to store
+
+    :return: The type of the stored counts
+    """
+    dtype = numpy.dtype(dtype)
+    if dtype not in COUNT_DTYPES:
+        raise ValueError(f"The molecule counts must be stored as one of {[str(d) for d in COUNT_DTYPES]}, not {dtype}")
+    counts = numpy.asarray(counts)
+    # The counts of a type cast safely to dtype always fit, without reading them (e.g. from a numpy.memmap)
+    if (counts.size == 0) or numpy.can_cast(counts.dtype, dtype):
+        return dtype
+    low, high = counts.min(), counts.max()
+    for candidate in COUNT_DTYPES[COUNT_DTYPES.index(dtype):]:
+        info = numpy.iinfo(candidate)
+        if (info.min <= low) and (high <= info.max):
+            return candidate
+    raise OverflowError(f"The molecule counts in [{low}, {high}] do not fit in {COUNT_DTYPES[-1]}")
+
+
+def as_counts(counts, dtype=numpy.int32, copy=True):
+    """
+    Casts an array of molecule counts to the type in which they are stored (see `promote_counts`).
+
+    :param counts: An array of the counts
+    :param dtype: The requested type, one of `COUNT_DTYPES`
+    :param copy: Whether a new array is returned. Otherwise an array of the type is returned as is.
+
+    :return: An array of the counts
+    """
+    counts = numpy.asarray(counts)
+    return counts.astype(promote_counts(dtype, counts), copy=copy)
+
+
+def add_counts(*counts):
+    """
+    Sums arrays of molecule counts without overflow.
+
+    The sum is stored in the largest type of the arrays, promoted if a count does not fit in it (see
+    `promote_counts`). Arrays which are not of `COUNT_DTYPES`, e.g. floats, are summed as is.
+
+    :param counts: The arrays of the counts
+
+    :return: An array of the sum of the counts
+    """
+    if not all(numpy.asarray(array).dtype in COUNT_DTYPES for array in counts):
+        return sum(counts)
+    dtype = numpy.result_type(*counts)
+    total = numpy.asarray(counts[0]).astype(numpy.int64)
+    for array in counts[1:]:
+        total += array
+    return as_counts(total, dtype, copy=False)
+
+
+def rng_key(seed=None):
+    """
+    Converts a seed to the key of the random generator of the raster kernels.
+
+    The random variates of every pixel are drawn from a counter-based generator keyed by this key and the index of
+    the pixel in the pixel list, such that the acquisitions are reproducible whatever the number of threads or
+    processes. Two acquisitions with the same key therefore draw the same variates, even on different pixel lists.
+    Independent acquisitions, e.g. the workers generating a dataset, should use independent seeds such as the children
+    of ``numpy.random.SeedSequence.spawn``, and the successive acquisitions of a seed, e.g. the frames of a time series
+    or the partial scans of an interrupted acquisition, the seeds of their index (see :func:`acquisition_seed`).
+
+    :param seed: ``None`` for a key from the entropy of the OS, an int, a ``numpy.random.SeedSequence`` or a
+                 ``numpy.random.Generator`` from which the key is drawn
+    
+    :return: An int in [0, 2**64)
+    """
+    if isinstance(seed, numpy.random.Generator):
+        return int(seed.integers(2**64, dtype=numpy.uint64))
+    if not isinstance(seed, numpy.random.SeedSequence):
+        seed = numpy.random.SeedSequence(seed)
+    return int(seed.generate_state(1, dtype=numpy.uint64)[0])
+
+
+def acquisition_seed(seed, acquisition_id):
+    """
+    Returns the seed of an acquisition of a series of acquisitions made with the same seed.
+
+    The key of the seed (see :func:`rng_key`) is mixed with the index of the acquisition, such that the acquisitions of
+    a series draw independent streams while the series stays reproducible.
+
+    :param seed: ``None``, an int, a ``numpy.random.SeedSequence`` or a ``numpy.random.Generator``
+    :param acquisition_id: The index of the acquisition in the series, e.g. a counter of the acquisitions
+
+    :return: The seed itself for the acquisition 0 or a ``None`` seed, otherwise a ``numpy.random.SeedSequence``
+    """
+    if (not acquisition_id) or (seed is None):
+        return seed
+    return numpy.random.SeedSequence([rng_key(seed), acquisition_id])
+
+
 def dict_write_func(file, dictio):
     """
     Write a dict to a text file in a good way :)
@@ -1331,22 +1484,14 @@ def generate_raster_pixel_list(n_pixels_to_add, starting_pixel, img):
     :param starting_pixel: The starting point of our raster scan
     :param img: the img in which the raster scan occurs
     
-    :return: A pixel list for the raster scan starting at starting_pixel
+    :return: An int32 array of shape (N, 2) of the pixels of the raster scan starting at starting_pixel
     """
     if starting_pixel[0] >= img.shape[0] or starting_pixel[1] >= img.shape[1]:
         raise ValueError(f"starting pixel {starting_pixel} must be within img bounds (of shape {img.shape})")
-    return_list = []
-    current_idx = starting_pixel
-    for i in range(n_pixels_to_add):
-        return_list.append(tuple(current_idx))
-        current_idx[1] += 1
-        if current_idx[1] >= img.shape[1]:
-            current_idx[1] = 0
-            current_idx[0] += 1
-        if current_idx[0] >= img.shape[0]:
-            current_idx[0] = 0
-
-    return return_list
+    # the raster scan wraps around to the top left pixel after the bottom right pixel
+    start = starting_pixel[0] * img.shape[1] + starting_pixel[1]
+    indices = (start + numpy.arange(n_pixels_to_add)) % (img.shape[0] * img.shape[1])
+    return numpy.stack(numpy.divmod(indices, img.shape[1]), axis=-1).astype(numpy.int32)
 
 
 def set_starting_pixel(previous_pixel, image_shape, ratio=1):
@@ -1495,7 +1640,7 @@ def action_execution(action_selected, frame_shape, starting_pixel, pxsize, datam
         pixel_list = pixel_list_filter(frozen_datamap, pixel_list, pxsize, datamap.pixelsize, output_empty=True)
 
         # Cut elements before the starting pixel from the list
-        start_idx = pixel_list.index(tuple(starting_pixel))
+        start_idx = numpy.flatnonzero(numpy.all(pixel_list == starting_pixel, axis=1))[0]
         pixel_list = pixel_list[start_idx:]
         pixel_list = pixel_list[:microscope.pixel_bank]
 
@@ -1548,7 +1693,7 @@ def action_execution_2(action_selected, frame_shape, starting_pixel, pxsize, dat
         pixel_list = pixel_list_filter(frozen_datamap, pixel_list, pxsize, datamap.pixelsize, output_empty=True)
 
         # Cut elements before the starting pixel from the list
-        start_idx = pixel_list.index(tuple(starting_pixel))
+        start_idx = numpy.flatnonzero(numpy.all(pixel_list == starting_pixel, axis=1))[0]
         pixel_list = pixel_list[start_idx:]
         pixel_list = pixel_list[:microscope.pixel_bank]
 
@@ -1604,7 +1749,7 @@ def action_execution_g(action_selected, frame_shape, starting_pixel, pxsize, dat
         pixel_list = pixel_list_filter(frozen_datamap, pixel_list, pxsize, datamap.pixelsize, output_empty=True)
 
         # Cut elements before the starting pixel from the list
-        start_idx = pixel_list.index(tuple(starting_pixel))
+        start_idx = numpy.flatnonzero(numpy.all(pixel_list == starting_pixel, axis=1))[0]
         pixel_list = pixel_list[start_idx:]
         pixel_list = pixel_list[:microscope.pixel_bank]
 
@@ -1,5 +1,12 @@
 
+import os
+import sys
+import tempfile
+
 from distutils.core import setup, Extension
+from distutils.ccompiler import new_compiler
+from distutils.errors import CompileError, LinkError
+from distutils.sysconfig import customize_compiler
 from Cython.Build import cythonize
 from Cython.Compiler import Options
 
@@ -14,10 +21,38 @@ except ImportError:
     HAS_NUMPY = False
 
 
+def get_openmp_flags():
+    """
+    Returns the compile and link flags of OpenMP if the compiler supports it. Without OpenMP, the
+    parallel loops of the extensions are executed serially.
+
+    The detection can be disabled by setting the environment variable ``PYSTED_NO_OPENMP``.
+    """
+    if os.environ.get("PYSTED_NO_OPENMP"):
+        return [], []
+    if sys.platform == "win32":
+        return ["/openmp"], []
+
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "test_openmp.c")
+        with open(source, "w") as file:
+            file.write("#include <omp.h>\nint main(void) { return omp_get_max_threads() < 1; }\n")
+        try:
+            objects = compiler.compile([source], output_dir=tmpdir, extra_postargs=["-fopenmp"])
+            compiler.link_executable(objects, os.path.join(tmpdir, "test_openmp"), extra_postargs=["-fopenmp"])
+        except (CompileError, LinkError):
+            return [], []
+    return ["-fopenmp"], ["-fopenmp"]
+
+OPENMP_COMPILE_ARGS, OPENMP_LINK_ARGS = get_openmp_flags()
+
 ext_modules = [
     Extension("pysted.cUtils", ["pysted/cUtils.c"], include_dirs=INCLUDE_DIRS),
     Extension("pysted._draw", ["pysted/_draw.pyx"], include_dirs=INCLUDE_DIRS),
-    Extension("pysted.raster", ["pysted/raster.pyx"], include_dirs=INCLUDE_DIRS),
+    Extension("pysted.raster", ["pysted/raster.pyx"], include_dirs=INCLUDE_DIRS,
+              extra_compile_args=OPENMP_COMPILE_ARGS, extra_link_args=OPENMP_LINK_ARGS),
     Extension("pysted.bleach_funcs", ["pysted/bleach_funcs.pyx"], include_dirs=INCLUDE_DIRS)
 ]
 for ext_module in ext_modules: